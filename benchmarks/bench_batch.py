@@ -0,0 +1,88 @@
+"""
+Configuring many interfaces one ioctl at a time against one batch.Batch.
+
+    sudo python -m benchmarks.bench_batch [pairs]
+
+Creates `pairs` (default 500) veth pairs in a scratch network namespace,
+then brings every interface up and gives it an IPv4 address, first with
+Interface.up()/ip/netmask and then with a single Batch, and reports the
+time taken by each. The namespace is deleted afterwards.
+"""
+import subprocess
+import sys
+import time
+
+from pynetlinux import batch
+from pynetlinux import context
+from pynetlinux import ifconfig
+
+NETNS = 'pynl_bench'
+
+
+def setup(pairs):
+    subprocess.check_call(['ip', 'netns', 'add', NETNS])
+    cmds = ''.join('link add bv%da type veth peer name bv%db\n' % (i, i)
+                   for i in range(pairs))
+    proc = subprocess.Popen(['ip', '-n', NETNS, '-batch', '-'],
+                            stdin=subprocess.PIPE)
+    proc.communicate(cmds.encode('ascii'))
+    names = []
+    for i in range(pairs):
+        names.extend([b'bv%da' % i, b'bv%db' % i])
+    return names
+
+
+def address(i):
+    return '10.%d.%d.1' % (i // 256, i % 256)
+
+
+def per_interface(ctx, names):
+    for i, name in enumerate(names):
+        iface = ifconfig.Interface(name, ctx)
+        iface.up()
+        iface.ip = address(i)
+        iface.netmask = 24
+
+
+def batched(ctx, names):
+    b = batch.Batch(ctx)
+    for i, name in enumerate(names):
+        b.up(name)
+        b.add_address(name, address(i), 24, replace=True)
+    for result in b.commit():
+        if result.error is not None:
+            raise result.error
+
+
+def reset():
+    subprocess.check_call(['ip', '-n', NETNS, 'addr', 'flush', 'scope',
+                           'global'])
+    subprocess.check_call(['ip', '-n', NETNS, 'link', 'set', 'group',
+                           'default', 'down'])
+
+
+def main():
+    pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    names = setup(pairs)
+    try:
+        ctx = context.Context(netns=NETNS)
+        # Warm the name cache so both cases only pay for the changes
+        for name in names:
+            ctx.index_cache.index(name)
+
+        print("%-14s %10s %12s" % ("method", "total (ms)", "per if (us)"))
+        for label, func in [("per-interface", per_interface),
+                            ("batch", batched)]:
+            reset()
+            start = time.time()
+            func(ctx, names)
+            elapsed = time.time() - start
+            print("%-14s %10.1f %12.1f" % (label, elapsed * 1e3,
+                                           elapsed / len(names) * 1e6))
+        ctx.close()
+    finally:
+        subprocess.call(['ip', 'netns', 'del', NETNS])
+
+
+if __name__ == '__main__':
+    main()
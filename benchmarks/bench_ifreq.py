@@ -0,0 +1,58 @@
+"""
+Per-call latency of ifreq ioctls: the original struct.pack/unpack code
+against the precompiled codecs and reusable buffer in pynetlinux.ifreq.
+
+    python -m benchmarks.bench_ifreq [calls]
+
+Calls is_up() over the system's interfaces, round-robin, until `calls`
+(default 5000) calls have been made, and reports the best of several runs.
+"""
+import fcntl
+import struct
+import sys
+import timeit
+
+from pynetlinux import ifconfig
+
+
+def is_up_legacy(name):
+    ''' Interface.is_up() before the codec layer. '''
+    ifreq = struct.pack('16sh', name, 0)
+    flags = struct.unpack('16sh', fcntl.ioctl(ifconfig.sockfd,
+                                              ifconfig.SIOCGIFFLAGS, ifreq))[1]
+    return bool(flags & ifconfig.IFF_UP)
+
+
+def get_index_legacy(name):
+    ''' Interface.get_index() before the codec layer. '''
+    ifreq = struct.pack('16si', name, 0)
+    res = fcntl.ioctl(ifconfig.sockfd, ifconfig.SIOCGIFINDEX, ifreq)
+    return struct.unpack("16si", res)[1]
+
+
+def bench(func, args, repeat=5):
+    best = min(timeit.repeat(lambda: [func(a) for a in args], number=1,
+                             repeat=repeat))
+    return best / len(args) * 1e9
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    ifs = ifconfig.list_ifs(physical=False)
+    ifs = [ifs[i % len(ifs)] for i in range(calls)]
+    names = [i.name for i in ifs]
+
+    cases = [
+        ("is_up", is_up_legacy, names, lambda i: i.is_up(), ifs),
+        ("get_index", get_index_legacy, names, lambda i: i.get_index(), ifs),
+    ]
+    print("%-10s %12s %12s %8s" % ("call", "before (ns)", "after (ns)", "speedup"))
+    for name, before, before_args, after, after_args in cases:
+        t_before = bench(before, before_args)
+        t_after = bench(after, after_args)
+        print("%-10s %12.0f %12.0f %7.2fx" % (name, t_before, t_after,
+                                             t_before / t_after))
+
+
+if __name__ == '__main__':
+    main()
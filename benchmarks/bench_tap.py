@@ -0,0 +1,337 @@
+"""
+Tap throughput and latency across frame sizes and I/O modes.
+
+    sudo python -m benchmarks.bench_tap [--frames N] [--sizes 64,512,1514]
+        [--modes blocking,nonblocking,batched] [--burst N] [--output FILE]
+
+Creates two taps joined by a bridge in a scratch network namespace. Frames
+are written to one tap in bursts and read back from the other, so each frame
+passes through one tap write and one tap read:
+
+    blocking     blocking taps, write() and read() one frame per call
+    nonblocking  non-blocking taps, write() and read() one frame per call,
+                 waiting in select() when nothing is ready
+    batched      non-blocking taps, write_batch() and read_batch()
+
+For each mode and frame size it reports:
+
+    * packets and gigabits per second through the pair
+    * the write-side and read-side packet rates
+    * percentiles of the time from writing a frame to reading it, measured
+      separately with one frame in flight at a time. Percentiles for the
+      bursts, which include time queued behind other frames, are reported
+      as burst_latency_us.
+    * process CPU time per packet, user plus system. The system part
+      includes the kernel forwarding frames across the bridge.
+
+Frames still missing after a second are counted as lost. Results are
+written as JSON, together with the kernel, Python and git revision, so runs
+can be compared across versions. A summary table goes to stderr. The
+namespace is deleted afterwards.
+"""
+import argparse
+import errno
+import json
+import os
+import platform
+import resource
+import select
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+from pynetlinux import brctl
+from pynetlinux import context
+from pynetlinux import ifconfig
+from pynetlinux import tap
+
+NETNS = 'pynl_bench'
+BRIDGE = b'pynlbr0'
+SIZES = [64, 512, 1514]
+# Local experimental ethertype; each frame carries the time it was sent
+ETHERTYPE = struct.pack('!H', 0x88b5)
+HEADER = b'\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02' + ETHERTYPE
+STAMP = struct.Struct('!d')
+MIN_SIZE = len(HEADER) + STAMP.size
+ETH_HLEN = 14
+# Seconds to wait for the rest of a burst before counting it lost
+TIMEOUT = 1.0
+PERCENTILES = [50, 90, 99, 99.9]
+
+_clock = time.perf_counter
+
+
+class Timeout(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise Timeout()
+
+
+def make_frames(count, size):
+    return [bytearray(HEADER + b'\x00' * (size - len(HEADER)))
+            for _i in range(count)]
+
+
+def _record(frame, latencies, now):
+    ''' Note the latency of one of our frames; ignore anything else the
+        kernel sends the tap. '''
+    if frame[12:14] != ETHERTYPE:
+        return False
+    latencies.append(now - STAMP.unpack_from(frame, len(HEADER))[0])
+    return True
+
+
+def write_single(t, frames):
+    for frame in frames:
+        STAMP.pack_into(frame, len(HEADER), _clock())
+        t.write(frame)
+
+
+def write_batched(t, frames):
+    now = _clock()
+    for frame in frames:
+        STAMP.pack_into(frame, len(HEADER), now)
+    t.write_batch(frames)
+
+
+def read_blocking(t, count, bufsize, latencies):
+    got = 0
+    signal.setitimer(signal.ITIMER_REAL, TIMEOUT)
+    try:
+        while got < count:
+            frame = t.read(bufsize)
+            if _record(frame, latencies, _clock()):
+                got += 1
+    except Timeout:
+        pass
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return got
+
+
+def read_nonblocking(t, count, bufsize, latencies):
+    got = 0
+    while got < count:
+        try:
+            frame = t.read(bufsize)
+        except EnvironmentError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            if not select.select([t], [], [], TIMEOUT)[0]:
+                break
+            continue
+        if _record(frame, latencies, _clock()):
+            got += 1
+    return got
+
+
+def read_batched(t, count, bufsize, latencies):
+    got = 0
+    while got < count:
+        frames = t.read_batch()
+        if not frames:
+            if not select.select([t], [], [], TIMEOUT)[0]:
+                break
+            continue
+        now = _clock()
+        for frame in frames:
+            if _record(frame, latencies, now):
+                got += 1
+    return got
+
+
+# mode: (blocking taps, writer, reader)
+MODES = {
+    'blocking': (True, write_single, read_blocking),
+    'nonblocking': (False, write_single, read_nonblocking),
+    'batched': (False, write_batched, read_batched),
+}
+
+
+def percentile(values, pct):
+    ''' Nearest-rank percentile of sorted values. '''
+    if not values:
+        return None
+    return values[int(round(pct / 100.0 * (len(values) - 1)))]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _latency(latencies):
+    ''' Percentiles of latencies, in microseconds. '''
+    latencies.sort()
+    latency = dict(('p%g' % pct, percentile(latencies, pct) * 1e6
+                    if latencies else None) for pct in PERCENTILES)
+    latency['max'] = latencies[-1] * 1e6 if latencies else None
+    return latency
+
+
+def run(mode, size, tx, rx, count, burst):
+    _blocking, write, read = MODES[mode]
+    frames = make_frames(burst, size)
+    bufsize = size + tap.FRAME_OVERHEAD
+    # Warm up, e.g. allocating read_batch()'s FramePool
+    write(tx, frames)
+    read(rx, burst, bufsize, [])
+
+    latencies = []
+    sent = received = 0
+    write_time = read_time = 0.0
+    cpu = cpu_time()
+    begin = _clock()
+    while sent < count:
+        batch = frames[:min(burst, count - sent)]
+        start = _clock()
+        write(tx, batch)
+        written = _clock()
+        received += read(rx, len(batch), bufsize, latencies)
+        read_time += _clock() - written
+        write_time += written - start
+        sent += len(batch)
+    elapsed = _clock() - begin
+    cpu = cpu_time() - cpu
+    return {
+        'mode': mode,
+        'size': size,
+        'sent': sent,
+        'received': received,
+        'lost': sent - received,
+        'seconds': elapsed,
+        'pps': received / elapsed,
+        'gbps': received * size * 8 / elapsed / 1e9,
+        'write_pps': sent / write_time,
+        'read_pps': received / read_time if read_time else None,
+        'burst_latency_us': _latency(latencies),
+        'cpu_ns_per_packet': cpu / received * 1e9 if received else None,
+    }
+
+
+def ping(mode, size, tx, rx, count):
+    ''' Return latency percentiles with one frame in flight. '''
+    _blocking, write, read = MODES[mode]
+    frames = make_frames(1, size)
+    bufsize = size + tap.FRAME_OVERHEAD
+    latencies = []
+    for _i in range(count):
+        write(tx, frames)
+        read(rx, 1, bufsize, latencies)
+    return _latency(latencies)
+
+
+def open_pair(ctx, bridge, blocking, mtu, txqlen):
+    pair = []
+    for _i in range(2):
+        t = tap.Tap(blocking=blocking, ctx=ctx)
+        t.set_link(mtu=mtu, txqlen=txqlen)
+        bridge.addif(t)
+        t.up()
+        pair.append(t)
+    return pair
+
+
+def revision():
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (EnvironmentError, subprocess.CalledProcessError):
+        return None
+    return out.decode('ascii').strip()
+
+
+def sizes(text):
+    values = [int(s) for s in text.split(',')]
+    if min(values) < MIN_SIZE:
+        raise argparse.ArgumentTypeError("frames are at least %d bytes" %
+                                         MIN_SIZE)
+    return values
+
+
+def modes(text):
+    values = text.split(',')
+    for mode in values:
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError("unknown mode %r" % mode)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tap throughput and latency between two bridged taps.")
+    parser.add_argument('--frames', type=int, default=100000,
+                        help="frames per mode and size (default 100000)")
+    parser.add_argument('--sizes', type=sizes, default=SIZES,
+                        help="comma-separated frame sizes in bytes, "
+                        "without FCS (default 64,512,1514)")
+    parser.add_argument('--modes', type=modes, default=list(MODES),
+                        help="comma-separated modes (default all)")
+    parser.add_argument('--burst', type=int, default=256,
+                        help="frames written before reading (default 256)")
+    parser.add_argument('--pings', type=int, default=10000,
+                        help="frames sent one at a time to measure latency "
+                        "(default 10000)")
+    parser.add_argument('--output', help="write the JSON here, not stdout")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGALRM, _alarm)
+    mtu = max(1500, max(args.sizes) - ETH_HLEN)
+    results = []
+    subprocess.check_call(['ip', 'netns', 'add', NETNS])
+    try:
+        ctx = context.Context(netns=NETNS)
+        bridge = brctl.addbr(BRIDGE, ctx)
+        ifconfig.Interface(BRIDGE, ctx).up()
+        for mode in args.modes:
+            tx, rx = open_pair(ctx, bridge, MODES[mode][0], mtu,
+                               args.burst * 4)
+            for size in args.sizes:
+                result = run(mode, size, tx, rx, args.frames, args.burst)
+                result['latency_us'] = ping(mode, size, tx, rx, args.pings)
+                results.append(result)
+            tx.close()
+            rx.close()
+        ctx.close()
+    finally:
+        subprocess.call(['ip', 'netns', 'del', NETNS])
+
+    sys.stderr.write("%-12s %6s %10s %8s %10s %10s %10s %8s\n" % (
+        "mode", "size", "packets/s", "Gbit/s", "p50 us", "p99 us",
+        "CPU ns/pkt", "lost"))
+    for r in results:
+        sys.stderr.write("%-12s %6d %10.0f %8.3f %10.1f %10.1f %10.0f %8d\n"
+                         % (r['mode'], r['size'], r['pps'], r['gbps'],
+                            r['latency_us']['p50'] or 0,
+                            r['latency_us']['p99'] or 0,
+                            r['cpu_ns_per_packet'] or 0, r['lost']))
+
+    report = {
+        'benchmark': 'tap',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'revision': revision(),
+        'kernel': platform.release(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'frames': args.frames,
+        'burst': args.burst,
+        'pings': args.pings,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
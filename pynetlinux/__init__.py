@@ -2,7 +2,14 @@
 #   import pylinux
 # does a reasonable thing.
 
+from . import batch
+from . import bpf
 from . import brctl
+from . import ethtool
 from . import ifconfig
+from . import monitor
+from . import netlink
 from . import tap
 from . import route
+from . import sampler
+from . import steering
@@ -0,0 +1,692 @@
+"""
+asyncio equivalents of the ifconfig, brctl and route operations, done over a
+non-blocking rtnetlink socket registered with the event loop.
+
+Requests are pipelined: every call sends its message straight away and waits
+for the reply with its own sequence number, so many operations can be in
+flight on one socket at a time. Dumps are the exception: the kernel runs one
+dump per socket at a time, so they wait their turn.
+
+Taps get an asyncio transport (TapTransport, driving a TapProtocol) and a
+streams-style async iterator of frames (TapStream). Python 3 only.
+"""
+import asyncio
+import collections
+import errno
+import os
+import socket
+import weakref
+
+from . import context
+from . import ifconfig
+from . import netlink
+from . import tap
+
+# Upper bound on requests awaiting a reply. The kernel drops unicast replies
+# that don't fit in the receive buffer, so this also bounds its use.
+MAX_INFLIGHT = 256
+
+# Room for MAX_INFLIGHT replies of a few KB each
+RCVBUF_SIZE = 4 * 1024 * 1024
+
+# Default TapTransport write buffer limit, in bytes, above which the
+# protocol is asked to pause writing. It resumes below a quarter of it.
+WRITE_HIGH_WATER = 256 * 1024
+
+# Default number of frames a TapStream holds before it stops reading
+STREAM_MAX_QUEUED = 1024
+
+_connections = weakref.WeakKeyDictionary()
+
+
+class Connection(object):
+    ''' An rtnetlink socket driven by an asyncio event loop. The socket is
+        opened by ctx (a context.Context), if given. '''
+
+    def __init__(self, loop=None, max_inflight=MAX_INFLIGHT, ctx=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.ctx = ctx
+        if ctx is not None:
+            self.sock = ctx.open_netlink()
+        else:
+            self.sock = netlink.NetlinkSocket()
+        self.sock.setblocking(False)
+        try:
+            self.sock.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                      RCVBUF_SIZE)
+        except OSError:
+            pass
+        self._pending = {}
+        self._inflight = asyncio.Semaphore(max_inflight)
+        # A second dump on the socket fails with EBUSY until the first ends
+        self._dumping = asyncio.Lock()
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        self._fail_all(OSError(errno.EBADF, "connection closed"))
+
+    def _fail_all(self, exc):
+        for future, _replies in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+    def _on_readable(self):
+        while True:
+            try:
+                messages = list(self.sock.recv())
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # ENOBUFS means replies were dropped; nobody can tell whose.
+                self._fail_all(e)
+                return
+            for msg_type, _flags, seq, payload in messages:
+                entry = self._pending.get(seq)
+                if entry is None:
+                    continue
+                future, replies = entry
+                if future.done():
+                    continue
+                if msg_type == netlink.NLMSG_DONE:
+                    future.set_result(replies)
+                elif msg_type == netlink.NLMSG_ERROR:
+                    error = netlink.NLMSGERR.unpack_from(payload)[0]
+                    if error:
+                        future.set_exception(
+                            netlink.NetlinkError(-error, os.strerror(-error)))
+                    else:
+                        future.set_result(replies)
+                else:
+                    replies.append((msg_type, payload))
+
+    async def _send(self, msg_type, flags, payload):
+        async with self._inflight:
+            if self.sock is None:
+                raise OSError(errno.EBADF, "connection closed")
+            future = self.loop.create_future()
+            seq = self.sock.send(msg_type, flags, payload)
+            self._pending[seq] = (future, [])
+            try:
+                return await future
+            finally:
+                self._pending.pop(seq, None)
+
+    async def request(self, msg_type, payload, flags=0):
+        ''' Send a request and return the list of (type, payload) replies once
+            the kernel acknowledges it. '''
+        return await self._send(
+            msg_type, netlink.NLM_F_REQUEST | netlink.NLM_F_ACK | flags, payload)
+
+    async def dump(self, msg_type, payload):
+        ''' Issue a dump request and return the list of (type, payload)
+            objects the kernel returns. Dumps run one at a time; other
+            requests carry on alongside them. '''
+        async with self._dumping:
+            return await self._send(
+                msg_type, netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP, payload)
+
+    async def get_link(self, name=None, index=0):
+        ''' Return the netlink.Link with the given name or index. Raises
+            NetlinkError (ENODEV) if there is no such device. '''
+        for msg_type, payload in await self.request(
+                netlink.RTM_GETLINK, netlink.link_msg(name, index)):
+            if msg_type == netlink.RTM_NEWLINK:
+                return netlink.parse_link(payload)
+        raise netlink.NetlinkError(errno.ENODEV, os.strerror(errno.ENODEV))
+
+    async def get_links(self):
+        return [netlink.parse_link(payload) for msg_type, payload
+                in await self.dump(netlink.RTM_GETLINK, netlink.link_msg())
+                if msg_type == netlink.RTM_NEWLINK]
+
+    async def get_addresses(self, family=socket.AF_UNSPEC):
+        msg = netlink.IFADDRMSG.pack(family, 0, 0, 0, 0)
+        return [netlink.parse_addr(payload) for msg_type, payload
+                in await self.dump(netlink.RTM_GETADDR, msg)
+                if msg_type == netlink.RTM_NEWADDR]
+
+    async def get_routes(self, family=socket.AF_UNSPEC):
+        msg = netlink.RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)
+        return [netlink.parse_route(payload) for msg_type, payload
+                in await self.dump(netlink.RTM_GETROUTE, msg)
+                if msg_type == netlink.RTM_NEWROUTE]
+
+    async def set_link(self, name, flags=0, change=0, attrs=()):
+        ''' Modify the named link (RTM_NEWLINK without NLM_F_CREATE). '''
+        await self.request(netlink.RTM_NEWLINK,
+                           netlink.link_msg(name, flags=flags, change=change,
+                                            attrs=attrs))
+
+
+def get_connection(loop=None):
+    ''' Return the shared Connection for the given (or current) event loop. '''
+    loop = loop or asyncio.get_event_loop()
+    conn = _connections.get(loop)
+    if conn is None or conn.sock is None:
+        conn = _connections[loop] = Connection(loop)
+    return conn
+
+
+class Interface(object):
+    ''' Awaitable counterpart of ifconfig.Interface. '''
+
+    def __init__(self, name, conn=None):
+        self.name = name
+        self._conn = conn
+
+    def __repr__(self):
+        return "<%s %s at 0x%x>" % (self.__class__.__name__, self.name, id(self))
+
+    @property
+    def conn(self):
+        return self._conn or get_connection()
+
+    async def get_link(self):
+        return await self.conn.get_link(self.name)
+
+    async def up(self):
+        ''' Bring up the interface. Equivalent to ifconfig [iface] up. '''
+        await self.conn.set_link(self.name, ifconfig.IFF_UP, ifconfig.IFF_UP)
+
+    async def down(self):
+        ''' Bring down the interface. Equivalent to ifconfig [iface] down. '''
+        await self.conn.set_link(self.name, 0, ifconfig.IFF_UP)
+
+    async def is_up(self):
+        ''' Return True if the interface is up, False otherwise. '''
+        return bool((await self.get_link()).flags & ifconfig.IFF_UP)
+
+    async def get_mac(self):
+        return (await self.get_link()).mac
+
+    async def set_mac(self, newmac):
+        ''' Set the device's mac address. Device must be down for this to
+            succeed. '''
+        macbytes = bytes(bytearray(int(i, 16) for i in newmac.split(':')))
+        await self.conn.set_link(self.name,
+                                 attrs=[(netlink.IFLA_ADDRESS, macbytes)])
+
+    async def get_index(self):
+        return (await self.get_link()).index
+
+    async def _primary_address(self, link):
+        ''' The address SIOCGIFADDR would report: the first IPv4 address
+            labelled with the interface name. '''
+        for addr in await self.conn.get_addresses(socket.AF_INET):
+            if addr.index == link.index and addr.label == self.name:
+                return addr
+        return None
+
+    async def get_ip(self):
+        addr = await self._primary_address(await self.get_link())
+        return addr.address if addr is not None else None
+
+    async def get_netmask(self):
+        addr = await self._primary_address(await self.get_link())
+        return addr.prefixlen if addr is not None else 0
+
+    async def _replace_address(self, ip=None, prefixlen=None):
+        link = await self.get_link()
+        old = await self._primary_address(link)
+        if old is not None:
+            await self.conn.request(netlink.RTM_DELADDR, netlink.addr_msg(
+                link.index, old.address, old.prefixlen))
+            ip = ip or old.address
+            prefixlen = old.prefixlen if prefixlen is None else prefixlen
+        if ip is None:
+            raise netlink.NetlinkError(errno.EADDRNOTAVAIL,
+                                       os.strerror(errno.EADDRNOTAVAIL))
+        try:
+            await self.conn.request(
+                netlink.RTM_NEWADDR,
+                netlink.addr_msg(link.index, ip, 32 if prefixlen is None else prefixlen),
+                netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE)
+        except EnvironmentError:
+            # Don't leave the interface without an address. The old one is
+            # removed first because, unless promote_secondaries is set,
+            # removing a primary address also removes the new one if it is
+            # in the same subnet.
+            if old is not None:
+                await self.conn.request(
+                    netlink.RTM_NEWADDR,
+                    netlink.addr_msg(link.index, old.address, old.prefixlen),
+                    netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE)
+            raise
+
+    async def set_ip(self, newip, prefixlen=None):
+        ''' Replace the primary IPv4 address, keeping its prefix length unless
+            one is given. If the new address is refused, the old one is
+            restored before the error is raised. '''
+        await self._replace_address(newip, prefixlen)
+
+    async def set_netmask(self, netmask):
+        ''' Change the prefix length of the primary IPv4 address. '''
+        await self._replace_address(prefixlen=netmask)
+
+    async def get_mtu(self):
+        return (await self.get_link()).mtu
+
+    async def get_stats(self):
+        ''' Return a dict of this interface's 64-bit counters, with the same
+            keys as ifconfig.Interface.get_stats(). '''
+        for msg_type, payload in await self.conn.request(
+                netlink.RTM_GETLINK, netlink.link_msg(self.name)):
+            if msg_type == netlink.RTM_NEWLINK:
+                stats = netlink.parse_link_stats64(payload)
+                if stats is not None:
+                    return dict(zip(ifconfig.STATS_TITLES,
+                                    ifconfig.fold_stats64(stats[2])))
+        return None
+
+
+class Bridge(Interface):
+    ''' Awaitable counterpart of brctl.Bridge. '''
+
+    async def _set_master(self, iface, master):
+        name = iface.name if isinstance(iface, (Interface, ifconfig.Interface)) else iface
+        await self.conn.set_link(
+            name, attrs=[(netlink.IFLA_MASTER, netlink.U32.pack(master))])
+        return self
+
+    async def addif(self, iface):
+        ''' Add the interface to this bridge. Equivalent to
+            brctl addif [bridge] [interface]. '''
+        return await self._set_master(iface, await self.get_index())
+
+    async def delif(self, iface):
+        ''' Remove the interface from this bridge. Equivalent to
+            brctl delif [bridge] [interface]. '''
+        return await self._set_master(iface, 0)
+
+    async def delete(self):
+        ''' Remove the bridge. Equivalent to
+            ifconfig [bridge] down && brctl delbr [bridge]. '''
+        await self.conn.request(netlink.RTM_DELLINK, netlink.link_msg(self.name))
+        (self.conn.ctx or context.get_context()).index_cache.invalidate(self.name)
+        return self
+
+    async def iterifs(self):
+        ''' Return the names of the interfaces in this bridge. '''
+        index = await self.get_index()
+        return [link.name for link in await self.conn.get_links()
+                if link.master == index]
+
+
+async def addbr(name, conn=None):
+    ''' Create new bridge with the given name '''
+    conn = conn or get_connection()
+    linkinfo = netlink.pack_attr(netlink.IFLA_INFO_KIND, b'bridge')
+    await conn.request(netlink.RTM_NEWLINK,
+                       netlink.link_msg(name, attrs=[(netlink.IFLA_LINKINFO, linkinfo)]),
+                       netlink.NLM_F_CREATE | netlink.NLM_F_EXCL)
+    return Bridge(name, conn)
+
+
+async def list_ifs(conn=None):
+    ''' Return a list of Interfaces for every link in the system. '''
+    conn = conn or get_connection()
+    return [Interface(link.name, conn) for link in await conn.get_links()]
+
+
+async def _default_route(conn):
+    for route in await conn.get_routes(socket.AF_INET):
+        if route.dst_len == 0 and route.table == netlink.RT_TABLE_MAIN:
+            return route
+    return None
+
+
+async def get_default_gw(conn=None):
+    ''' Returns the default gateway '''
+    route = await _default_route(conn or get_connection())
+    return route.gateway if route is not None else None
+
+
+async def get_default_if(conn=None):
+    ''' Returns the default interface '''
+    conn = conn or get_connection()
+    route = await _default_route(conn)
+    if route is None or route.oif is None:
+        return None
+    return (await conn.get_link(index=route.oif)).name
+
+
+async def get_all_stats64(conn=None):
+    ''' Awaitable ifconfig.get_all_stats64(). '''
+    conn = conn or get_connection()
+    stats = {}
+    for msg_type, payload in await conn.dump(netlink.RTM_GETLINK,
+                                             netlink.link_msg()):
+        if msg_type == netlink.RTM_NEWLINK:
+            parsed = netlink.parse_link_stats64(payload)
+            if parsed is not None:
+                _index, name, s = parsed
+                stats[name] = dict(zip(ifconfig.STATS_TITLES,
+                                       ifconfig.fold_stats64(s)))
+    return stats
+
+
+class TapProtocol(asyncio.BaseProtocol):
+    ''' Protocol for a TapTransport. '''
+
+    def frame_received(self, frame):
+        ''' Called with each frame read from the tap. '''
+
+    def error_received(self, exc):
+        ''' Called when a frame could not be written, e.g. with EIO while
+            the tap is down. The frame is dropped; the transport stays
+            open. '''
+
+
+class TapTransport(asyncio.Transport):
+    '''
+    Transport for a tap.Tap or tap.TapQueue, which is made non-blocking.
+
+    Each time the tap is readable every frame that is ready is read, a
+    FramePool at a time, and passed to the protocol's frame_received(). With
+    copy=False the frames are memoryviews into the pool, only valid until
+    frame_received() returns. pause_reading() takes effect after the frames
+    already read.
+
+    Each write() or writelines() item is one frame. Frames the tap can't
+    take straight away are buffered, and the protocol's pause_writing() and
+    resume_writing() are called as the buffer crosses the high and low water
+    marks. Closing the transport closes the tap.
+    '''
+
+    def __init__(self, device, protocol, loop=None, copy=True, waiter=None):
+        super().__init__({'tap': device, 'name': device.name
+                          if isinstance(device, tap.Tap) else device.tap.name})
+        self._loop = loop or asyncio.get_event_loop()
+        self._device = device
+        self._protocol = protocol
+        self._copy = copy
+        self._fileno = device.fileno()
+        os.set_blocking(self._fileno, False)
+        device.blocking = False
+        self._pool = device.frame_pool()
+        self._reading = True
+        self._closing = False
+        self._buffer = collections.deque()
+        self._buffer_size = 0
+        self._writing_paused = False
+        self.set_write_buffer_limits()
+        self._loop.call_soon(protocol.connection_made, self)
+        self._loop.call_soon(self._start_reading)
+        if waiter is not None:
+            self._loop.call_soon(self._connected, waiter)
+
+    @staticmethod
+    def _connected(waiter):
+        if not waiter.cancelled():
+            waiter.set_result(None)
+
+    def _start_reading(self):
+        if self._reading and not self._closing:
+            self._loop.add_reader(self._fileno, self._on_readable)
+
+    def _on_readable(self):
+        pool_size = len(self._pool)
+        while self._reading and not self._closing:
+            try:
+                frames = self._device.read_batch(self._pool)
+            except OSError as exc:
+                self._force_close(exc)
+                return
+            for frame in frames:
+                self._protocol.frame_received(
+                    bytes(frame) if self._copy else frame)
+            if len(frames) < pool_size:
+                return
+
+    def is_reading(self):
+        return self._reading and not self._closing
+
+    def pause_reading(self):
+        if self._reading and not self._closing:
+            self._loop.remove_reader(self._fileno)
+        self._reading = False
+
+    def resume_reading(self):
+        if not self._reading:
+            self._reading = True
+            self._start_reading()
+
+    def set_protocol(self, protocol):
+        self._protocol = protocol
+
+    def get_protocol(self):
+        return self._protocol
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        if high is None:
+            high = WRITE_HIGH_WATER if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError("high (%r) must be >= low (%r) must be >= 0" %
+                             (high, low))
+        self._high_water = high
+        self._low_water = low
+        self._maybe_pause_protocol()
+
+    def get_write_buffer_limits(self):
+        return (self._low_water, self._high_water)
+
+    def get_write_buffer_size(self):
+        return self._buffer_size
+
+    def _maybe_pause_protocol(self):
+        if self._buffer_size > self._high_water and not self._writing_paused:
+            self._writing_paused = True
+            self._protocol.pause_writing()
+
+    def _maybe_resume_protocol(self):
+        if self._writing_paused and self._buffer_size <= self._low_water:
+            self._writing_paused = False
+            self._protocol.resume_writing()
+
+    def write(self, data):
+        ''' Send data as one frame. '''
+        if self._closing:
+            raise RuntimeError("write() on a closing transport")
+        if not self._buffer:
+            try:
+                os.write(self._fileno, data)
+                return
+            except BlockingIOError:
+                pass
+            except OSError as exc:
+                self._protocol.error_received(exc)
+                return
+            self._loop.add_writer(self._fileno, self._on_writable)
+        # The caller may reuse its buffer
+        self._buffer.append(bytes(data))
+        self._buffer_size += len(data)
+        self._maybe_pause_protocol()
+
+    def writelines(self, list_of_data):
+        ''' Send each item as a frame. '''
+        for data in list_of_data:
+            self.write(data)
+
+    def _on_writable(self):
+        while self._buffer:
+            data = self._buffer[0]
+            try:
+                os.write(self._fileno, data)
+            except BlockingIOError:
+                break
+            except OSError as exc:
+                self._protocol.error_received(exc)
+            self._buffer.popleft()
+            self._buffer_size -= len(data)
+        self._maybe_resume_protocol()
+        if not self._buffer:
+            self._loop.remove_writer(self._fileno)
+            if self._closing:
+                self._loop.call_soon(self._call_connection_lost, None)
+
+    def can_write_eof(self):
+        return False
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        ''' Stop reading, and close once buffered frames are written. '''
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fileno)
+        if not self._buffer:
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        ''' Close straight away, dropping buffered frames. '''
+        self._force_close(None)
+
+    def _force_close(self, exc):
+        if self._device is None:
+            return
+        if self._buffer:
+            self._buffer.clear()
+            self._buffer_size = 0
+            self._loop.remove_writer(self._fileno)
+        if not self._closing:
+            self._closing = True
+            self._loop.remove_reader(self._fileno)
+            self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc):
+        if self._device is None:
+            return
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._device.close()
+            self._device = None
+
+
+class TapStream(TapProtocol):
+    '''
+    The frames of a tap as an async iterator, as made by open_tap_stream():
+
+        stream = await open_tap_stream(name=b'tap0')
+        async for frame in stream:
+            stream.write(reply)
+            await stream.drain()
+
+    Reading pauses while max_queued frames wait to be consumed, and resumes
+    once half of them have been.
+    '''
+
+    def __init__(self, max_queued=STREAM_MAX_QUEUED):
+        self.max_queued = max_queued
+        self.transport = None
+        self._frames = collections.deque()
+        self._read_waiter = None
+        self._drain_waiter = None
+        self._writing_paused = False
+        self._closed = False
+        self._exception = None
+
+    @staticmethod
+    def _wake(waiter):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._exception = exc
+        self._wake(self._read_waiter)
+        self._wake(self._drain_waiter)
+
+    def frame_received(self, frame):
+        self._frames.append(frame)
+        if len(self._frames) >= self.max_queued:
+            self.transport.pause_reading()
+        self._wake(self._read_waiter)
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self._wake(self._drain_waiter)
+
+    async def read(self):
+        ''' Return the next frame, or None once the stream is closed. '''
+        while not self._frames:
+            if self._closed:
+                if self._exception is not None:
+                    raise self._exception
+                return None
+            self._read_waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+        frame = self._frames.popleft()
+        if (len(self._frames) <= self.max_queued // 2 and not self._closed and
+                not self.transport.is_reading()):
+            self.transport.resume_reading()
+        return frame
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.read()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    def write(self, frame):
+        ''' Send a frame. Call drain() to wait for buffered frames to go. '''
+        self.transport.write(frame)
+
+    async def drain(self):
+        ''' Wait until the write buffer is below its low water mark. '''
+        if self._exception is not None:
+            raise self._exception
+        while self._writing_paused and not self._closed:
+            self._drain_waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._drain_waiter
+            finally:
+                self._drain_waiter = None
+
+    def close(self):
+        self.transport.close()
+
+
+async def create_tap_endpoint(protocol_factory, device=None, name=None,
+                              copy=True, loop=None):
+    ''' Connect a TapProtocol to a tap.Tap or tap.TapQueue, or to a new
+        tap.Tap with the given name, and return (transport, protocol). '''
+    loop = loop or asyncio.get_event_loop()
+    if device is None:
+        device = tap.Tap(name, blocking=False)
+    protocol = protocol_factory()
+    waiter = loop.create_future()
+    transport = TapTransport(device, protocol, loop, copy, waiter)
+    await waiter
+    return transport, protocol
+
+
+async def open_tap_stream(device=None, name=None,
+                          max_queued=STREAM_MAX_QUEUED, loop=None):
+    ''' Return a TapStream for a tap.Tap or tap.TapQueue, or for a new
+        tap.Tap with the given name. '''
+    _transport, stream = await create_tap_endpoint(
+        lambda: TapStream(max_queued), device, name, loop=loop)
+    return stream
@@ -0,0 +1,216 @@
+import collections
+import errno
+import socket
+
+from . import context
+from . import ifconfig
+from . import netlink
+
+"""
+Batches of link and address changes. Queued changes are sent as a few large
+datagrams of rtnetlink requests, each flagged NLM_F_ACK, so every change is
+acknowledged (or refused) on its own while the kernel is entered once per
+datagram rather than once per change.
+"""
+
+# Limits on each datagram a batch is split into. The kernel handles every
+# message in a datagram before sendmsg() returns, queueing an
+# acknowledgement of about 1KB (as charged to the receive buffer) for each,
+# so MAX_MESSAGES keeps them within the default 208KB SO_RCVBUF.
+MAX_DATAGRAM = 32768
+MAX_MESSAGES = 128
+
+# The outcome of one queued change. op and name describe it, e.g. ('up',
+# b'eth1'); error is None on success, or the exception it failed with.
+Result = collections.namedtuple('Result', ['op', 'name', 'error'])
+
+
+def _name(iface):
+    if isinstance(iface, ifconfig.Interface):
+        return iface.name
+    return iface
+
+
+def _family(address):
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+class Batch(object):
+    '''
+    Collects changes to any number of interfaces and applies them with
+    commit(). Changes are applied in the order they were queued; one that
+    fails does not stop the rest.
+
+    Interfaces can be given as names or Interfaces. Requests go through
+    ctx's rtnetlink socket, or the calling thread's context.
+    '''
+
+    def __init__(self, ctx=None):
+        self.ctx = ctx
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _add(self, op, iface, msg_type, payload, flags=0, error=None):
+        self._ops.append((op, _name(iface), msg_type, flags, payload, error))
+        return self
+
+    def _link(self, op, iface, flags=0, change=0, attrs=()):
+        return self._add(op, iface, netlink.RTM_NEWLINK,
+                         netlink.link_msg(_name(iface), flags=flags,
+                                          change=change, attrs=attrs))
+
+    def _address(self, op, iface, address, prefixlen, msg_type, flags=0):
+        try:
+            if isinstance(iface, ifconfig.Interface):
+                index = iface.index
+            else:
+                index = (self.ctx or context.get_context()).index_cache.index(iface)
+        except EnvironmentError as e:
+            # Reported with the other results instead of aborting the batch
+            return self._add(op, iface, msg_type, None, error=e)
+        return self._add(op, iface, msg_type,
+                         netlink.addr_msg(index, address, prefixlen,
+                                          _family(address)), flags)
+
+    def up(self, iface):
+        ''' Queue bringing up the interface. '''
+        return self._link('up', iface, netlink.IFF_UP, netlink.IFF_UP)
+
+    def down(self, iface):
+        ''' Queue bringing down the interface. '''
+        return self._link('down', iface, 0, netlink.IFF_UP)
+
+    def set_mac(self, iface, newmac):
+        ''' Queue setting the interface's mac address, given as
+            'aa:bb:cc:dd:ee:ff'. '''
+        macbytes = bytes(bytearray(int(i, 16) for i in newmac.split(':')))
+        return self._link('set_mac', iface,
+                          attrs=[(netlink.IFLA_ADDRESS, macbytes)])
+
+    def set_mtu(self, iface, mtu):
+        ''' Queue setting the interface's MTU. '''
+        return self._link('set_mtu', iface,
+                          attrs=[(netlink.IFLA_MTU, netlink.U32.pack(mtu))])
+
+    def set_link(self, iface, **settings):
+        ''' Queue changing any of netlink.LINK_SETTINGS in one message, e.g.
+            set_link(iface, mtu=9000, txqlen=10000). '''
+        return self._link('set_link', iface,
+                          attrs=netlink.link_settings_attrs(settings))
+
+    def set_master(self, iface, master):
+        ''' Queue enslaving the interface to the bridge (or bond) master, or
+            releasing it if master is None. master is an Interface or an
+            ifindex. '''
+        if isinstance(master, ifconfig.Interface):
+            master = master.index
+        return self._link('set_master', iface, attrs=[
+            (netlink.IFLA_MASTER, netlink.U32.pack(master or 0))])
+
+    def add_address(self, iface, address, prefixlen, replace=False):
+        ''' Queue adding an IPv4 or IPv6 address. With replace, an existing
+            address with the same prefix is updated instead of refused. '''
+        flags = netlink.NLM_F_CREATE
+        flags |= netlink.NLM_F_REPLACE if replace else netlink.NLM_F_EXCL
+        return self._address('add_address', iface, address, prefixlen,
+                             netlink.RTM_NEWADDR, flags)
+
+    def del_address(self, iface, address, prefixlen):
+        ''' Queue removing an IPv4 or IPv6 address. '''
+        return self._address('del_address', iface, address, prefixlen,
+                             netlink.RTM_DELADDR)
+
+    def commit(self):
+        ''' Send every queued change and return a list of Results, in the
+            order the changes were queued. The batch is empty afterwards. '''
+        ops, self._ops = self._ops, []
+        nlsock = (self.ctx or context.get_context()).netlink
+        errors = [op[5] for op in ops]
+
+        chunk = []
+        size = 0
+        for i, (_op, _name, msg_type, flags, payload, error) in enumerate(ops):
+            if error is not None:
+                continue
+            length = netlink.NLMSGHDR.size + netlink.align(len(payload))
+            if chunk and (size + length > MAX_DATAGRAM or
+                          len(chunk) == MAX_MESSAGES):
+                self._send(nlsock, chunk, errors)
+                chunk = []
+                size = 0
+            chunk.append((i, msg_type, flags, payload))
+            size += length
+        if chunk:
+            self._send(nlsock, chunk, errors)
+
+        return [Result(op[0], op[1], error) for op, error in zip(ops, errors)]
+
+    def _send(self, nlsock, chunk, errors):
+        seqs = nlsock.send_batch(
+            [(msg_type, netlink.NLM_F_REQUEST | netlink.NLM_F_ACK | flags, payload)
+             for _i, msg_type, flags, payload in chunk])
+        acks = nlsock.acks(seqs)
+        for (i, _type, _flags, _payload), seq in zip(chunk, seqs):
+            errors[i] = acks[seq]
+
+
+class LinkProfile(object):
+    '''
+    Link settings (see netlink.LINK_SETTINGS) wanted on a set of interfaces,
+    e.g. LinkProfile(mtu=9000, txqlen=10000, gro_max_size=65536). Settings
+    left out, or given as None, are not touched.
+
+    apply() reads every interface's current settings with one rtnetlink
+    dump and sends only the settings that differ, as a single Batch, so
+    reapplying a profile that is already in effect changes nothing.
+    '''
+
+    def __init__(self, **settings):
+        netlink.link_settings_attrs(settings)   # reject unknown settings
+        self.settings = dict((k, v) for k, v in settings.items()
+                             if v is not None)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, " ".join(
+            "%s=%s" % item for item in sorted(self.settings.items())))
+
+    def diff(self, link):
+        ''' Return a dict of the settings that differ from the given
+            netlink.Link. '''
+        return dict((field, value) for field, value in self.settings.items()
+                    if getattr(link, field) != value)
+
+    def plan(self, ifaces, ctx=None):
+        ''' Return a dict mapping the name of each of the given interfaces
+            to the settings apply() would change on it, leaving out those
+            already as wanted. Names that don't exist map to None. '''
+        current = ctx or context.get_context()
+        links = dict((link.name, link)
+                     for link in netlink.get_links(current.netlink))
+        result = {}
+        for name in [_name(i) for i in ifaces]:
+            if name not in links:
+                result[name] = None
+                continue
+            changes = self.diff(links[name])
+            if changes:
+                result[name] = changes
+        return result
+
+    def apply(self, ifaces, ctx=None):
+        ''' Bring the given interfaces in line with the profile. There is no
+            default: a profile meant for physical ports would otherwise also
+            reach lo, bridges and other virtual devices. Returns a list of
+            Results, with op 'set_link', for the interfaces that needed
+            changing or don't exist. '''
+        b = Batch(ctx)
+        for name, changes in sorted(self.plan(ifaces, ctx).items()):
+            if changes is None:
+                b._add('set_link', name, netlink.RTM_NEWLINK, None,
+                       error=IOError(errno.ENODEV,
+                                     "no such device: %r" % name))
+            else:
+                b.set_link(name, **changes)
+        return b.commit()
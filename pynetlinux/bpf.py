@@ -0,0 +1,294 @@
+import array
+import collections
+import ctypes
+import errno
+import os
+import platform
+import struct
+
+"""
+Packet filters for taps: classic BPF programs, as attached with
+TUNATTACHFILTER, with a builder for common ethernet matches, and a minimal
+loader for the eBPF programs TUNSETSTEERINGEBPF takes. This file makes the
+following assumptions about data structures:
+
+// From linux/filter.h
+
+struct sock_filter {
+    __u16   code;
+    __u8    jt;     /* instructions to skip if true */
+    __u8    jf;     /* instructions to skip if false */
+    __u32   k;
+};
+
+struct sock_fprog {
+    unsigned short      len;
+    struct sock_filter  *filter;
+};
+
+// From linux/bpf.h
+
+struct bpf_insn {
+    __u8    code;
+    __u8    dst_reg:4;
+    __u8    src_reg:4;
+    __s16   off;
+    __s32   imm;
+};
+"""
+
+# From linux/bpf_common.h
+BPF_LD   = 0x00
+BPF_LDX  = 0x01
+BPF_ALU  = 0x04
+BPF_JMP  = 0x05
+BPF_RET  = 0x06
+BPF_W    = 0x00
+BPF_H    = 0x08
+BPF_B    = 0x10
+BPF_ABS  = 0x20
+BPF_MEM  = 0x60
+BPF_AND  = 0x50
+BPF_JA   = 0x00
+BPF_JEQ  = 0x10
+BPF_JSET = 0x40
+BPF_K    = 0x00
+
+# From linux/filter.h: ancillary data, loaded from SKF_AD_OFF + n
+SKF_AD_OFF = -0x1000
+SKF_AD_VLAN_TAG = 44
+SKF_AD_VLAN_TAG_PRESENT = 48
+
+# From linux/bpf.h
+BPF_ALU64 = 0x07
+BPF_MOV  = 0xb0
+BPF_EXIT = 0x90
+BPF_PROG_LOAD = 5
+BPF_PROG_TYPE_SOCKET_FILTER = 1
+BPF_REG_0 = 0
+BPF_REG_1 = 1
+
+# Offset of vlan_tci in struct __sk_buff
+SKB_VLAN_TCI = 24
+
+# __NR_bpf
+BPF_SYSCALLS = {'x86_64': 321, 'aarch64': 280, 'i386': 357, 'i686': 357,
+                'armv7l': 386, 'ppc64le': 361, 's390x': 351}
+
+SOCK_FILTER = struct.Struct('=HBBI')
+SOCK_FPROG = struct.Struct('@HP')
+BPF_INSN = struct.Struct('=BBhi')
+BPF_ATTR_PROG_LOAD = struct.Struct('=IIQQIIQII')
+
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88a8
+
+# Length to keep of an accepted frame: all of it
+ACCEPT_ALL = 0x40000
+
+Instruction = collections.namedtuple('Instruction', ['code', 'jt', 'jf', 'k'])
+
+
+def stmt(code, k):
+    return Instruction(code, 0, 0, k & 0xffffffff)
+
+
+def jump(code, k, jt, jf):
+    ''' A conditional jump. jt and jf are numbers of instructions to skip or,
+        for assemble(), label names. '''
+    return Instruction(code, jt, jf, k & 0xffffffff)
+
+
+def goto(target):
+    ''' An unconditional jump, to a label name or over a number of
+        instructions. '''
+    return Instruction(BPF_JMP | BPF_JA, 0, 0, target)
+
+
+def assemble(items):
+    ''' Resolve label names used as jump targets into offsets. items are
+        Instructions and label names (strings), each marking the position of
+        the next instruction. Returns a list of Instructions. '''
+    labels = {}
+    program = []
+    for item in items:
+        if isinstance(item, str):
+            labels[item] = len(program)
+        else:
+            program.append(item)
+
+    def offset(i, target, limit=0xff):
+        if not isinstance(target, str):
+            return target
+        skip = labels[target] - i - 1
+        if not 0 <= skip <= limit:
+            raise ValueError("jump to %r out of range" % target)
+        return skip
+
+    return [insn._replace(jt=offset(i, insn.jt), jf=offset(i, insn.jf),
+                          k=offset(i, insn.k, 0xffffffff))
+            for i, insn in enumerate(program)]
+
+
+def pack(program):
+    ''' Return (fprog, buffer): a struct sock_fprog for program, and the
+        array holding its instructions, which must outlive any use of
+        fprog. '''
+    buf = array.array('B', b''.join(SOCK_FILTER.pack(*insn)
+                                    for insn in program))
+    return SOCK_FPROG.pack(len(program), buf.buffer_info()[0]), buf
+
+
+def _mac(mac):
+    ''' Return (high 16 bits, low 32 bits) of a MAC address given as
+        'aa:bb:cc:dd:ee:ff'. '''
+    value = int(mac.replace(':', ''), 16)
+    return value >> 32, value & 0xffffffff
+
+
+def _any_of(values, ok):
+    ''' Compare the accumulator against values, jumping to ok on a match and
+        to 'reject' otherwise. '''
+    values = list(values)
+    items = []
+    for i, value in enumerate(values):
+        last = i == len(values) - 1
+        items.append(jump(BPF_JMP | BPF_JEQ | BPF_K, value, ok,
+                          'reject' if last else 0))
+    return items
+
+
+def _mac_any_of(offset, macs, ok):
+    ''' Compare the MAC address at offset against macs, like _any_of(). '''
+    macs = list(macs)
+    items = []
+    for i, mac in enumerate(macs):
+        high, low = _mac(mac)
+        last = i == len(macs) - 1
+        miss = 'reject' if last else 'mac%d_%d' % (offset, i)
+        items += [
+            stmt(BPF_LD | BPF_W | BPF_ABS, offset + 2),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, low, 0, miss),
+            stmt(BPF_LD | BPF_H | BPF_ABS, offset),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, high, ok, miss),
+        ]
+        if not last:
+            items.append(miss)
+    return items
+
+
+def build_filter(ethertypes=None, vlans=None, dst_macs=None, src_macs=None,
+                 drop_multicast=False, drop_broadcast=False,
+                 snaplen=ACCEPT_ALL):
+    ''' Return a classic BPF program accepting only the frames that pass
+        every given test:
+
+        ethertypes  the frame's ethertype (after any VLAN tag) is one of these
+        vlans       the frame has a VLAN tag with one of these IDs; 0 in the
+                    list also lets untagged frames through
+        dst_macs    the destination MAC is one of these
+        src_macs    the source MAC is one of these
+        drop_multicast  the destination is not multicast (or broadcast)
+        drop_broadcast  the destination is not broadcast
+
+        VLAN tags are found whether the kernel kept them out of band (as
+        with taps) or in the frame. Accepted frames are cut to snaplen. '''
+    items = []
+    if drop_multicast:
+        items += [stmt(BPF_LD | BPF_B | BPF_ABS, 0),
+                  jump(BPF_JMP | BPF_JSET | BPF_K, 0x01, 'reject', 0)]
+    elif drop_broadcast:
+        items += [stmt(BPF_LD | BPF_W | BPF_ABS, 2),
+                  jump(BPF_JMP | BPF_JEQ | BPF_K, 0xffffffff, 0, 'bcast_ok'),
+                  stmt(BPF_LD | BPF_H | BPF_ABS, 0),
+                  jump(BPF_JMP | BPF_JEQ | BPF_K, 0xffff, 'reject', 0),
+                  'bcast_ok']
+    if dst_macs:
+        items += _mac_any_of(0, dst_macs, 'dst_ok') + ['dst_ok']
+    if src_macs:
+        items += _mac_any_of(6, src_macs, 'src_ok') + ['src_ok']
+    if vlans:
+        vlans = list(vlans)
+        untagged = 'vlan_ok' if 0 in vlans else 'reject'
+        tagged = [v for v in vlans if v]
+        items += [
+            stmt(BPF_LD | BPF_W | BPF_ABS,
+                 SKF_AD_OFF + SKF_AD_VLAN_TAG_PRESENT),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, 0, 'vlan_inband', 0),
+            stmt(BPF_LD | BPF_W | BPF_ABS, SKF_AD_OFF + SKF_AD_VLAN_TAG),
+            goto('vlan_id'),
+            'vlan_inband',
+            stmt(BPF_LD | BPF_H | BPF_ABS, 12),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, ETH_P_8021Q, 'vlan_load', 0),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, ETH_P_8021AD, 'vlan_load',
+                 untagged),
+            'vlan_load',
+            stmt(BPF_LD | BPF_H | BPF_ABS, 14),
+            'vlan_id',
+            stmt(BPF_ALU | BPF_AND | BPF_K, 0xfff),
+        ]
+        if tagged:
+            items += _any_of(tagged, 'vlan_ok')
+        else:
+            items.append(jump(BPF_JMP | BPF_JEQ | BPF_K, 0, 0, 'reject'))
+        items.append('vlan_ok')
+    if ethertypes:
+        items += [
+            stmt(BPF_LD | BPF_H | BPF_ABS, 12),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, ETH_P_8021Q, 'type_inner', 0),
+            jump(BPF_JMP | BPF_JEQ | BPF_K, ETH_P_8021AD, 0, 'type_cmp'),
+            'type_inner',
+            stmt(BPF_LD | BPF_H | BPF_ABS, 16),
+            'type_cmp',
+        ] + _any_of(ethertypes, 'type_ok') + ['type_ok']
+    items += [stmt(BPF_RET | BPF_K, snaplen),
+              'reject',
+              stmt(BPF_RET | BPF_K, 0)]
+    return assemble(items)
+
+
+def ebpf_insn(code, dst=0, src=0, off=0, imm=0):
+    ''' Pack one struct bpf_insn. '''
+    return BPF_INSN.pack(code, src << 4 | dst, off, imm)
+
+
+def vlan_steering_program():
+    ''' eBPF instructions for a tap steering program that sends each frame
+        to the queue numbered by its VLAN ID (modulo the number of queues),
+        so untagged frames go to queue 0. '''
+    return b''.join([
+        # r0 = skb->vlan_tci & 0xfff
+        ebpf_insn(BPF_LDX | BPF_MEM | BPF_W, BPF_REG_0, BPF_REG_1,
+                  SKB_VLAN_TCI),
+        ebpf_insn(BPF_ALU | BPF_AND | BPF_K, BPF_REG_0, imm=0xfff),
+        ebpf_insn(BPF_JMP | BPF_EXIT),
+    ])
+
+
+def load_program(insns, prog_type=BPF_PROG_TYPE_SOCKET_FILTER,
+                 license=b"GPL"):
+    ''' Load packed eBPF instructions with the bpf() system call and return
+        the program's file descriptor, which the caller closes. '''
+    number = BPF_SYSCALLS.get(platform.machine())
+    if number is None:
+        raise OSError(errno.ENOSYS,
+                      "bpf() syscall number unknown for this machine")
+    insn_buf = ctypes.create_string_buffer(insns, len(insns))
+    license_buf = ctypes.create_string_buffer(license)
+    log_buf = ctypes.create_string_buffer(4096)
+    attr = ctypes.create_string_buffer(BPF_ATTR_PROG_LOAD.pack(
+        prog_type, len(insns) // BPF_INSN.size, ctypes.addressof(insn_buf),
+        ctypes.addressof(license_buf), 1, len(log_buf),
+        ctypes.addressof(log_buf), 0, 0), BPF_ATTR_PROG_LOAD.size)
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+    fd = libc.syscall(ctypes.c_long(number), ctypes.c_long(BPF_PROG_LOAD),
+                      attr, ctypes.c_ulong(BPF_ATTR_PROG_LOAD.size))
+    if fd < 0:
+        err = ctypes.get_errno()
+        message = os.strerror(err)
+        log = log_buf.value.decode('ascii', 'replace').strip()
+        if log:
+            message += ": " + log
+        raise OSError(err, message)
+    return fd
@@ -1,9 +1,11 @@
 import array
 import fcntl
 import os
-import struct
 
+from . import context
 from . import ifconfig
+from . import ifreq
+from . import netlink
 
 SYSFS_NET_PATH = b"/sys/class/net"
 
@@ -25,16 +27,24 @@ if not os.path.isdir(SYSFS_NET_PATH):
 class Bridge(ifconfig.Interface):
     ''' Class representing a Linux Ethernet bridge. '''
 
-    def __init__(self, name):
-        ifconfig.Interface.__init__(self, name)
+    def __init__(self, name, ctx=None):
+        ifconfig.Interface.__init__(self, name, ctx)
 
 
     def iterifs(self):
         ''' Iterate over all the interfaces in this bridge. '''
-        if_path = os.path.join(SYSFS_NET_PATH, self.name, b"brif")
-        net_files = os.listdir(if_path)
-        for iface in net_files:
-            yield iface
+        ctx = self.ctx
+        if ctx.netns is None:
+            # A single directory read
+            if_path = os.path.join(SYSFS_NET_PATH, self.name, b"brif")
+            for iface in os.listdir(if_path):
+                yield iface
+            return
+        # sysfs shows the namespace it was mounted in, not the context's.
+        index = self.index
+        for link in netlink.get_links(ctx.netlink):
+            if link.master == index:
+                yield link.name
         
         
     def listif(self):
@@ -45,39 +55,32 @@ class Bridge(ifconfig.Interface):
     def addif(self, iface):
         ''' Add the interface with the given name to this bridge. Equivalent to
             brctl addif [bridge] [interface]. '''
-        if type(iface) == ifconfig.Interface:
-            devindex = iface.index
-        else:
-            devindex = ifconfig.Interface(iface).index
-        ifreq = struct.pack('16si', self.name, devindex)
-        fcntl.ioctl(ifconfig.sockfd, SIOCBRADDIF, ifreq)
+        devindex = _ifindex(iface, self.ctx)
+        ifreq.ioctl(self.ctx.sockfd, SIOCBRADDIF, ifreq.INT, self.name, devindex)
         return self
         
         
     def delif(self, iface):
         ''' Remove the interface with the given name from this bridge.
             Equivalent to brctl delif [bridge] [interface]'''
-        if type(iface) == ifconfig.Interface:
-            devindex = iface.index
-        else:
-            devindex = ifconfig.Interface(iface).index
-        ifreq = struct.pack('16si', self.name, devindex)
-        fcntl.ioctl(ifconfig.sockfd, SIOCBRDELIF, ifreq)    
+        devindex = _ifindex(iface, self.ctx)
+        ifreq.ioctl(self.ctx.sockfd, SIOCBRDELIF, ifreq.INT, self.name, devindex)
         return self
 
     def set_forward_delay(self, delay):
         # delay is passed to kernel in "jiffies", which seems to be 100ths of a second
         data = array.array('L', [BRCTL_SET_BRIDGE_FORWARD_DELAY, int(delay*100), 0, 0] )
         buffer, _items = data.buffer_info()
-        ifreq = struct.pack('16sP', self.name, buffer)
-        fcntl.ioctl(ifconfig.sockfd, SIOCDEVPRIVATE, ifreq)
+        ifreq.ioctl(self.ctx.sockfd, SIOCDEVPRIVATE, ifreq.PTR, self.name, buffer)
         return self
 
     def delete(self):
         ''' Brings down the bridge interface, and removes it. Equivalent to
         ifconfig [bridge] down && brctl delbr [bridge]. '''
         self.down()
-        fcntl.ioctl(ifconfig.sockfd, SIOCBRDELBR, self.name)
+        ctx = self.ctx
+        fcntl.ioctl(ctx.sockfd, SIOCBRDELBR, self.name)
+        ctx.index_cache.invalidate(self.name)
         return self
 
         
@@ -89,47 +92,81 @@ class Bridge(ifconfig.Interface):
     ip = property(get_ip)
 
 
+def _ifindex(iface, ctx):
+    ''' Resolve an Interface or interface name to its ifindex. '''
+    if isinstance(iface, ifconfig.Interface):
+        return iface.index
+    return ctx.index_cache.index(iface)
+
+
 def shutdown():
     ''' Shut down bridge library '''
     ifconfig.shutdown()
 
 
-def iterbridges():
+def iterbridges(ctx=None):
     ''' Iterate over all the bridges in the system. '''
+    current = ctx or context.get_context()
+    try:
+        links = netlink.get_links(current.netlink)
+    except EnvironmentError:
+        # sysfs shows the namespace it was mounted in, not the context's.
+        if current.netns is not None:
+            raise
+        links = None
+    if links is not None:
+        for link in links:
+            if link.kind == b'bridge':
+                yield Bridge(link.name, ctx)
+        return
+
     net_files = os.listdir(SYSFS_NET_PATH)
     for d in net_files:
         path = os.path.join(SYSFS_NET_PATH, d)
         if not os.path.isdir(path):
             continue
         if os.path.exists(os.path.join(path, b"bridge")):
-            yield Bridge(d)
+            yield Bridge(d, ctx)
 
 
-def list_bridges():
+def list_bridges(ctx=None):
     ''' Return a list of the names of the bridge interfaces. '''
-    return [br for br in iterbridges()]
+    return [br for br in iterbridges(ctx)]
 
     
-def addbr(name):
+def addbr(name, ctx=None):
     ''' Create new bridge with the given name '''
-    fcntl.ioctl(ifconfig.sockfd, SIOCBRADDBR, name)
-    return Bridge(name)
+    fcntl.ioctl((ctx or context.get_context()).sockfd, SIOCBRADDBR, name)
+    return Bridge(name, ctx)
 
 
-def findif(name):
+def findif(name, ctx=None):
     ''' Find the given interface name within any of the bridges. Return the
         Bridge object corresponding to the bridge containing the interface, or
         None if no such bridge could be found. '''
-    for br in iterbridges():
-        if name in br.iterifs():
-            return br
+    current = ctx or context.get_context()
+    try:
+        links = netlink.get_links(current.netlink)
+    except EnvironmentError:
+        if current.netns is not None:
+            raise
+        for br in iterbridges(ctx):
+            if name in br.iterifs():
+                return br
+        return None
+    # One dump covers every bridge
+    bridges = dict((link.index, link.name) for link in links
+                   if link.kind == b'bridge')
+    for link in links:
+        if link.name == name and link.master in bridges:
+            return Bridge(bridges[link.master], ctx)
     return None
 
 
-def findbridge(name):
+def findbridge(name, ctx=None):
     ''' Find the given bridge. Return the Bridge object, or None if no such
         bridge could be found. '''
-    for br in iterbridges():
+    for br in iterbridges(ctx):
         if br.name == name:
             return br
     return None
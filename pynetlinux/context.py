@@ -0,0 +1,292 @@
+import contextlib
+import ctypes
+import os
+import socket
+import threading
+
+from . import netlink
+
+"""
+A Context owns the sockets used to talk to the kernel: an AF_INET socket for
+ioctls and an rtnetlink socket, opened on first use. Interfaces, bridges and
+taps can be bound to a Context; unbound ones use the calling thread's
+default, so threads never share a socket or tear down each other's.
+
+A Context can also belong to another network namespace. Sockets keep the
+namespace they were created in, so its sockets are opened once by a helper
+thread that has joined the namespace with setns(); the calling thread never
+leaves its own namespace.
+"""
+
+# From linux/sched.h
+CLONE_NEWNET = 0x40000000
+
+# Where `ip netns add` bind-mounts named namespaces
+NETNS_RUN_DIR = "/var/run/netns"
+
+# The namespace of the process itself
+SELF_NETNS_PATH = "/proc/self/ns/net"
+
+_local = threading.local()
+_default_index_cache = None
+_lock = threading.Lock()
+
+
+def _setns(fd, nstype):
+    if hasattr(os, 'setns'):
+        os.setns(fd, nstype)
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.setns(fd, nstype) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _netns_path(ns):
+    ''' Resolve a namespace name (as used by `ip netns`) or path. '''
+    if isinstance(ns, bytes):
+        ns = ns.decode('ascii')
+    if os.sep in ns:
+        return ns
+    return os.path.join(NETNS_RUN_DIR, ns)
+
+
+def _open_netns(ns):
+    ''' Return a new file descriptor for the namespace ns: a name, a path,
+        or a file descriptor, which is duplicated. '''
+    if isinstance(ns, int):
+        return os.dup(ns)
+    return os.open(_netns_path(ns), os.O_RDONLY)
+
+
+class Context(object):
+    ''' Sockets for ioctl and rtnetlink requests. If netns is given (a name
+        under /var/run/netns, a path or a file descriptor), the sockets are
+        opened in that network namespace. '''
+
+    def __init__(self, index_cache=None, netns=None):
+        self.netns = netns
+        self._netns_fd = _open_netns(netns) if netns is not None else None
+        self.sock = self.run(socket.socket, socket.AF_INET, socket.SOCK_STREAM)
+        self.sockfd = self.sock.fileno()
+        self._netlink = None
+        self._genetlink = None
+        self._index_cache = index_cache
+        self._owns_index_cache = index_cache is None
+        self.pid = os.getpid()
+
+    def __repr__(self):
+        if self.netns is not None:
+            return "<%s netns %s at 0x%x>" % (self.__class__.__name__,
+                                              self.netns, id(self))
+        return "<%s at 0x%x>" % (self.__class__.__name__, id(self))
+
+    @property
+    def netns_fd(self):
+        ''' A file descriptor for this context's network namespace, as
+            expected by IFLA_NET_NS_FD. '''
+        if self._netns_fd is None:
+            self._netns_fd = os.open(SELF_NETNS_PATH, os.O_RDONLY)
+        return self._netns_fd
+
+    def run(self, func, *args):
+        ''' Call func(*args) in this context's network namespace and return
+            its result. Only creating sockets and opening files need this;
+            the resulting descriptors can then be used from any thread. '''
+        if self.netns is None:
+            return func(*args)
+        result = []
+        def helper():
+            try:
+                _setns(self._netns_fd, CLONE_NEWNET)
+                result.append((True, func(*args)))
+            except BaseException as e:
+                result.append((False, e))
+        thread = threading.Thread(target=helper)
+        thread.start()
+        thread.join()
+        ok, value = result[0]
+        if not ok:
+            raise value
+        return value
+
+    def open(self, path, flags):
+        ''' os.open() in this context's network namespace, e.g. for
+            /dev/net/tun. '''
+        return self.run(os.open, path, flags)
+
+    @property
+    def netlink(self):
+        ''' This context's rtnetlink socket, opened on first use. '''
+        if self._netlink is None:
+            self._netlink = self.open_netlink()
+        return self._netlink
+
+    def open_netlink(self, groups=0, protocol=None):
+        ''' Open a new rtnetlink (or other protocol) socket, subscribed to
+            the given groups. '''
+        if protocol is None:
+            protocol = netlink.NETLINK_ROUTE
+        return self.run(netlink.NetlinkSocket, protocol, groups)
+
+    @property
+    def genetlink(self):
+        ''' This context's generic netlink socket, opened on first use. '''
+        if self._genetlink is None:
+            self._genetlink = self.open_netlink(protocol=netlink.NETLINK_GENERIC)
+        return self._genetlink
+
+    @property
+    def index_cache(self):
+        ''' The ifconfig.IndexCache used to resolve names in this context. '''
+        if self._index_cache is None:
+            from . import ifconfig
+            self._index_cache = ifconfig.IndexCache(ctx=self)
+        return self._index_cache
+
+    def close_netlink(self):
+        if self._netlink is not None:
+            self._netlink.close()
+            self._netlink = None
+        if self._genetlink is not None:
+            self._genetlink.close()
+            self._genetlink = None
+
+    def close(self):
+        ''' Close every socket this context owns. '''
+        self.close_netlink()
+        if self._owns_index_cache and self._index_cache is not None:
+            self._index_cache.close()
+        self._index_cache = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.sockfd = None
+        if self._netns_fd is not None:
+            os.close(self._netns_fd)
+            self._netns_fd = None
+
+
+def _shared_index_cache():
+    ''' The name cache shared by every thread's default context. '''
+    global _default_index_cache
+    with _lock:
+        if _default_index_cache is None:
+            from . import ifconfig
+            _default_index_cache = ifconfig.IndexCache()
+        return _default_index_cache
+
+
+def get_context():
+    ''' Return the calling thread's current Context: the innermost one bound
+        with using(), or else the thread's default, created on first use. '''
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    ctx = getattr(_local, 'default', None)
+    if ctx is None or (_check_pid and ctx.pid != os.getpid()):
+        ctx = _local.default = Context(index_cache=_shared_index_cache())
+    return ctx
+
+
+def netns(ns):
+    ''' Return the calling thread's Context for the network namespace ns (a
+        name under /var/run/netns, a path or a file descriptor), creating it
+        on first use. Contexts are cached by namespace identity, so a name
+        that is deleted and re-created gets a fresh one. '''
+    if isinstance(ns, int):
+        st = os.fstat(ns)
+    else:
+        st = os.stat(_netns_path(ns))
+    key = (st.st_dev, st.st_ino)
+    contexts = getattr(_local, 'netns', None)
+    if contexts is None:
+        contexts = _local.netns = {}
+    ctx = contexts.get(key)
+    if ctx is None or (_check_pid and ctx.pid != os.getpid()):
+        ctx = contexts[key] = Context(netns=ns)
+    return ctx
+
+
+@contextlib.contextmanager
+def using(ctx):
+    ''' Make ctx the calling thread's current Context within the block. '''
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(ctx)
+    try:
+        yield ctx
+    finally:
+        stack.pop()
+
+
+def shutdown():
+    ''' Close the calling thread's default Context and its namespace
+        Contexts. Other threads are not affected; new ones are created if
+        this thread needs them again. '''
+    ctx = getattr(_local, 'default', None)
+    if ctx is not None:
+        ctx.close()
+        _local.default = None
+    contexts = getattr(_local, 'netns', None)
+    if contexts:
+        for ctx in contexts.values():
+            ctx.close()
+        contexts.clear()
+
+
+class ContextPool(object):
+    ''' A small pool of Contexts that can be lent out to worker threads. '''
+
+    def __init__(self, size=4, factory=None):
+        self.size = size
+        self.factory = factory or (lambda: Context(index_cache=_shared_index_cache()))
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        ''' Take an idle Context from the pool, or create one. '''
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.factory()
+
+    def release(self, ctx):
+        ''' Return a Context to the pool, closing it if the pool is full. '''
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(ctx)
+                return
+        ctx.close()
+
+    @contextlib.contextmanager
+    def context(self):
+        ''' Borrow a Context and make it current for the block. '''
+        ctx = self.acquire()
+        try:
+            with using(ctx):
+                yield ctx
+        finally:
+            self.release(ctx)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ctx in idle:
+            ctx.close()
+
+
+def _after_fork():
+    # The child must not share netlink sockets with its parent: replies for
+    # one could be read by the other.
+    global _default_index_cache
+    _local.__dict__.clear()
+    _default_index_cache = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+    _check_pid = False
+else:
+    _check_pid = True
@@ -0,0 +1,761 @@
+import array
+import collections
+import errno
+import struct
+
+from . import context
+from . import ifreq
+from . import netlink
+from . import util
+
+"""
+ethtool requests, made with the SIOCETHTOOL ioctl or, where the kernel has
+it (5.6 and later), the ethtool generic netlink family, which can report
+on every device with a single dump. This file makes the following
+assumptions about data structures:
+
+// From linux/ethtool.h
+
+struct ethtool_link_settings {
+    __u32   cmd;
+    __u32   speed;
+    __u8    duplex;
+    __u8    port;
+    __u8    phy_address;
+    __u8    autoneg;
+    __u8    mdio_support;
+    __u8    eth_tp_mdix;
+    __u8    eth_tp_mdix_ctrl;
+    __s8    link_mode_masks_nwords;
+    __u8    transceiver;
+    __u8    master_slave_cfg;
+    __u8    master_slave_state;
+    __u8    rate_matching;
+    __u32   reserved[7];
+    __u32   link_mode_masks[];
+    /* supported, advertising and lp_advertising, nwords each */
+};
+
+struct ethtool_drvinfo {
+    __u32   cmd;
+    char    driver[32];
+    char    version[32];
+    char    fw_version[32];
+    char    bus_info[32];
+    char    erom_version[32];
+    char    reserved2[12];
+    __u32   n_priv_flags;
+    __u32   n_stats;
+    __u32   testinfo_len;
+    __u32   eedump_len;
+    __u32   regdump_len;
+};
+
+struct ethtool_sset_info {
+    __u32   cmd;
+    __u32   reserved;
+    __u64   sset_mask;      /* in: sets queried; out: sets supported */
+    __u32   data[];         /* size of each supported set */
+};
+
+struct ethtool_gstrings {
+    __u32   cmd;
+    __u32   string_set;
+    __u32   len;
+    __u8    data[];         /* len strings of ETH_GSTRING_LEN */
+};
+
+struct ethtool_stats {
+    __u32   cmd;
+    __u32   n_stats;
+    __u64   data[];
+};
+
+struct ethtool_ringparam {
+    __u32   cmd;
+    __u32   rx_max_pending;
+    __u32   rx_mini_max_pending;
+    __u32   rx_jumbo_max_pending;
+    __u32   tx_max_pending;
+    __u32   rx_pending;
+    __u32   rx_mini_pending;
+    __u32   rx_jumbo_pending;
+    __u32   tx_pending;
+};
+
+struct ethtool_channels {
+    __u32   cmd;
+    __u32   max_rx;
+    __u32   max_tx;
+    __u32   max_other;
+    __u32   max_combined;
+    __u32   rx_count;
+    __u32   tx_count;
+    __u32   other_count;
+    __u32   combined_count;
+};
+
+struct ethtool_gfeatures {
+    __u32   cmd;
+    __u32   size;           /* number of blocks */
+    struct ethtool_get_features_block {
+        __u32   available;      /* features that can be changed */
+        __u32   requested;      /* features requested to be on */
+        __u32   active;         /* features that are on */
+        __u32   never_changed;  /* features that are fixed */
+    } features[];
+};
+
+struct ethtool_sfeatures {
+    __u32   cmd;
+    __u32   size;
+    struct ethtool_set_features_block {
+        __u32   valid;          /* features to change */
+        __u32   requested;      /* their new values */
+    } features[];
+};
+
+struct ethtool_coalesce {
+    __u32   cmd;
+    __u32   rx_coalesce_usecs;
+    ...                             /* 22 __u32 fields, see Coalesce */
+};
+"""
+
+# From linux/ethtool.h
+ETHTOOL_GDRVINFO = 0x00000003
+ETHTOOL_GLINK = 0x0000000a
+ETHTOOL_GCOALESCE = 0x0000000e
+ETHTOOL_SCOALESCE = 0x0000000f
+ETHTOOL_GRINGPARAM = 0x00000010
+ETHTOOL_SRINGPARAM = 0x00000011
+ETHTOOL_GSTRINGS = 0x0000001b
+ETHTOOL_GSTATS = 0x0000001d
+ETHTOOL_GSSET_INFO = 0x00000037
+ETHTOOL_GFEATURES = 0x0000003a
+ETHTOOL_SFEATURES = 0x0000003b
+ETHTOOL_GCHANNELS = 0x0000003c
+ETHTOOL_SCHANNELS = 0x0000003d
+ETHTOOL_GLINKSETTINGS = 0x0000004c
+
+ETH_GSTRING_LEN = 32
+
+# ETHTOOL_SFEATURES return flags
+ETHTOOL_F_UNSUPPORTED = 1 << 0
+ETHTOOL_F_WISH = 1 << 1
+ETHTOOL_F_COMPAT = 1 << 2
+
+# String sets
+ETH_SS_TEST = 0
+ETH_SS_STATS = 1
+ETH_SS_PRIV_FLAGS = 2
+ETH_SS_FEATURES = 4
+
+SPEED_UNKNOWN = 0xffffffff
+DUPLEX_HALF = 0x00
+DUPLEX_FULL = 0x01
+DUPLEX_UNKNOWN = 0xff
+AUTONEG_DISABLE = 0x00
+AUTONEG_ENABLE = 0x01
+
+# Bit numbers in the link mode masks (enum ethtool_link_mode_bit_indices)
+LINK_MODE_10baseT_Half = 0
+LINK_MODE_10baseT_Full = 1
+LINK_MODE_100baseT_Half = 2
+LINK_MODE_100baseT_Full = 3
+LINK_MODE_1000baseT_Half = 4
+LINK_MODE_1000baseT_Full = 5
+LINK_MODE_Autoneg = 6
+LINK_MODE_TP = 7
+LINK_MODE_AUI = 8
+LINK_MODE_MII = 9
+LINK_MODE_FIBRE = 10
+LINK_MODE_BNC = 11
+LINK_MODE_10000baseT_Full = 12
+LINK_MODE_Pause = 13
+LINK_MODE_Asym_Pause = 14
+LINK_MODE_2500baseX_Full = 15
+LINK_MODE_Backplane = 16
+LINK_MODE_1000baseKX_Full = 17
+LINK_MODE_10000baseKX4_Full = 18
+LINK_MODE_10000baseKR_Full = 19
+LINK_MODE_10000baseR_FEC = 20
+LINK_MODE_20000baseMLD2_Full = 21
+LINK_MODE_20000baseKR2_Full = 22
+LINK_MODE_40000baseKR4_Full = 23
+LINK_MODE_40000baseCR4_Full = 24
+LINK_MODE_40000baseSR4_Full = 25
+LINK_MODE_40000baseLR4_Full = 26
+LINK_MODE_56000baseKR4_Full = 27
+LINK_MODE_56000baseCR4_Full = 28
+LINK_MODE_56000baseSR4_Full = 29
+LINK_MODE_56000baseLR4_Full = 30
+LINK_MODE_25000baseCR_Full = 31
+LINK_MODE_25000baseKR_Full = 32
+LINK_MODE_25000baseSR_Full = 33
+LINK_MODE_50000baseCR2_Full = 34
+LINK_MODE_50000baseKR2_Full = 35
+LINK_MODE_100000baseKR4_Full = 36
+LINK_MODE_100000baseSR4_Full = 37
+LINK_MODE_100000baseCR4_Full = 38
+LINK_MODE_100000baseLR4_ER4_Full = 39
+LINK_MODE_50000baseSR2_Full = 40
+LINK_MODE_1000baseX_Full = 41
+LINK_MODE_10000baseCR_Full = 42
+LINK_MODE_10000baseSR_Full = 43
+LINK_MODE_10000baseLR_Full = 44
+LINK_MODE_10000baseLRM_Full = 45
+LINK_MODE_10000baseER_Full = 46
+LINK_MODE_2500baseT_Full = 47
+LINK_MODE_5000baseT_Full = 48
+
+# From linux/ethtool_netlink.h
+ETHTOOL_GENL_NAME = b"ethtool"
+
+ETHTOOL_MSG_LINKMODES_GET = 4
+ETHTOOL_MSG_LINKSTATE_GET = 6
+
+ETHTOOL_A_HEADER_DEV_INDEX = 1
+ETHTOOL_A_HEADER_DEV_NAME = 2
+ETHTOOL_A_HEADER_FLAGS = 3
+
+ETHTOOL_FLAG_COMPACT_BITSETS = 1 << 0
+
+ETHTOOL_A_BITSET_NOMASK = 1
+ETHTOOL_A_BITSET_SIZE = 2
+ETHTOOL_A_BITSET_BITS = 3
+ETHTOOL_A_BITSET_VALUE = 4
+ETHTOOL_A_BITSET_MASK = 5
+
+ETHTOOL_A_LINKMODES_HEADER = 1
+ETHTOOL_A_LINKMODES_AUTONEG = 2
+ETHTOOL_A_LINKMODES_OURS = 3
+ETHTOOL_A_LINKMODES_PEER = 4
+ETHTOOL_A_LINKMODES_SPEED = 5
+ETHTOOL_A_LINKMODES_DUPLEX = 6
+
+ETHTOOL_A_LINKSTATE_HEADER = 1
+ETHTOOL_A_LINKSTATE_LINK = 2
+
+LINK_SETTINGS = struct.Struct('=IIBBBBBBBbBBBB7I')  # struct ethtool_link_settings
+VALUE = struct.Struct('=II')                        # struct ethtool_value
+DRVINFO = struct.Struct('=I32s32s32s32s32s12xIIIII')  # struct ethtool_drvinfo
+SSET_INFO = struct.Struct('=IIQI')  # struct ethtool_sset_info, for one set
+GSTRINGS = struct.Struct('=III')    # struct ethtool_gstrings header
+STATS = struct.Struct('=II')        # struct ethtool_stats header
+RINGPARAM = struct.Struct('=9I')    # struct ethtool_ringparam
+CHANNELS = struct.Struct('=9I')     # struct ethtool_channels
+COALESCE = struct.Struct('=23I')    # struct ethtool_coalesce
+FEATURES = struct.Struct('=II')     # struct ethtool_[gs]features header
+GET_FEATURES_BLOCK = struct.Struct('=IIII')
+SET_FEATURES_BLOCK = struct.Struct('=II')
+# Index of link_mode_masks_nwords in LINK_SETTINGS, and the zeroed fields
+# around it
+_NWORDS = 9
+_BEFORE_NWORDS = (0,) * 8
+_AFTER_NWORDS = (0,) * 11
+
+# speed is in Mb/s; speed, duplex and autoneg are None when unknown. The
+# link mode masks are ints with bit LINK_MODE_* set for each mode.
+LinkSettings = collections.namedtuple('LinkSettings', [
+    'speed', 'duplex', 'autoneg', 'link', 'supported', 'advertising',
+    'lp_advertising'])
+
+DriverInfo = collections.namedtuple('DriverInfo', [
+    'driver', 'version', 'fw_version', 'bus_info', 'n_priv_flags', 'n_stats'])
+
+# Tunables, in struct order (without cmd). The max_* fields are read-only.
+RingParam = collections.namedtuple('RingParam', [
+    'rx_max_pending', 'rx_mini_max_pending', 'rx_jumbo_max_pending',
+    'tx_max_pending', 'rx_pending', 'rx_mini_pending', 'rx_jumbo_pending',
+    'tx_pending'])
+
+Channels = collections.namedtuple('Channels', [
+    'max_rx', 'max_tx', 'max_other', 'max_combined', 'rx_count', 'tx_count',
+    'other_count', 'combined_count'])
+
+Coalesce = collections.namedtuple('Coalesce', [
+    'rx_coalesce_usecs', 'rx_max_coalesced_frames', 'rx_coalesce_usecs_irq',
+    'rx_max_coalesced_frames_irq', 'tx_coalesce_usecs',
+    'tx_max_coalesced_frames', 'tx_coalesce_usecs_irq',
+    'tx_max_coalesced_frames_irq', 'stats_block_coalesce_usecs',
+    'use_adaptive_rx_coalesce', 'use_adaptive_tx_coalesce', 'pkt_rate_low',
+    'rx_coalesce_usecs_low', 'rx_max_coalesced_frames_low',
+    'tx_coalesce_usecs_low', 'tx_max_coalesced_frames_low', 'pkt_rate_high',
+    'rx_coalesce_usecs_high', 'rx_max_coalesced_frames_high',
+    'tx_coalesce_usecs_high', 'tx_max_coalesced_frames_high',
+    'rate_sample_interval'])
+
+# The state of one offload feature, as bools. available means it can be
+# changed; never_changed means it is fixed.
+Feature = collections.namedtuple('Feature', [
+    'available', 'requested', 'active', 'never_changed'])
+
+# `ethtool -K` names for groups of features
+FEATURE_ALIASES = {
+    'rx': ('rx-checksum',),
+    'tx': ('tx-checksum-ipv4', 'tx-checksum-ip-generic', 'tx-checksum-ipv6',
+           'tx-checksum-fcoe-crc', 'tx-checksum-sctp'),
+    'sg': ('tx-scatter-gather', 'tx-scatter-gather-fraglist'),
+    'tso': ('tx-tcp-segmentation', 'tx-tcp-ecn-segmentation',
+            'tx-tcp-mangleid-segmentation', 'tx-tcp6-segmentation'),
+    'gso': ('tx-generic-segmentation',),
+    'gro': ('rx-gro',),
+    'lro': ('rx-lro',),
+}
+
+# The outcome of applying one kind of setting to one interface: changed is
+# False if it was already in effect; error is None or the exception.
+Applied = collections.namedtuple('Applied', ['op', 'name', 'changed', 'error'])
+
+if util.PY3:
+    _COUNTER_TYPECODE = 'Q'
+else:
+    _COUNTER_TYPECODE = 'L'
+
+# Words per link mode mask, learnt from the kernel on first use
+_nwords = None
+_masks = None
+_family_id = None
+
+# StringTables by (driver, string set, size)
+_string_tables = {}
+
+
+def _mask(words):
+    value = 0
+    for i, word in enumerate(words):
+        value |= word << (32 * i)
+    return value
+
+
+def _make_settings(speed, duplex, autoneg, link, supported, advertising,
+                   lp_advertising):
+    return LinkSettings(
+        speed=None if speed in (0, SPEED_UNKNOWN) else speed,
+        duplex=None if duplex == DUPLEX_UNKNOWN else duplex == DUPLEX_FULL,
+        autoneg=None if autoneg is None else autoneg == AUTONEG_ENABLE,
+        link=link,
+        supported=supported,
+        advertising=advertising,
+        lp_advertising=lp_advertising)
+
+
+def _glinksettings(sockfd, name):
+    ''' Issue ETHTOOL_GLINKSETTINGS and return (fields, masks), where masks
+        is the three link mode masks as tuples of words. '''
+    global _nwords, _masks
+    buf = ifreq.ethtool_buffer()
+    for _attempt in range(2):
+        nwords = _nwords or 0
+        LINK_SETTINGS.pack_into(buf, 0, ETHTOOL_GLINKSETTINGS, *(
+            _BEFORE_NWORDS + (nwords,) + _AFTER_NWORDS))
+        ifreq.ethtool_raw(sockfd, name)
+        fields = LINK_SETTINGS.unpack_from(buf)
+        if nwords and fields[_NWORDS] == nwords:
+            words = _masks.unpack_from(buf, LINK_SETTINGS.size)
+            return fields, (words[:nwords], words[nwords:2 * nwords],
+                            words[2 * nwords:])
+        # Handshake: the kernel answers a request with the wrong number of
+        # words with minus the right one, once per process.
+        _nwords = -fields[_NWORDS]
+        _masks = struct.Struct('=%dI' % (3 * _nwords))
+    raise IOError(errno.EPROTO, "link mode mask size handshake failed")
+
+
+def get_link_settings(name, ctx=None):
+    ''' Return the LinkSettings of the named interface, using
+        ETHTOOL_GLINKSETTINGS and ETHTOOL_GLINK. Raises IOError (e.g.
+        EOPNOTSUPP) if the driver does not report them. '''
+    sockfd = (ctx or context.get_context()).sockfd
+    fields, masks = _glinksettings(sockfd, name)
+    link = bool(ifreq.ethtool(sockfd, name, VALUE, ETHTOOL_GLINK, 0)[1])
+    return _make_settings(fields[1], fields[2], fields[5], link,
+                          *[_mask(m) for m in masks])
+
+
+def get_drvinfo(name, ctx=None):
+    ''' Return the DriverInfo of the named interface. '''
+    sockfd = (ctx or context.get_context()).sockfd
+    res = ifreq.ethtool(sockfd, name, DRVINFO, ETHTOOL_GDRVINFO,
+                        b'', b'', b'', b'', b'', 0, 0, 0, 0, 0)
+    return DriverInfo(*[netlink.attr_str(v) for v in res[1:5]] +
+                      list(res[6:8]))
+
+
+def _sset_count(sockfd, name, sset):
+    ''' Return the number of strings in the named interface's string set
+        sset, or None if the driver has no such set. '''
+    res = ifreq.ethtool(sockfd, name, SSET_INFO, ETHTOOL_GSSET_INFO, 0,
+                        1 << sset, 0)
+    return res[3] if res[2] & (1 << sset) else None
+
+
+def _native(value):
+    value = netlink.attr_str(value)
+    return value.decode('ascii', 'replace') if util.PY3 else value
+
+
+class StringTable(object):
+    ''' The names in an ethtool string set, and the position of each. '''
+
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.index = dict((n, i) for i, n in enumerate(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "<%s of %d at 0x%x>" % (self.__class__.__name__, len(self), id(self))
+
+
+def _string_table(sockfd, name, sset, driver, count):
+    key = (driver, sset, count)
+    table = _string_tables.get(key)
+    if table is None:
+        buf = array.array('B', b'\x00' * (GSTRINGS.size + count * ETH_GSTRING_LEN))
+        GSTRINGS.pack_into(buf, 0, ETHTOOL_GSTRINGS, sset, count)
+        ifreq.ethtool_raw(sockfd, name, buf)
+        data = util.array_tobytes(buf)
+        end = GSTRINGS.size + GSTRINGS.unpack_from(data)[2] * ETH_GSTRING_LEN
+        table = _string_tables[key] = StringTable(
+            _native(data[offset:offset + ETH_GSTRING_LEN])
+            for offset in range(GSTRINGS.size, end, ETH_GSTRING_LEN))
+    return table
+
+
+def get_string_table(name, sset, ctx=None):
+    ''' Return the StringTable of string set sset (ETH_SS_*) of the named
+        interface. Tables are cached by driver and size, so interfaces with
+        the same driver share one. Raises IOError (EOPNOTSUPP) if the driver
+        has no such set. '''
+    sockfd = (ctx or context.get_context()).sockfd
+    count = _sset_count(sockfd, name, sset)
+    if count is None:
+        raise IOError(errno.EOPNOTSUPP, "no string set %d" % sset)
+    return _string_table(sockfd, name, sset, get_drvinfo(name, ctx).driver,
+                         count)
+
+
+class StatsReader(object):
+    '''
+    Reads the driver statistics (ETHTOOL_GSTATS) of one interface, e.g. per
+    queue drops and rx_missed, which /proc/net/dev folds together.
+
+    read() fills a preallocated array in place and returns it: two ioctls,
+    one to check the number of counters (the kernel writes as many as it
+    has, whatever the buffer size) and one for the values. table maps the
+    positions in it to counter names; it is looked up once, and shared with
+    other interfaces with the same driver.
+    '''
+
+    def __init__(self, name, ctx=None):
+        self.name = name
+        self.ctx = ctx
+        self.driver = get_drvinfo(name, ctx).driver
+        self.table = None
+        self._buf = None
+        self.values = None
+        self._setup((ctx or context.get_context()).sockfd)
+
+    def __repr__(self):
+        return "<%s %s at 0x%x>" % (self.__class__.__name__, self.name, id(self))
+
+    def _setup(self, sockfd):
+        count = _sset_count(sockfd, self.name, ETH_SS_STATS)
+        if count is None:
+            raise IOError(errno.EOPNOTSUPP, "no driver statistics")
+        self.table = _string_table(sockfd, self.name, ETH_SS_STATS,
+                                   self.driver, count)
+        # The ethtool_stats header takes the first slot
+        self._buf = array.array(_COUNTER_TYPECODE, [0] * (count + 1))
+        if util.PY3:
+            self.values = memoryview(self._buf)[1:]
+
+    def read(self):
+        ''' Read the counters. Returns a sequence in table.names order,
+            which on Python 3 is updated in place by the next read(). '''
+        sockfd = (self.ctx or context.get_context()).sockfd
+        if _sset_count(sockfd, self.name, ETH_SS_STATS) != len(self.table):
+            self._setup(sockfd)
+        STATS.pack_into(self._buf, 0, ETHTOOL_GSTATS, len(self.table))
+        ifreq.ethtool_raw(sockfd, self.name, self._buf)
+        if self.values is None:
+            return self._buf[1:]
+        return self.values
+
+    def get(self, counter):
+        ''' Return the named counter as of the last read(). '''
+        return self._buf[self.table.index[counter] + 1]
+
+    def as_dict(self):
+        ''' Return the counters of the last read() as a dict. '''
+        return dict(zip(self.table.names, self._buf[1:]))
+
+
+def get_stats(name, ctx=None):
+    ''' Return a dict of the named interface's driver statistics. '''
+    reader = StatsReader(name, ctx)
+    reader.read()
+    return reader.as_dict()
+
+
+# op -> (codec, get command, set command, namedtuple), in the order apply()
+# writes them: channel changes can reset a driver's rings.
+_TUNABLES = collections.OrderedDict([
+    ('channels', (CHANNELS, ETHTOOL_GCHANNELS, ETHTOOL_SCHANNELS, Channels)),
+    ('ring', (RINGPARAM, ETHTOOL_GRINGPARAM, ETHTOOL_SRINGPARAM, RingParam)),
+    ('coalesce', (COALESCE, ETHTOOL_GCOALESCE, ETHTOOL_SCOALESCE, Coalesce)),
+])
+
+
+def _get_tunable(sockfd, name, op):
+    codec, get_cmd, _set_cmd, result = _TUNABLES[op]
+    return result._make(ifreq.ethtool(sockfd, name, codec, get_cmd,
+                                      *(0,) * len(result._fields))[1:])
+
+
+def _set_tunable(sockfd, name, op, changes):
+    ''' Apply changes (a dict of fields) to the current settings and write
+        them back unless they are already in effect. Returns whether a write
+        was made. '''
+    codec, _get_cmd, set_cmd, _result = _TUNABLES[op]
+    current = _get_tunable(sockfd, name, op)
+    wanted = current._replace(**changes)
+    if wanted == current:
+        return False
+    ifreq.ethtool(sockfd, name, codec, set_cmd, *wanted)
+    return True
+
+
+def get_ringparam(name, ctx=None):
+    ''' Return the RingParam (ring sizes) of the named interface. '''
+    return _get_tunable((ctx or context.get_context()).sockfd, name, 'ring')
+
+
+def set_ringparam(name, ctx=None, **changes):
+    ''' Change ring sizes, e.g. set_ringparam(name, rx_pending=4096).
+        Equivalent to ethtool -G. Returns False, without writing, if they
+        are already set. '''
+    return _set_tunable((ctx or context.get_context()).sockfd, name, 'ring',
+                        changes)
+
+
+def get_channels(name, ctx=None):
+    ''' Return the Channels (queue counts) of the named interface. '''
+    return _get_tunable((ctx or context.get_context()).sockfd, name,
+                        'channels')
+
+
+def set_channels(name, ctx=None, **changes):
+    ''' Change queue counts, e.g. set_channels(name, combined_count=8).
+        Equivalent to ethtool -L. Returns False, without writing, if they
+        are already set. '''
+    return _set_tunable((ctx or context.get_context()).sockfd, name,
+                        'channels', changes)
+
+
+def get_coalesce(name, ctx=None):
+    ''' Return the Coalesce (interrupt coalescing) settings of the named
+        interface. '''
+    return _get_tunable((ctx or context.get_context()).sockfd, name,
+                        'coalesce')
+
+
+def set_coalesce(name, ctx=None, **changes):
+    ''' Change interrupt coalescing, e.g. set_coalesce(name,
+        rx_coalesce_usecs=50). Equivalent to ethtool -C. Returns False,
+        without writing, if it is already set. '''
+    return _set_tunable((ctx or context.get_context()).sockfd, name,
+                        'coalesce', changes)
+
+
+def _gfeatures(sockfd, name, nblocks):
+    ''' Issue ETHTOOL_GFEATURES and return the kernel's block count and
+        the available, requested, active and never_changed masks. '''
+    buf = ifreq.ethtool_buffer()
+    FEATURES.pack_into(buf, 0, ETHTOOL_GFEATURES, nblocks)
+    ifreq.ethtool_raw(sockfd, name)
+    size = FEATURES.unpack_from(buf)[1]
+    masks = [0, 0, 0, 0]
+    for i in range(min(size, nblocks)):
+        block = GET_FEATURES_BLOCK.unpack_from(
+            buf, FEATURES.size + i * GET_FEATURES_BLOCK.size)
+        for j in range(4):
+            masks[j] |= block[j] << (32 * i)
+    return size, masks
+
+
+def _feature_table(sockfd, name, ctx):
+    count = _sset_count(sockfd, name, ETH_SS_FEATURES)
+    if count is None:
+        raise IOError(errno.EOPNOTSUPP, "no feature names")
+    return _string_table(sockfd, name, ETH_SS_FEATURES,
+                         get_drvinfo(name, ctx).driver, count)
+
+
+def get_features(name, ctx=None):
+    ''' Return a dict mapping the name of each of the interface's offload
+        features (e.g. 'rx-gro') to a Feature. '''
+    sockfd = (ctx or context.get_context()).sockfd
+    table = _feature_table(sockfd, name, ctx)
+    _size, masks = _gfeatures(sockfd, name, (len(table) + 31) // 32)
+    return dict((feature, Feature(*[bool(m >> i & 1) for m in masks]))
+                for i, feature in enumerate(table.names))
+
+
+def set_features(name, changes, ctx=None):
+    ''' Turn offload features on or off. changes maps feature names, or
+        the `ethtool -K` names in FEATURE_ALIASES, to bools. Returns a dict
+        mapping each feature name to whether it is now in the requested
+        state: the kernel silently keeps fixed features, and may turn off
+        features that depend on others. Nothing is written if every feature
+        is already as requested. '''
+    sockfd = (ctx or context.get_context()).sockfd
+    table = _feature_table(sockfd, name, ctx)
+    wanted = {}
+    for feature, on in changes.items():
+        if feature in table.index:
+            wanted[feature] = bool(on)
+        elif feature in FEATURE_ALIASES:
+            for alias in FEATURE_ALIASES[feature]:
+                if alias in table.index:
+                    wanted[alias] = bool(on)
+        else:
+            raise ValueError("unknown feature %r" % feature)
+
+    nblocks = (len(table) + 31) // 32
+    size, masks = _gfeatures(sockfd, name, nblocks)
+    valid = requested = 0
+    for feature, on in wanted.items():
+        bit = 1 << table.index[feature]
+        if bool(masks[1] & bit) != on or bool(masks[2] & bit) != on:
+            valid |= bit
+            if on:
+                requested |= bit
+
+    if valid:
+        buf = ifreq.ethtool_buffer()
+        FEATURES.pack_into(buf, 0, ETHTOOL_SFEATURES, size)
+        for i in range(size):
+            SET_FEATURES_BLOCK.pack_into(
+                buf, FEATURES.size + i * SET_FEATURES_BLOCK.size,
+                valid >> (32 * i) & 0xffffffff,
+                requested >> (32 * i) & 0xffffffff)
+        ifreq.ethtool_raw(sockfd, name)
+        _size, masks = _gfeatures(sockfd, name, nblocks)
+
+    return dict((feature, bool(masks[2] >> table.index[feature] & 1) == on)
+                for feature, on in wanted.items())
+
+
+def apply(config, ctx=None):
+    ''' Apply settings to many interfaces. config maps interface names to
+        dicts with any of the keys 'channels', 'ring' and 'coalesce', each a
+        dict of field changes as taken by set_channels() etc. Settings that
+        are already in effect are not written, and a failure does not stop
+        the rest. Returns a list of Applied, one per interface and key. '''
+    # Refuse bad keys before anything is written
+    for settings in config.values():
+        for op, changes in settings.items():
+            if op not in _TUNABLES:
+                raise ValueError("unknown setting %r" % op)
+            fields = _TUNABLES[op][3]._fields
+            for field in changes:
+                if field not in fields:
+                    raise ValueError("unknown %s field %r" % (op, field))
+
+    sockfd = (ctx or context.get_context()).sockfd
+    results = []
+    for name, settings in config.items():
+        for op in _TUNABLES:
+            if op not in settings:
+                continue
+            try:
+                changed = _set_tunable(sockfd, name, op, settings[op])
+            except EnvironmentError as e:
+                results.append(Applied(op, name, False, e))
+            else:
+                results.append(Applied(op, name, changed, None))
+    return results
+
+
+def _get_family_id(ctx):
+    global _family_id
+    if _family_id is None:
+        _family_id = netlink.get_family_id(ETHTOOL_GENL_NAME, ctx.genetlink)
+    return _family_id
+
+
+def _dump(ctx, cmd):
+    ''' Dump cmd for every device. Yield (name, attrs) for each reply. '''
+    header = netlink.pack_attr(
+        ETHTOOL_A_HEADER_FLAGS, netlink.U32.pack(ETHTOOL_FLAG_COMPACT_BITSETS))
+    msg = netlink.GENLMSGHDR.pack(cmd, 1)
+    msg += netlink.pack_attr(1 | netlink.NLA_F_NESTED, header)
+    for _msg_type, payload in ctx.genetlink.dump(_get_family_id(ctx), msg):
+        attrs = netlink.parse_attrs(payload, netlink.GENLMSGHDR.size)
+        name = netlink.parse_attrs(attrs[1]).get(ETHTOOL_A_HEADER_DEV_NAME)
+        if name is not None:
+            yield netlink.attr_str(name), attrs
+
+
+def _bitset(value):
+    ''' Decode a compact bitset attribute into (value, mask). '''
+    attrs = netlink.parse_attrs(value)
+    result = []
+    for attr in (ETHTOOL_A_BITSET_VALUE, ETHTOOL_A_BITSET_MASK):
+        data = attrs.get(attr, b'')
+        result.append(_mask(struct.unpack('=%dI' % (len(data) // 4), data)))
+    return result
+
+
+def _scan_genetlink(ctx):
+    links = {}
+    for name, attrs in _dump(ctx, ETHTOOL_MSG_LINKSTATE_GET):
+        if ETHTOOL_A_LINKSTATE_LINK in attrs:
+            links[name] = bool(netlink.U8.unpack(attrs[ETHTOOL_A_LINKSTATE_LINK])[0])
+
+    result = {}
+    for name, attrs in _dump(ctx, ETHTOOL_MSG_LINKMODES_GET):
+        advertising, supported = _bitset(attrs.get(ETHTOOL_A_LINKMODES_OURS, b''))
+        lp_advertising, _ = _bitset(attrs.get(ETHTOOL_A_LINKMODES_PEER, b''))
+        speed = attrs.get(ETHTOOL_A_LINKMODES_SPEED)
+        duplex = attrs.get(ETHTOOL_A_LINKMODES_DUPLEX)
+        autoneg = attrs.get(ETHTOOL_A_LINKMODES_AUTONEG)
+        result[name] = _make_settings(
+            netlink.attr_u32(speed) if speed is not None else SPEED_UNKNOWN,
+            netlink.U8.unpack(duplex)[0] if duplex is not None else DUPLEX_UNKNOWN,
+            netlink.U8.unpack(autoneg)[0] if autoneg is not None else None,
+            links.get(name), supported, advertising, lp_advertising)
+    return result
+
+
+def _scan_ioctl(ctx):
+    result = {}
+    for link in netlink.get_links(ctx.netlink):
+        try:
+            fields, masks = _glinksettings(ctx.sockfd, link.name)
+        except IOError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENODEV):
+                continue
+            raise
+        result[link.name] = _make_settings(
+            fields[1], fields[2], fields[5],
+            bool(link.flags & netlink.IFF_LOWER_UP), *[_mask(m) for m in masks])
+    return result
+
+
+def scan_links(ctx=None):
+    ''' Return a dict mapping the name of every interface whose driver
+        reports link settings to its LinkSettings. Where ethtool netlink is
+        available this takes two dumps; otherwise one rtnetlink dump and an
+        ETHTOOL_GLINKSETTINGS ioctl per interface. '''
+    ctx = ctx or context.get_context()
+    try:
+        return _scan_genetlink(ctx)
+    except EnvironmentError:
+        return _scan_ioctl(ctx)
@@ -1,12 +1,22 @@
+import collections
+import errno
 import fcntl
 import os
-import re
+import select
 import socket
 import struct
+import threading
 import ctypes
 import array
 import math
 
+from . import context
+from . import ethtool
+from . import ifreq
+from . import netlink
+from . import steering
+from . import util
+
 """
 This file makes the following assumptions about data structures:
 
@@ -62,9 +72,14 @@ struct ethtool_cmd {
     __u8    phy_address;
     __u8    transceiver;    /* Which transceiver to use */
     __u8    autoneg;        /* Enable or disable autonegotiation */
+    __u8    mdio_support;
     __u32   maxtxpkt;       /* Tx pkts before generating tx int */
     __u32   maxrxpkt;       /* Rx pkts before generating rx int */
-    __u32   reserved[4];
+    __u16   speed_hi;       /* The forced speed (upper bits) */
+    __u8    eth_tp_mdix;
+    __u8    eth_tp_mdix_ctrl;
+    __u32   lp_advertising; /* Features the link partner advertises */
+    __u32   reserved[2];
 };
 
 struct ethtool_value {
@@ -78,6 +93,7 @@ SYSFS_NET_PATH = b"/sys/class/net"
 PROCFS_NET_PATH = b"/proc/net/dev"
 
 # From linux/sockios.h
+SIOCGIFNAME = 0x8910
 SIOCGIFCONF = 0x8912
 SIOCGIFINDEX = 0x8933
 SIOCGIFFLAGS =  0x8913
@@ -92,6 +108,7 @@ SIOCETHTOOL = 0x8946
 
 # From linux/if.h
 IFF_UP       = 0x1
+IFF_LOOPBACK = 0x8
 
 # From linux/socket.h
 AF_UNIX      = 1
@@ -117,10 +134,26 @@ ADVERTISED_FIBRE = (1 << 10)
 ADVERTISED_BNC = (1 << 11)
 ADVERTISED_10000baseT_Full = (1 << 12)
 
-# This is probably not cross-platform
-SIZE_OF_IFREQ = 40
+ETHTOOL_CMD = struct.Struct('=IIIHBBBBBBIIHBBI2I')  # struct ethtool_cmd
+ETHTOOL_VALUE = struct.Struct('=II')                # struct ethtool_value
+ETHTOOL_PAUSEPARAM = struct.Struct('=IIII')         # struct ethtool_pauseparam
+# Every ethtool_cmd field after cmd, zeroed
+_ETHTOOL_CMD_EMPTY = (0,) * 17
+
+# Column order of /proc/net/dev
+STATS_TITLES = ["rx_bytes", "rx_packets", "rx_errs", "rx_drop", "rx_fifo",
+                "rx_frame", "rx_compressed", "rx_multicast", "tx_bytes",
+                "tx_packets", "tx_errs", "tx_drop", "tx_fifo", "tx_colls",
+                "tx_carrier", "tx_compressed"]
+
+SIZE_OF_IFREQ = ifreq.SIZE_OF_IFREQ
+
+# Immutable view of a link's state; addresses is a tuple of netlink.Address.
+Snapshot = collections.namedtuple('Snapshot', [
+    'name', 'index', 'flags', 'mac', 'mtu', 'operstate', 'addresses'])
 
-# Globals
+# Globals. Kept for backwards compatibility; the library itself uses the
+# sockets of a context.Context.
 sock = None
 sockfd = None
 
@@ -130,58 +163,64 @@ if not os.path.isdir(SYSFS_NET_PATH):
 if not os.path.exists(PROCFS_NET_PATH):
     raise ImportError("Path %s not found. This module requires procfs." % PROCFS_NET_PATH)
 
+def _link_setting(field):
+    ''' A property reading and writing one of netlink.LINK_SETTINGS. '''
+    def fget(self):
+        return getattr(self.get_link(), field)
+
+    def fset(self, value):
+        self.set_link(**{field: value})
+
+    return property(fget, fset, doc="The link's %s." % field)
+
+
 class Interface(object):
     ''' Class representing a Linux network device. '''
 
-    def __init__(self, name):
+    def __init__(self, name, ctx=None):
         self.name = name
+        self._ctx = ctx
 
     def __repr__(self):
         return "<%s %s at 0x%x>" % (self.__class__.__name__, self.name, id(self))
 
+    @property
+    def ctx(self):
+        ''' The context.Context this interface is bound to, or the calling
+            thread's current one. '''
+        return self._ctx or context.get_context()
+
     def up(self):
         ''' Bring up the bridge interface. Equivalent to ifconfig [iface] up. '''
 
         # Get existing device flags
-        ifreq = struct.pack('16sh', self.name, 0)
-        flags = struct.unpack('16sh', fcntl.ioctl(sockfd, SIOCGIFFLAGS, ifreq))[1]
+        flags = ifreq.ioctl(self.ctx.sockfd, SIOCGIFFLAGS, ifreq.FLAGS, self.name, 0)[1]
 
         # Set new flags
         flags = flags | IFF_UP
-        ifreq = struct.pack('16sh', self.name, flags)
-        fcntl.ioctl(sockfd, SIOCSIFFLAGS, ifreq)
+        ifreq.ioctl(self.ctx.sockfd, SIOCSIFFLAGS, ifreq.FLAGS, self.name, flags)
 
     def down(self):
         ''' Bring down the bridge interface. Equivalent to ifconfig [iface] down. '''
 
         # Get existing device flags
-        ifreq = struct.pack('16sh', self.name, 0)
-        flags = struct.unpack('16sh', fcntl.ioctl(sockfd, SIOCGIFFLAGS, ifreq))[1]
+        flags = ifreq.ioctl(self.ctx.sockfd, SIOCGIFFLAGS, ifreq.FLAGS, self.name, 0)[1]
 
         # Set new flags
         flags = flags & ~IFF_UP
-        ifreq = struct.pack('16sh', self.name, flags)
-        fcntl.ioctl(sockfd, SIOCSIFFLAGS, ifreq)
+        ifreq.ioctl(self.ctx.sockfd, SIOCSIFFLAGS, ifreq.FLAGS, self.name, flags)
 
     def is_up(self):
         ''' Return True if the interface is up, False otherwise. '''
 
         # Get existing device flags
-        ifreq = struct.pack('16sh', self.name, 0)
-        flags = struct.unpack('16sh', fcntl.ioctl(sockfd, SIOCGIFFLAGS, ifreq))[1]
-
-        # Set new flags
-        if flags & IFF_UP:
-            return True
-        else:
-            return False
+        flags = ifreq.ioctl(self.ctx.sockfd, SIOCGIFFLAGS, ifreq.FLAGS, self.name, 0)[1]
+        return bool(flags & IFF_UP)
 
     def get_mac(self):
         ''' Obtain the device's mac address. '''
-        ifreq = struct.pack('16sH14s', self.name, AF_UNIX, b'\x00'*14)
-        res = fcntl.ioctl(sockfd, SIOCGIFHWADDR, ifreq)
-        address = struct.unpack('16sH14s', res)[2]
-        mac = struct.unpack('6B8x', address)
+        mac = ifreq.ioctl(self.ctx.sockfd, SIOCGIFHWADDR, ifreq.HWADDR, self.name,
+                          AF_UNIX, 0, 0, 0, 0, 0, 0)[2:]
 
         return ":".join(['%02X' % i for i in mac])
 
@@ -190,34 +229,33 @@ class Interface(object):
         ''' Set the device's mac address. Device must be down for this to
             succeed. '''
         macbytes = [int(i, 16) for i in newmac.split(':')]
-        ifreq = struct.pack('16sH6B8x', self.name, AF_UNIX, *macbytes)
-        fcntl.ioctl(sockfd, SIOCSIFHWADDR, ifreq)
+        ifreq.ioctl(self.ctx.sockfd, SIOCSIFHWADDR, ifreq.HWADDR, self.name, AF_UNIX,
+                    *macbytes)
 
 
     def get_ip(self):
-        ifreq = struct.pack('16sH14s', self.name, AF_INET, b'\x00'*14)
         try:
-            res = fcntl.ioctl(sockfd, SIOCGIFADDR, ifreq)
+            res = ifreq.ioctl(self.ctx.sockfd, SIOCGIFADDR, ifreq.INADDR, self.name,
+                              AF_INET, b'')
         except IOError:
             return None
-        ip = struct.unpack('16sH2x4s8x', res)[2]
 
-        return socket.inet_ntoa(ip)
+        return socket.inet_ntoa(res[2])
 
 
     def set_ip(self, newip):
         ipbytes = socket.inet_aton(newip)
-        ifreq = struct.pack('16sH2s4s8s', self.name, AF_INET, b'\x00'*2, ipbytes, b'\x00'*8)
-        fcntl.ioctl(sockfd, SIOCSIFADDR, ifreq)
+        ifreq.ioctl(self.ctx.sockfd, SIOCSIFADDR, ifreq.INADDR, self.name, AF_INET,
+                    ipbytes)
 
 
     def get_netmask(self):
-        ifreq = struct.pack('16sH14s', self.name, AF_INET, b'\x00'*14)
         try:
-            res = fcntl.ioctl(sockfd, SIOCGIFNETMASK, ifreq)
+            res = ifreq.ioctl(self.ctx.sockfd, SIOCGIFNETMASK, ifreq.INADDR_U32,
+                              self.name, AF_INET, 0)
         except IOError:
             return 0
-        netmask = socket.ntohl(struct.unpack('16sH2xI8x', res)[2])
+        netmask = socket.ntohl(res[2])
 
         return 32 - int(round(
             math.log(ctypes.c_uint32(~netmask).value + 1, 2), 1))
@@ -226,36 +264,39 @@ class Interface(object):
     def set_netmask(self, netmask):
         netmask = ctypes.c_uint32(~((2 ** (32 - netmask)) - 1)).value
         nmbytes = socket.htonl(netmask)
-        ifreq = struct.pack('16sH2sI8s', self.name, AF_INET, b'\x00'*2, nmbytes, b'\x00'*8) 
-        fcntl.ioctl(sockfd, SIOCSIFNETMASK, ifreq)
+        ifreq.ioctl(self.ctx.sockfd, SIOCSIFNETMASK, ifreq.INADDR_U32, self.name,
+                    AF_INET, nmbytes)
 
 
     def get_index(self):
         ''' Convert an interface name to an index value. '''
-        ifreq = struct.pack('16si', self.name, 0)
-        res = fcntl.ioctl(sockfd, SIOCGIFINDEX, ifreq)
-        return struct.unpack("16si", res)[1]
+        return self.ctx.index_cache.index(self.name)
 
 
     def get_link_info(self):
-        # First get link params
-        ecmd = array.array('B', struct.pack('I39s', ETHTOOL_GSET, b'\x00'*39))
-        ifreq = struct.pack('16sP', self.name, ecmd.buffer_info()[0])
+        ''' Return (speed, duplex, autoneg, link). speed is 0, and duplex and
+            autoneg None, when they are unknown. '''
+        try:
+            settings = self.get_link_settings()
+        except IOError:
+            settings = None
+        if settings is not None:
+            return (settings.speed or 0, settings.duplex, settings.autoneg,
+                    settings.link)
+
+        # Kernels before 4.6 only have the legacy ETHTOOL_GSET
         try:
-            fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
-            res = ecmd.tostring()
-            speed, duplex, auto = struct.unpack('12xHB3xB24x', res)
+            ecmd = ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_CMD, ETHTOOL_GSET,
+                                 *_ETHTOOL_CMD_EMPTY)
+            speed, duplex, auto = ecmd[3] | ecmd[12] << 16, ecmd[4], ecmd[8]
         except IOError:
             speed, duplex, auto = 65535, 255, 255
 
         # Then get link up/down state
-        ecmd = array.array('B', struct.pack('2I', ETHTOOL_GLINK, 0))
-        ifreq = struct.pack('16sP', self.name, ecmd.buffer_info()[0])
-        fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
-        res = ecmd.tostring()
-        up = bool(struct.unpack('4xI', res)[0])
+        up = bool(ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_VALUE,
+                                ETHTOOL_GLINK, 0)[1])
 
-        if speed == 65535:
+        if speed in (65535, ethtool.SPEED_UNKNOWN):
             speed = 0
         if duplex == 255:
             duplex = None
@@ -267,27 +308,31 @@ class Interface(object):
             auto = bool(auto)
         return speed, duplex, auto, up
 
+    def get_link_settings(self):
+        ''' Return an ethtool.LinkSettings with the speed, duplex, autoneg,
+            link state and full link mode masks. '''
+        return ethtool.get_link_settings(self.name, self.ctx)
+
 
     def set_link_mode(self, speed, duplex):
         # First get the existing info
-        ecmd = array.array('B', struct.pack('I39s', ETHTOOL_GSET, b'\x00'*39))
-        ifreq = struct.pack('16sP', self.name, ecmd.buffer_info()[0])
-        fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
+        ecmd = list(ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_CMD, ETHTOOL_GSET,
+                                  *_ETHTOOL_CMD_EMPTY))
         # Then modify it to reflect our needs
-        ecmd[0:4] = array.array('B', struct.pack('I', ETHTOOL_SSET))
-        ecmd[12:14] = array.array('B', struct.pack('H', speed))
-        ecmd[14] = int(duplex)
-        ecmd[18] = 0 # Autonegotiation is off
-        fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
+        ecmd[0] = ETHTOOL_SSET
+        ecmd[3] = speed & 0xffff
+        ecmd[12] = speed >> 16
+        ecmd[4] = int(duplex)
+        ecmd[8] = 0 # Autonegotiation is off
+        ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_CMD, *ecmd)
 
 
     def set_link_auto(self, ten=True, hundred=True, thousand=True):
         # First get the existing info
-        ecmd = array.array('B', struct.pack('I39s', ETHTOOL_GSET, b'\x00'*39))
-        ifreq = struct.pack('16sP', self.name, ecmd.buffer_info()[0])
-        fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
+        ecmd = list(ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_CMD, ETHTOOL_GSET,
+                                  *_ETHTOOL_CMD_EMPTY))
         # Then modify it to reflect our needs
-        ecmd[0:4] = array.array('B', struct.pack('I', ETHTOOL_SSET))
+        ecmd[0] = ETHTOOL_SSET
 
         advertise = 0
         if ten:
@@ -297,10 +342,9 @@ class Interface(object):
         if thousand:
             advertise |= ADVERTISED_1000baseT_Half | ADVERTISED_1000baseT_Full
 
-        newmode = struct.unpack('I', ecmd[4:8].tostring())[0] & advertise
-        ecmd[8:12] = array.array('B', struct.pack('I', newmode))
-        ecmd[18] = 1
-        fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
+        ecmd[2] = ecmd[1] & advertise
+        ecmd[8] = 1
+        ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_CMD, *ecmd)
         
 
     def set_pause_param(self, autoneg, rx_pause, tx_pause):
@@ -311,48 +355,582 @@ class Interface(object):
 
         http://en.wikipedia.org/wiki/Ethernet_flow_control
         """
-        # create a struct ethtool_pauseparm
-        # create a struct ifreq with its .ifr_data pointing at the above
-        ecmd = array.array('B', struct.pack('IIII',
-            ETHTOOL_SPAUSEPARAM, bool(autoneg), bool(rx_pause), bool(tx_pause)))
-        buf_addr, _buf_len = ecmd.buffer_info()
-        ifreq = struct.pack('16sP', self.name, buf_addr)
-        fcntl.ioctl(sockfd, SIOCETHTOOL, ifreq)
-
-    def get_stats(self):
-        spl_re = re.compile(br"\s+")
-
-        fp = open(PROCFS_NET_PATH, 'rb')
-        # Skip headers
-        fp.readline()
-        fp.readline()
-        while True:
-            data = fp.readline()
-            if not data:
+        # fill in a struct ethtool_pauseparam; the ifreq's .ifr_data points
+        # at it
+        ifreq.ethtool(self.ctx.sockfd, self.name, ETHTOOL_PAUSEPARAM,
+                      ETHTOOL_SPAUSEPARAM, bool(autoneg), bool(rx_pause),
+                      bool(tx_pause))
+
+    def get_ringparam(self):
+        ''' Return the ring sizes as an ethtool.RingParam. '''
+        return ethtool.get_ringparam(self.name, self.ctx)
+
+    def set_ringparam(self, **changes):
+        ''' Change ring sizes, e.g. set_ringparam(rx_pending=4096). Returns
+            False, without writing, if they are already set. '''
+        return ethtool.set_ringparam(self.name, self.ctx, **changes)
+
+    def get_channels(self):
+        ''' Return the queue counts as an ethtool.Channels. '''
+        return ethtool.get_channels(self.name, self.ctx)
+
+    def set_channels(self, **changes):
+        ''' Change queue counts, e.g. set_channels(combined_count=8).
+            Returns False, without writing, if they are already set. '''
+        return ethtool.set_channels(self.name, self.ctx, **changes)
+
+    def get_coalesce(self):
+        ''' Return the interrupt coalescing settings as an
+            ethtool.Coalesce. '''
+        return ethtool.get_coalesce(self.name, self.ctx)
+
+    def set_coalesce(self, **changes):
+        ''' Change interrupt coalescing, e.g.
+            set_coalesce(rx_coalesce_usecs=50). Returns False, without
+            writing, if it is already set. '''
+        return ethtool.set_coalesce(self.name, self.ctx, **changes)
+
+    def get_features(self):
+        ''' Return a dict mapping offload feature names, e.g. 'rx-gro', to
+            ethtool.Feature. '''
+        return ethtool.get_features(self.name, self.ctx)
+
+    def set_features(self, changes):
+        ''' Turn offloads on or off, e.g. set_features({'gro': True,
+            'tx-checksum-ip-generic': False}). Returns a dict mapping each
+            feature to whether the kernel left it as requested. '''
+        return ethtool.set_features(self.name, changes, self.ctx)
+
+    def get_rx_queues(self):
+        ''' Return the numbers of the receive queues. '''
+        return steering.rx_queues(self.name, self.ctx)
+
+    def get_tx_queues(self):
+        ''' Return the numbers of the transmit queues. '''
+        return steering.tx_queues(self.name, self.ctx)
+
+    def get_rps(self, queue):
+        ''' Return the set of CPUs RPS steers receive queue's packets to. '''
+        return steering.get_rps(self.name, queue, self.ctx)
+
+    def set_rps(self, queue, cpus):
+        ''' Steer receive queue's packets to the given CPUs. Returns False,
+            without writing, if already set. '''
+        return steering.set_rps(self.name, queue, cpus, self.ctx)
+
+    def get_rps_flow_cnt(self, queue):
+        ''' Return the number of RFS flows tracked for receive queue. '''
+        return steering.get_rps_flow_cnt(self.name, queue, self.ctx)
+
+    def set_rps_flow_cnt(self, queue, count):
+        ''' Set the number of RFS flows tracked for receive queue. '''
+        return steering.set_rps_flow_cnt(self.name, queue, count, self.ctx)
+
+    def get_xps(self, queue):
+        ''' Return the set of CPUs that transmit through queue. '''
+        return steering.get_xps(self.name, queue, self.ctx)
+
+    def set_xps(self, queue, cpus):
+        ''' Transmit through queue from the given CPUs. Returns False,
+            without writing, if already set. '''
+        return steering.set_xps(self.name, queue, cpus, self.ctx)
+
+    def get_irqs(self):
+        ''' Return the interface's interrupts as steering.Irqs, which give
+            the queue each serves. '''
+        return steering.get_irqs(self.name, self.ctx)
+
+    def spread_queues(self, cpus=None, rps=True, xps=True, irqs=True):
+        ''' Distribute the queues' RPS and XPS masks and interrupts evenly
+            across cpus (default: all online CPUs). Returns a list of
+            steering.Assignments. '''
+        return steering.spread(self.name, cpus, rps, xps, irqs, self.ctx)
+
+    def snapshot(self):
+        ''' Return a Snapshot of this interface's link attributes and
+            addresses, fetched with one netlink request and one dump. Returns
+            None if the interface does not exist. '''
+        nlsock = self.ctx.netlink
+        link = netlink.get_link(self.name, nlsock)
+        if link is None:
+            return None
+        try:
+            addrs = netlink.get_addresses(sock=nlsock, index=link.index)
+        except netlink.NetlinkError as e:
+            # Removed since the link request
+            if e.errno == errno.ENODEV:
                 return None
+            raise
+        return _make_snapshot(link, addrs)
 
-            name, stats_str = data.split(b":")
-            if name.strip() != self.name:
-                continue
-
-            stats = [int(a) for a in spl_re.split(stats_str.strip())]
-            break
-
-        titles = ["rx_bytes", "rx_packets", "rx_errs", "rx_drop", "rx_fifo",
-                  "rx_frame", "rx_compressed", "rx_multicast", "tx_bytes",
-                  "tx_packets", "tx_errs", "tx_drop", "tx_fifo", "tx_colls",
-                  "tx_carrier", "tx_compressed"]
-        return dict(list(zip(titles, stats)))
+    def get_stats(self):
+        ''' Return a dict of this interface's counters, or None if the
+            interface has no entry in /proc/net/dev. '''
+        return get_all_stats(self.ctx).get(self.name)
+
+    def get_addresses(self, family=socket.AF_UNSPEC):
+        ''' Return a list of every netlink.Address on this interface,
+            including secondary and IPv6 addresses. '''
+        ctx = self.ctx
+        index = ctx.index_cache.index(self.name)
+        return netlink.get_addresses(family, ctx.netlink, index)
+
+    def get_driver_stats(self):
+        ''' Return a dict of the driver's own counters (ETHTOOL_GSTATS). Use
+            an ethtool.StatsReader to sample them repeatedly. '''
+        return ethtool.get_stats(self.name, self.ctx)
+
+    def set_netns(self, ns):
+        ''' Move the interface into another network namespace: a Context, or
+            a name, path or file descriptor as taken by context.netns(). The
+            interface is bound to that namespace's Context afterwards.
+            Equivalent to ip link set [iface] netns [ns]. '''
+        target = ns if isinstance(ns, context.Context) else context.netns(ns)
+        ctx = self.ctx
+        ctx.netlink.request(netlink.RTM_NEWLINK, netlink.link_msg(
+            self.name,
+            attrs=[(netlink.IFLA_NET_NS_FD, netlink.U32.pack(target.netns_fd))]))
+        ctx.index_cache.invalidate(self.name)
+        self._ctx = target
+        return self
+
+    def get_link(self):
+        ''' Return the interface's rtnetlink attributes as a netlink.Link. '''
+        link = netlink.get_link(self.name, self.ctx.netlink)
+        if link is None:
+            raise IOError(errno.ENODEV, "no such device: %r" % self.name)
+        return link
+
+    def set_link(self, **settings):
+        ''' Change any of the link settings in netlink.LINK_SETTINGS (mtu,
+            txqlen, gso_max_size, gso_max_segs, gro_max_size) with a single
+            request, e.g. set_link(mtu=9000, txqlen=10000). '''
+        attrs = netlink.link_settings_attrs(settings)
+        if attrs:
+            self.ctx.netlink.request(netlink.RTM_NEWLINK,
+                                     netlink.link_msg(self.name, attrs=attrs))
+        return self
 
     index = property(get_index)
     mac = property(get_mac, set_mac)
     ip  = property(get_ip, set_ip)
     netmask = property(get_netmask, set_netmask)
-
-
-def iterifs(physical=True):
+    mtu = _link_setting('mtu')
+    txqlen = _link_setting('txqlen')
+    gso_max_size = _link_setting('gso_max_size')
+    gso_max_segs = _link_setting('gso_max_segs')
+    gro_max_size = _link_setting('gro_max_size')
+
+
+class IndexCache(object):
+    '''
+    Bounded cache of interface name <-> ifindex mappings. When full, the
+    least recently used entries are dropped.
+
+    When rtnetlink is available the cache subscribes to link notifications
+    and applies RTM_NEWLINK/RTM_DELLINK (including renames) before each
+    lookup; checking for them is a poll(), which is cheaper than the ioctl a
+    lookup would otherwise cost. Without netlink, entries stay valid until
+    invalidate() is called, which also bumps the generation counter.
+    '''
+
+    def __init__(self, maxsize=4096, watch=True, ctx=None):
+        self.maxsize = maxsize
+        self.ctx = ctx
+        self.generation = 0
+        self._by_name = collections.OrderedDict()
+        self._by_index = {}
+        # ifindex -> alias labels (e.g. eth0:1) cached for it
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self._events = None
+        self._poll = None
+        if watch:
+            try:
+                if ctx is not None:
+                    self._events = ctx.open_netlink(netlink.RTMGRP_LINK)
+                else:
+                    self._events = netlink.NetlinkSocket(groups=netlink.RTMGRP_LINK)
+            except EnvironmentError:
+                pass
+            else:
+                self._events.setblocking(False)
+                self._poll = select.poll()
+                self._poll.register(self._events.fileno(), select.POLLIN)
+
+    def close(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+            self._poll = None
+
+    def _store(self, name, index):
+        if b':' in name:
+            # SIOCGIFINDEX resolves an alias label to its interface's index,
+            # but the label is not the interface's name.
+            self._by_name.pop(name, None)
+            self._by_name[name] = index
+            self._aliases.setdefault(index, set()).add(name)
+        else:
+            old = self._by_index.pop(index, None)
+            if old is not None and old != name:
+                self._by_name.pop(old, None)
+                # Labels of the old name no longer resolve
+                self._forget_aliases(index)
+            old = self._by_name.pop(name, None)
+            if old is not None and old != index:
+                self._forget(index=old)
+            self._by_name[name] = index
+            self._by_index[index] = name
+        while len(self._by_name) > self.maxsize:
+            evicted, evicted_index = self._by_name.popitem(last=False)
+            if self._by_index.get(evicted_index) == evicted:
+                del self._by_index[evicted_index]
+            else:
+                self._aliases.get(evicted_index, set()).discard(evicted)
+
+    def _touch(self, name):
+        # Move to the most recently used end (OrderedDict.move_to_end is
+        # Python 3 only)
+        self._by_name[name] = self._by_name.pop(name)
+
+    def _forget_aliases(self, index):
+        for alias in self._aliases.pop(index, ()):
+            self._by_name.pop(alias, None)
+
+    def _forget(self, name=None, index=None):
+        if name is not None:
+            index = self._by_name.pop(name, index)
+        if index is not None:
+            name = self._by_index.pop(index, None)
+            if name is not None:
+                self._by_name.pop(name, None)
+            self._forget_aliases(index)
+
+    def _sync(self):
+        ''' Apply any pending link notifications. '''
+        while self._poll is not None and self._poll.poll(0):
+            try:
+                messages = list(self._events.recv())
+            except EnvironmentError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Notifications were dropped; nothing can be trusted,
+                    # including those still queued from before.
+                    self._events.discard()
+                    self._clear()
+                    continue
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+            for msg_type, _flags, _seq, payload in messages:
+                if msg_type == netlink.RTM_NEWLINK:
+                    link = netlink.parse_link(payload)
+                    self._store(link.name, link.index)
+                elif msg_type == netlink.RTM_DELLINK:
+                    link = netlink.parse_link(payload)
+                    self._forget(index=link.index)
+
+    def _clear(self):
+        self._by_name.clear()
+        self._by_index.clear()
+        self._aliases.clear()
+        self.generation += 1
+
+    def index(self, name):
+        ''' Return the ifindex of the named interface. '''
+        with self._lock:
+            self._sync()
+            index = self._by_name.get(name)
+            if index is not None:
+                self._touch(name)
+                return index
+            sockfd = (self.ctx or context.get_context()).sockfd
+            index = ifreq.ioctl(sockfd, SIOCGIFINDEX, ifreq.INT, name, 0)[1]
+            self._store(name, index)
+            return index
+
+    def name(self, index):
+        ''' Return the name of the interface with the given ifindex. '''
+        with self._lock:
+            self._sync()
+            name = self._by_index.get(index)
+            if name is not None:
+                self._touch(name)
+                return name
+            sockfd = (self.ctx or context.get_context()).sockfd
+            name = ifreq.ioctl(sockfd, SIOCGIFNAME, ifreq.INT, b'', index)[0]
+            name = name.split(b'\x00', 1)[0]
+            self._store(name, index)
+            return name
+
+    def invalidate(self, name=None):
+        ''' Drop the entry for the named interface, or everything if name is
+            None, and bump the generation counter. '''
+        with self._lock:
+            if name is None:
+                self._clear()
+            else:
+                self._forget(name=name)
+                self.generation += 1
+
+
+def _address_key(addr):
+    return addr.index, addr.family, addr.address, addr.prefixlen
+
+
+def _canonical_address(address):
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    return socket.inet_ntop(family, socket.inet_pton(family, address))
+
+
+class AddressTable(object):
+    '''
+    Every IPv4 and/or IPv6 address on the system, loaded with a single
+    RTM_GETADDR dump and indexed both by address and by ifindex.
+
+    With watch=True the table subscribes to address notifications before
+    dumping, and applies the ones received since before every lookup, so it
+    only dumps again if the kernel drops notifications. With watch=False
+    the table stays as loaded until refresh() re-dumps it.
+    '''
+
+    def __init__(self, family=socket.AF_UNSPEC, watch=True, ctx=None):
+        self.family = family
+        self.ctx = ctx
+        self._by_address = {}
+        self._by_index = {}
+        self._lock = threading.Lock()
+        self._events = None
+        self._poll = None
+        if watch:
+            groups = 0
+            if family in (socket.AF_UNSPEC, socket.AF_INET):
+                groups |= netlink.RTMGRP_IPV4_IFADDR
+            if family in (socket.AF_UNSPEC, socket.AF_INET6):
+                groups |= netlink.RTMGRP_IPV6_IFADDR
+            if ctx is not None:
+                self._events = ctx.open_netlink(groups)
+            else:
+                self._events = netlink.NetlinkSocket(groups=groups)
+            self._events.setblocking(False)
+            self._poll = select.poll()
+            self._poll.register(self._events.fileno(), select.POLLIN)
+        with self._lock:
+            self._load()
+
+    def close(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+            self._poll = None
+
+    def _load(self):
+        self._by_address.clear()
+        self._by_index.clear()
+        nlsock = (self.ctx or context.get_context()).netlink
+        for addr in netlink.get_addresses(self.family, nlsock):
+            self._add(addr)
+
+    def _add(self, addr):
+        key = _address_key(addr)
+        self._by_address.setdefault(addr.address, {})[key] = addr
+        self._by_index.setdefault(addr.index, {})[key] = addr
+
+    def _remove(self, addr):
+        key = _address_key(addr)
+        for table, field in ((self._by_address, addr.address),
+                             (self._by_index, addr.index)):
+            entries = table.get(field)
+            if entries is not None:
+                entries.pop(key, None)
+                if not entries:
+                    del table[field]
+
+    def _sync(self):
+        if self._poll is None:
+            self._load()
+            return
+        while self._poll.poll(0):
+            try:
+                messages = list(self._events.recv())
+            except EnvironmentError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Notifications were dropped; start over, without
+                    # those still queued from before.
+                    self._events.discard()
+                    self._load()
+                    continue
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+            for msg_type, _flags, _seq, payload in messages:
+                if msg_type == netlink.RTM_NEWADDR:
+                    self._add(netlink.parse_addr(payload))
+                elif msg_type == netlink.RTM_DELADDR:
+                    self._remove(netlink.parse_addr(payload))
+
+    def refresh(self):
+        ''' Bring the table up to date. '''
+        with self._lock:
+            self._sync()
+
+    def lookup(self, address):
+        ''' Return the list of netlink.Addresses for the given address
+            string, one per interface (and prefix) it is configured on. '''
+        address = _canonical_address(address)
+        with self._lock:
+            if self._poll is not None:
+                self._sync()
+            return list(self._by_address.get(address, {}).values())
+
+    def index_of(self, address):
+        ''' Return the ifindex of an interface that owns the given address,
+            or None. '''
+        addrs = self.lookup(address)
+        return addrs[0].index if addrs else None
+
+    def addresses(self, index=None):
+        ''' Return the list of netlink.Addresses on the interface with the
+            given ifindex, or on every interface if index is None. '''
+        with self._lock:
+            if self._poll is not None:
+                self._sync()
+            if index is not None:
+                return list(self._by_index.get(index, {}).values())
+            return [addr for entries in self._by_index.values()
+                    for addr in entries.values()]
+
+
+def iter_proc_net_dev():
+    ''' Yield (name, counters) for every interface in /proc/net/dev, where
+        counters is a list in STATS_TITLES order. '''
+    with open(PROCFS_NET_PATH, 'rb') as fp:
+        lines = fp.readlines()
+
+    # Skip headers
+    for line in lines[2:]:
+        name, _, counters = line.partition(b":")
+        yield name.strip(), [int(a) for a in counters.split()]
+
+
+def fold_stats64(s):
+    ''' Convert a netlink.LinkStats64 into a list in STATS_TITLES order,
+        folding the detailed counters the same way the kernel does for
+        /proc/net/dev. '''
+    return [
+        s.rx_bytes,
+        s.rx_packets,
+        s.rx_errors,
+        s.rx_dropped + s.rx_missed_errors,
+        s.rx_fifo_errors,
+        s.rx_length_errors + s.rx_over_errors + s.rx_crc_errors +
+            s.rx_frame_errors,
+        s.rx_compressed,
+        s.multicast,
+        s.tx_bytes,
+        s.tx_packets,
+        s.tx_errors,
+        s.tx_dropped,
+        s.tx_fifo_errors,
+        s.collisions,
+        s.tx_carrier_errors + s.tx_aborted_errors + s.tx_window_errors +
+            s.tx_heartbeat_errors,
+        s.tx_compressed,
+    ]
+
+
+def iter_netlink_stats(ctx=None):
+    ''' Yield (name, index, counters) for every interface, where counters is
+        a list in STATS_TITLES order built from the 64-bit rtnetlink
+        counters. '''
+    ctx = ctx or context.get_context()
+    for index, name, s in netlink.iter_link_stats64(ctx.netlink):
+        yield name, index, fold_stats64(s)
+
+
+def get_all_stats(ctx=None):
+    ''' Return a dict mapping every interface name to a dict of its counters,
+        parsed from a single read of /proc/net/dev. /proc/net/dev only shows
+        the process's own namespace, so for a namespace Context (given or
+        current) this is get_all_stats64(ctx). '''
+    ctx = ctx or context.get_context()
+    if ctx.netns is not None:
+        return get_all_stats64(ctx)
+    return dict((name, dict(zip(STATS_TITLES, counters)))
+                for name, counters in iter_proc_net_dev())
+
+
+def get_all_stats64(ctx=None):
+    ''' Like get_all_stats(), but using the 64-bit counters from an rtnetlink
+        link dump. The result has the same keys. '''
+    return dict((name, dict(zip(STATS_TITLES, counters)))
+                for name, _index, counters in iter_netlink_stats(ctx))
+
+
+def _make_snapshot(link, addrs):
+    return Snapshot(name=link.name, index=link.index, flags=link.flags,
+                    mac=link.mac, mtu=link.mtu, operstate=link.operstate,
+                    addresses=tuple(addrs))
+
+
+def snapshot_all(ctx=None):
+    ''' Return a list of Snapshots for every interface in the system, built
+        from a single netlink link dump and a single address dump. '''
+    nlsock = (ctx or context.get_context()).netlink
+    by_index = collections.defaultdict(list)
+    for addr in netlink.get_addresses(sock=nlsock):
+        by_index[addr.index].append(addr)
+    return [_make_snapshot(link, by_index.get(link.index, ()))
+            for link in netlink.get_links(nlsock)]
+
+
+def iterifs(physical=True, ctx=None):
     ''' Iterate over all the interfaces in the system. If physical is
-        true, then return only real physical interfaces (not 'lo', etc).'''
+        true, then return only real physical interfaces (not 'lo', etc).
+        The Interfaces are bound to ctx, if given. '''
+    current = ctx or context.get_context()
+    try:
+        names = _iterifs_netlink(physical, current.netlink)
+    except EnvironmentError:
+        # sysfs shows the namespace it was mounted in, not the context's.
+        if current.netns is not None:
+            raise
+        # No rtnetlink (e.g. restricted sandbox); fall back to sysfs/ioctl.
+        names = _iterifs_sysfs(physical, current.sockfd)
+
+    for d in names:
+        yield Interface(d, ctx)
+
+
+def _is_physical(link):
+    ''' Whether the given netlink.Link has a backing device, i.e. whether
+        /sys/class/net/[iface]/device exists. '''
+    if link.parent is not None:
+        return True
+    # Older kernels don't report IFLA_PARENT_DEV_NAME. Virtual devices can
+    # still be ruled out by their kind, so only the rest need a stat.
+    if link.kind is not None or link.flags & IFF_LOOPBACK:
+        return False
+    return os.path.exists(os.path.join(SYSFS_NET_PATH, link.name, b"device"))
+
+
+def _iterifs_netlink(physical, nlsock):
+    links = netlink.get_links(nlsock)
+    if physical:
+        return [link.name for link in links if _is_physical(link)]
+
+    names = [link.name for link in links]
+    # Subinterfaces (e.g. eth0:1) aren't links; they only exist as labels on
+    # IPv4 addresses.
+    seen = set(names)
+    for addr in netlink.get_addresses(socket.AF_INET, nlsock):
+        if addr.label and addr.label not in seen:
+            seen.add(addr.label)
+            names.append(addr.label)
+    return names
+
+
+def _iterifs_sysfs(physical, sockfd):
     net_files = os.listdir(SYSFS_NET_PATH)
     interfaces = set()
     virtual = set()
@@ -378,26 +956,24 @@ def iterifs(physical=True):
             "Unexpected amount of data returned from ioctl. "
             "You're probably running on an unexpected architecture")
 
-        res = ifreqs.tostring()
+        res = util.array_tobytes(ifreqs)
         for i in range(0, ifreqs_len, SIZE_OF_IFREQ):
             d = res[i:i+16].strip(b'\0')
             interfaces.add(d)
 
-    results = interfaces - virtual if physical else interfaces
-    for d in results:
-        yield Interface(d)
+    return interfaces - virtual if physical else interfaces
 
 
-def findif(name, physical=True):
-    for br in iterifs(physical):
+def findif(name, physical=True, ctx=None):
+    for br in iterifs(physical, ctx):
         if name == br.name:
             return br
     return None
 
-def list_ifs(physical=True):
+def list_ifs(physical=True, ctx=None):
     ''' Return a list of the names of the interfaces. If physical is
         true, then return only real physical interfaces (not 'lo', etc). '''
-    return [br for br in iterifs(physical)]
+    return [br for br in iterifs(physical, ctx)]
 
 
 def init():
@@ -407,10 +983,13 @@ def init():
 
 
 def shutdown():
-    ''' Shut down the library '''
-    globals()["sock"].close()
-    globals()["sock"] = None
+    ''' Shut down the library. Only the calling thread's default context
+        is closed; other threads keep working. '''
+    context.shutdown()
+    legacy, globals()["sock"] = globals()["sock"], None
     globals()["sockfd"] = None
+    if legacy is not None:
+        legacy.close()
 
 
 # Do this when loading the module
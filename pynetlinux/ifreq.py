@@ -0,0 +1,77 @@
+import array
+import fcntl
+import struct
+import threading
+
+"""
+Precompiled codecs for struct ifreq (see ifconfig.py for its layout) and a
+reusable, per-thread buffer to issue ioctls with. The buffer is mutated in
+place by the kernel, so a call allocates neither the request nor the result.
+"""
+
+# This is probably not cross-platform
+SIZE_OF_IFREQ = 40
+
+# From linux/sockios.h
+SIOCETHTOOL = 0x8946
+
+# ifr_name plus one member of the ifr_ifru union
+FLAGS = struct.Struct('16sh')           # ifru_flags
+INT = struct.Struct('16si')             # ifru_ivalue, ifru_mtu, ifindex
+PTR = struct.Struct('16sP')             # ifru_data
+SOCKADDR = struct.Struct('16sH14s')     # any struct sockaddr
+HWADDR = struct.Struct('16sH6B8x')      # sockaddr holding a MAC address
+INADDR = struct.Struct('16sH2x4s8x')    # sockaddr_in
+INADDR_U32 = struct.Struct('16sH2xI8x') # sockaddr_in, address as an int
+
+# Largest ethtool command buffer handed out by ethtool_buffer()
+ETHTOOL_BUFFER_SIZE = 4096
+
+_local = threading.local()
+
+
+def _buffers():
+    try:
+        return _local.ifreq, _local.ethtool
+    except AttributeError:
+        _local.ifreq = bytearray(SIZE_OF_IFREQ)
+        # ethtool structs are referred to by address, so this must be an array
+        _local.ethtool = array.array('B', b'\x00' * ETHTOOL_BUFFER_SIZE)
+        return _local.ifreq, _local.ethtool
+
+
+def ioctl(fd, request, codec, *args):
+    ''' Pack args into this thread's ifreq buffer with the given codec, issue
+        the ioctl in place and return the unpacked result. '''
+    buf = _buffers()[0]
+    codec.pack_into(buf, 0, *args)
+    fcntl.ioctl(fd, request, buf, True)
+    return codec.unpack_from(buf)
+
+
+def ethtool_buffer():
+    ''' Return this thread's ethtool command buffer, for commands whose
+        size is only known at run time. Issue them with ethtool_raw(). '''
+    return _buffers()[1]
+
+
+def ethtool_raw(fd, name, buf=None):
+    ''' Issue SIOCETHTOOL on the named interface with the command already
+        in buf, an array large enough for the reply, or in this thread's
+        ethtool buffer. '''
+    ifr, ecmd = _buffers()
+    if buf is None:
+        buf = ecmd
+    PTR.pack_into(ifr, 0, name, buf.buffer_info()[0])
+    fcntl.ioctl(fd, SIOCETHTOOL, ifr, True)
+
+
+def ethtool(fd, name, codec, *args):
+    ''' Pack args (starting with the ethtool command) into this thread's
+        ethtool buffer with the given codec, issue SIOCETHTOOL on the named
+        interface and return the unpacked result. '''
+    ifr, ecmd = _buffers()
+    codec.pack_into(ecmd, 0, *args)
+    PTR.pack_into(ifr, 0, name, ecmd.buffer_info()[0])
+    fcntl.ioctl(fd, SIOCETHTOOL, ifr, True)
+    return codec.unpack_from(ecmd)
@@ -0,0 +1,199 @@
+import collections
+import errno
+import select
+import socket
+
+from . import netlink
+
+# Event types
+LINK_NEW = 'link_new'
+LINK_DEL = 'link_del'
+LINK_UP = 'link_up'
+LINK_DOWN = 'link_down'
+CARRIER_UP = 'carrier_up'
+CARRIER_DOWN = 'carrier_down'
+LINK_RENAME = 'link_rename'
+LINK_CHANGE = 'link_change'
+ADDR_NEW = 'addr_new'
+ADDR_DEL = 'addr_del'
+ROUTE_NEW = 'route_new'
+ROUTE_DEL = 'route_del'
+NEIGH_NEW = 'neigh_new'
+NEIGH_DEL = 'neigh_del'
+
+LINK_GROUPS = netlink.RTMGRP_LINK
+ADDR_GROUPS = netlink.RTMGRP_IPV4_IFADDR | netlink.RTMGRP_IPV6_IFADDR
+ROUTE_GROUPS = netlink.RTMGRP_IPV4_ROUTE | netlink.RTMGRP_IPV6_ROUTE
+NEIGH_GROUPS = netlink.RTMGRP_NEIGH
+ALL_GROUPS = LINK_GROUPS | ADDR_GROUPS | ROUTE_GROUPS | NEIGH_GROUPS
+
+# obj is the netlink.Link/Address/Route/Neighbour the event is about; old is
+# the previous Link for link events, if it was known.
+Event = collections.namedtuple('Event', ['type', 'index', 'name', 'obj', 'old'])
+
+
+def _addr_key(addr):
+    return addr.family, addr.address, addr.prefixlen
+
+
+class Monitor(object):
+    '''
+    Subscribes to rtnetlink notifications and turns them into Events.
+
+    The monitor always tracks links, so that it can tell up/down, carrier and
+    rename transitions apart. With mirror=True it also keeps every address,
+    so links and addresses can be read from memory instead of the kernel.
+    If the kernel drops notifications because the monitor fell behind, the
+    state is re-dumped and the differences are reported as events.
+
+    A Monitor can be passed to select(). If ctx (a context.Context) is given,
+    the monitor watches that context's network namespace.
+    '''
+
+    def __init__(self, groups=ALL_GROUPS, mirror=False, ctx=None):
+        self.groups = groups
+        self.mirror = mirror
+        self.links = {}
+        self.addresses = collections.defaultdict(list)
+        if ctx is not None:
+            self.sock = ctx.open_netlink(groups)
+            self._dump_sock = ctx.netlink
+        else:
+            self.sock = netlink.NetlinkSocket(groups=groups)
+            self._dump_sock = None
+        self.sock.setblocking(False)
+        # Subscribe before dumping so nothing falls in between; notifications
+        # that repeat the dump are harmless.
+        self._resync()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def link_by_name(self, name):
+        ''' Return the mirrored Link with the given name, or None. '''
+        for link in self.links.values():
+            if link.name == name:
+                return link
+        return None
+
+    def _resync(self):
+        ''' Rebuild the mirror from a dump and return the resulting events. '''
+        events = []
+        seen = set()
+        for link in netlink.get_links(self._dump_sock):
+            seen.add(link.index)
+            events.extend(self._link_changed(link))
+        for index in list(self.links):
+            if index not in seen:
+                events.extend(self._link_removed(index))
+
+        if self.mirror:
+            old = self.addresses
+            self.addresses = collections.defaultdict(list)
+            for addr in netlink.get_addresses(sock=self._dump_sock):
+                self.addresses[addr.index].append(addr)
+                if addr not in old.get(addr.index, ()):
+                    events.append(Event(ADDR_NEW, addr.index, self._name(addr.index), addr, None))
+            for index, addrs in old.items():
+                for addr in addrs:
+                    if addr not in self.addresses.get(index, ()):
+                        events.append(Event(ADDR_DEL, index, self._name(index), addr, None))
+        return events
+
+    def _name(self, index):
+        link = self.links.get(index)
+        return link.name if link is not None else None
+
+    def _link_changed(self, link):
+        old = self.links.get(link.index)
+        self.links[link.index] = link
+        if old is None:
+            return [Event(LINK_NEW, link.index, link.name, link, None)]
+        if old == link:
+            return []
+
+        events = []
+        if old.name != link.name:
+            events.append(Event(LINK_RENAME, link.index, link.name, link, old))
+        changed = old.flags ^ link.flags
+        if changed & netlink.IFF_UP:
+            kind = LINK_UP if link.flags & netlink.IFF_UP else LINK_DOWN
+            events.append(Event(kind, link.index, link.name, link, old))
+        if changed & netlink.IFF_LOWER_UP:
+            kind = CARRIER_UP if link.flags & netlink.IFF_LOWER_UP else CARRIER_DOWN
+            events.append(Event(kind, link.index, link.name, link, old))
+        if not events:
+            events.append(Event(LINK_CHANGE, link.index, link.name, link, old))
+        return events
+
+    def _link_removed(self, index, link=None):
+        old = self.links.pop(index, None)
+        self.addresses.pop(index, None)
+        if link is None:
+            link = old
+        return [Event(LINK_DEL, index, link.name, link, old)]
+
+    def _handle(self, msg_type, payload):
+        if msg_type == netlink.RTM_NEWLINK:
+            # Bridge port notifications share the message type
+            if netlink.IFINFOMSG.unpack_from(payload)[0] != socket.AF_UNSPEC:
+                return []
+            return self._link_changed(netlink.parse_link(payload))
+        if msg_type == netlink.RTM_DELLINK:
+            if netlink.IFINFOMSG.unpack_from(payload)[0] != socket.AF_UNSPEC:
+                return []
+            link = netlink.parse_link(payload)
+            return self._link_removed(link.index, link)
+        if msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+            addr = netlink.parse_addr(payload)
+            if self.mirror:
+                # Flags change over an address' life (e.g. after DAD), so
+                # match on what identifies it.
+                key = _addr_key(addr)
+                addrs = [a for a in self.addresses[addr.index] if _addr_key(a) != key]
+                if msg_type == netlink.RTM_NEWADDR:
+                    addrs.append(addr)
+                self.addresses[addr.index] = addrs
+            kind = ADDR_NEW if msg_type == netlink.RTM_NEWADDR else ADDR_DEL
+            return [Event(kind, addr.index, self._name(addr.index), addr, None)]
+        if msg_type in (netlink.RTM_NEWROUTE, netlink.RTM_DELROUTE):
+            route = netlink.parse_route(payload)
+            kind = ROUTE_NEW if msg_type == netlink.RTM_NEWROUTE else ROUTE_DEL
+            return [Event(kind, route.oif, self._name(route.oif), route, None)]
+        if msg_type in (netlink.RTM_NEWNEIGH, netlink.RTM_DELNEIGH):
+            neigh = netlink.parse_neigh(payload)
+            kind = NEIGH_NEW if msg_type == netlink.RTM_NEWNEIGH else NEIGH_DEL
+            return [Event(kind, neigh.index, self._name(neigh.index), neigh, None)]
+        return []
+
+    def poll(self):
+        ''' Process every pending notification without blocking and return
+            the list of resulting Events. '''
+        events = []
+        while True:
+            try:
+                messages = list(self.sock.recv())
+            except EnvironmentError as e:
+                if e.errno == errno.EAGAIN:
+                    return events
+                if e.errno == errno.ENOBUFS:
+                    # What is still queued predates the dump
+                    self.sock.discard()
+                    events.extend(self._resync())
+                    continue
+                raise
+            for msg_type, _flags, _seq, payload in messages:
+                events.extend(self._handle(msg_type, payload))
+
+    def events(self, timeout=None):
+        ''' Yield Events as they happen. If timeout is given, stop once no
+            notification has arrived for that many seconds. '''
+        while True:
+            readable, _, _ = select.select([self], [], [], timeout)
+            if not readable:
+                return
+            for event in self.poll():
+                yield event
@@ -0,0 +1,650 @@
+import collections
+import errno
+import os
+import socket
+import struct
+
+"""
+Minimal rtnetlink client. This file makes the following assumptions about
+data structures:
+
+struct nlmsghdr {
+    __u32   nlmsg_len;      /* Length of message including header */
+    __u16   nlmsg_type;     /* Message content */
+    __u16   nlmsg_flags;    /* Additional flags */
+    __u32   nlmsg_seq;      /* Sequence number */
+    __u32   nlmsg_pid;      /* Sending process port ID */
+};
+
+struct nlmsgerr {
+    int     error;
+    struct nlmsghdr msg;
+};
+
+struct rtattr {
+    unsigned short  rta_len;
+    unsigned short  rta_type;
+};
+
+struct ifinfomsg {
+    unsigned char   ifi_family;
+    unsigned char   __ifi_pad;
+    unsigned short  ifi_type;       /* ARPHRD_* */
+    int             ifi_index;      /* Link index */
+    unsigned        ifi_flags;      /* IFF_* flags */
+    unsigned        ifi_change;     /* IFF_* change mask */
+};
+
+struct rtmsg {
+    unsigned char   rtm_family;
+    unsigned char   rtm_dst_len;
+    unsigned char   rtm_src_len;
+    unsigned char   rtm_tos;
+    unsigned char   rtm_table;      /* Routing table id */
+    unsigned char   rtm_protocol;   /* Routing protocol; see below */
+    unsigned char   rtm_scope;      /* See below */
+    unsigned char   rtm_type;       /* See below */
+    unsigned        rtm_flags;
+};
+
+struct ndmsg {
+    __u8    ndm_family;
+    __u8    ndm_pad1;
+    __u16   ndm_pad2;
+    __s32   ndm_ifindex;
+    __u16   ndm_state;
+    __u8    ndm_flags;
+    __u8    ndm_type;
+};
+
+struct ifaddrmsg {
+    __u8    ifa_family;
+    __u8    ifa_prefixlen;  /* The prefix length */
+    __u8    ifa_flags;      /* Flags */
+    __u8    ifa_scope;      /* Address scope */
+    __u32   ifa_index;      /* Link index */
+};
+
+struct genlmsghdr {
+    __u8    cmd;
+    __u8    version;
+    __u16   reserved;
+};
+"""
+
+# From linux/netlink.h
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_ROOT = 0x100
+NLM_F_MATCH = 0x200
+NLM_F_DUMP = NLM_F_ROOT | NLM_F_MATCH
+
+# Modifiers to NEW requests
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+# Socket options
+SOL_NETLINK = 270
+NETLINK_GET_STRICT_CHK = 12
+
+NLA_F_NESTED = 0x8000
+NLA_F_NET_BYTEORDER = 0x4000
+NLA_TYPE_MASK = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+
+# From linux/rtnetlink.h
+RTMGRP_LINK = 0x1
+RTMGRP_NEIGH = 0x4
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_SETLINK = 19
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+
+RT_TABLE_MAIN = 254
+
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_SITE = 200
+RT_SCOPE_LINK = 253
+RT_SCOPE_HOST = 254
+
+# From linux/if_link.h
+IFLA_ADDRESS = 1
+IFLA_BROADCAST = 2
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_LINK = 5
+IFLA_MASTER = 10
+IFLA_TXQLEN = 13
+IFLA_OPERSTATE = 16
+IFLA_STATS64 = 23
+IFLA_NET_NS_FD = 28
+IFLA_LINKINFO = 18
+IFLA_GSO_MAX_SEGS = 40
+IFLA_GSO_MAX_SIZE = 41
+IFLA_PARENT_DEV_NAME = 56
+IFLA_GRO_MAX_SIZE = 58
+
+IFLA_INFO_KIND = 1
+
+# RFC 2863 operational states, indexed by IF_OPER_*
+OPERSTATES = ['unknown', 'notpresent', 'down', 'lowerlayerdown', 'testing',
+              'dormant', 'up']
+
+# From linux/if_addr.h
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_FLAGS = 8
+
+IFA_F_SECONDARY = 0x01
+IFA_F_NODAD = 0x02
+IFA_F_OPTIMISTIC = 0x04
+IFA_F_DADFAILED = 0x08
+IFA_F_HOMEADDRESS = 0x10
+IFA_F_DEPRECATED = 0x20
+IFA_F_TENTATIVE = 0x40
+IFA_F_PERMANENT = 0x80
+IFA_F_MANAGETEMPADDR = 0x100
+IFA_F_NOPREFIXROUTE = 0x200
+
+# From linux/neighbour.h
+NDA_DST = 1
+NDA_LLADDR = 2
+
+# From linux/genetlink.h
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# From linux/if.h
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_LOWER_UP = 0x10000
+
+NLMSGHDR = struct.Struct('=IHHII')
+NLMSGERR = struct.Struct('=i')
+RTATTR = struct.Struct('=HH')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+NDMSG = struct.Struct('=BxxxiHBB')
+GENLMSGHDR = struct.Struct('=BBxx')
+U8 = struct.Struct('=B')
+U16 = struct.Struct('=H')
+U32 = struct.Struct('=I')
+RTNL_LINK_STATS64 = struct.Struct('=23Q')
+
+RECV_BUFFER_SIZE = 65536
+
+
+# Link attributes that can be changed on an existing link, keyed by their
+# Link field names. All are u32.
+LINK_SETTINGS = collections.OrderedDict([
+    ('mtu', IFLA_MTU),
+    ('txqlen', IFLA_TXQLEN),
+    ('gso_max_size', IFLA_GSO_MAX_SIZE),
+    ('gso_max_segs', IFLA_GSO_MAX_SEGS),
+    ('gro_max_size', IFLA_GRO_MAX_SIZE),
+])
+
+Link = collections.namedtuple('Link', [
+    'index', 'name', 'flags', 'type', 'mtu', 'mac', 'kind', 'master',
+    'parent', 'operstate', 'txqlen', 'gso_max_size', 'gso_max_segs',
+    'gro_max_size'])
+
+Address = collections.namedtuple('Address', [
+    'index', 'family', 'prefixlen', 'flags', 'scope', 'address', 'label'])
+Route = collections.namedtuple('Route', [
+    'family', 'dst', 'dst_len', 'gateway', 'oif', 'table', 'protocol',
+    'scope', 'type', 'priority'])
+
+Neighbour = collections.namedtuple('Neighbour', [
+    'family', 'index', 'state', 'flags', 'address', 'lladdr'])
+
+# struct rtnl_link_stats64. Newer kernels append fields; only the ones every
+# kernel reports are decoded.
+LinkStats64 = collections.namedtuple('LinkStats64', [
+    'rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes', 'rx_errors',
+    'tx_errors', 'rx_dropped', 'tx_dropped', 'multicast', 'collisions',
+    'rx_length_errors', 'rx_over_errors', 'rx_crc_errors', 'rx_frame_errors',
+    'rx_fifo_errors', 'rx_missed_errors', 'tx_aborted_errors',
+    'tx_carrier_errors', 'tx_fifo_errors', 'tx_heartbeat_errors',
+    'tx_window_errors', 'rx_compressed', 'tx_compressed'])
+
+
+class NetlinkError(OSError):
+    ''' Error reported by the kernel in an NLMSG_ERROR message. '''
+
+
+def align(length):
+    ''' Round length up to the 4 byte netlink alignment. '''
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type, data):
+    ''' Encode a single rtattr, including trailing padding. '''
+    length = RTATTR.size + len(data)
+    return RTATTR.pack(length, attr_type) + data + b'\x00' * (align(length) - length)
+
+
+def parse_attrs(data, offset=0):
+    ''' Parse a sequence of rtattrs into a dict of type -> raw value. '''
+    attrs = {}
+    end = len(data)
+    while offset + RTATTR.size <= end:
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = data[offset + RTATTR.size:offset + length]
+        offset += align(length)
+    return attrs
+
+
+def attr_str(value):
+    ''' Decode a NUL terminated string attribute. '''
+    return value.split(b'\x00', 1)[0]
+
+
+def attr_u32(value):
+    return U32.unpack_from(value)[0]
+
+
+def attr_mac(value):
+    return ":".join(['%02X' % i for i in bytearray(value)])
+
+
+class NetlinkSocket(object):
+    ''' A netlink socket speaking a request/response protocol. '''
+
+    def __init__(self, protocol=NETLINK_ROUTE, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+        try:
+            self.sock.bind((0, groups))
+        except Exception:
+            self.sock.close()
+            raise
+        self.seq = 0
+        self.strict = None
+        self._buf = bytearray(RECV_BUFFER_SIZE)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def enable_strict_check(self):
+        ''' Have the kernel validate dump requests and apply the filters in
+            their headers (NETLINK_GET_STRICT_CHK, Linux 4.20), as iproute2
+            does. Returns False if the kernel doesn't support it. '''
+        if self.strict is None:
+            try:
+                self.sock.setsockopt(SOL_NETLINK, NETLINK_GET_STRICT_CHK, 1)
+                self.strict = True
+            except EnvironmentError:
+                self.strict = False
+        return self.strict
+
+    def close(self):
+        self.sock.close()
+
+    def send(self, msg_type, flags, payload=b''):
+        ''' Send a single message and return its sequence number. '''
+        self.seq = (self.seq + 1) & 0xffffffff
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags,
+                               self.seq, 0)
+        self.sock.send(header + payload)
+        return self.seq
+
+    def send_batch(self, messages):
+        ''' Send (type, flags, payload) messages back to back in a single
+            datagram and return the list of their sequence numbers. '''
+        parts = []
+        seqs = []
+        for msg_type, flags, payload in messages:
+            self.seq = (self.seq + 1) & 0xffffffff
+            length = NLMSGHDR.size + len(payload)
+            parts.append(NLMSGHDR.pack(length, msg_type, flags, self.seq, 0))
+            parts.append(payload)
+            parts.append(b'\x00' * (align(length) - length))
+            seqs.append(self.seq)
+        self.sock.send(b''.join(parts))
+        return seqs
+
+    def acks(self, seqs):
+        ''' Wait for the acknowledgement of each of the given sequence
+            numbers and return a dict mapping each to None, or to the
+            NetlinkError the kernel reported. Other replies are discarded. '''
+        pending = set(seqs)
+        results = {}
+        while pending:
+            for msg_type, _flags, seq, payload in self.recv():
+                if msg_type != NLMSG_ERROR or seq not in pending:
+                    continue
+                pending.discard(seq)
+                error = NLMSGERR.unpack_from(payload)[0]
+                if error:
+                    results[seq] = NetlinkError(-error, os.strerror(-error))
+                else:
+                    results[seq] = None
+        return results
+
+    def recv(self):
+        ''' Receive one datagram and yield (type, flags, seq, payload) for each
+            message in it. '''
+        n = self.sock.recv_into(self._buf)
+        data = bytes(self._buf[:n])
+        offset = 0
+        while offset + NLMSGHDR.size <= n:
+            length, msg_type, flags, seq, _pid = NLMSGHDR.unpack_from(data, offset)
+            if length < NLMSGHDR.size:
+                break
+            yield msg_type, flags, seq, data[offset + NLMSGHDR.size:offset + length]
+            offset += align(length)
+
+    def discard(self):
+        ''' Throw away every datagram waiting on the socket. After ENOBUFS
+            the kernel still delivers the notifications queued before the
+            overflow, which would undo a resynchronisation if applied on
+            top of it. '''
+        while True:
+            try:
+                self.sock.recv_into(self._buf, 0, socket.MSG_DONTWAIT)
+            except EnvironmentError as e:
+                if e.errno == errno.ENOBUFS:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+    def _replies(self, seq):
+        ''' Yield (type, payload) replies to the given sequence number until
+            the kernel signals the end of the response. '''
+        while True:
+            for msg_type, _flags, msg_seq, payload in self.recv():
+                if msg_seq != seq:
+                    continue
+                if msg_type == NLMSG_DONE:
+                    return
+                if msg_type == NLMSG_ERROR:
+                    error = NLMSGERR.unpack_from(payload)[0]
+                    if error:
+                        raise NetlinkError(-error, os.strerror(-error))
+                    return
+                yield msg_type, payload
+
+    def request(self, msg_type, payload, flags=0):
+        ''' Send a request, wait for the kernel to acknowledge it and return
+            the list of (type, payload) replies. '''
+        seq = self.send(msg_type, NLM_F_REQUEST | NLM_F_ACK | flags, payload)
+        return list(self._replies(seq))
+
+    def dump(self, msg_type, payload):
+        ''' Issue a dump request and yield (type, payload) for each object the
+            kernel returns. '''
+        seq = self.send(msg_type, NLM_F_REQUEST | NLM_F_DUMP, payload)
+        return self._replies(seq)
+
+
+def parse_link(payload):
+    ''' Convert an RTM_NEWLINK payload into a Link. '''
+    _family, dev_type, index, flags, _change = IFINFOMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, IFINFOMSG.size)
+
+    kind = None
+    if IFLA_LINKINFO in attrs:
+        info = parse_attrs(attrs[IFLA_LINKINFO])
+        if IFLA_INFO_KIND in info:
+            kind = attr_str(info[IFLA_INFO_KIND])
+
+    mac = attrs.get(IFLA_ADDRESS)
+    mtu = attrs.get(IFLA_MTU)
+    master = attrs.get(IFLA_MASTER)
+    parent = attrs.get(IFLA_PARENT_DEV_NAME)
+    operstate = attrs.get(IFLA_OPERSTATE)
+    if operstate is not None:
+        operstate = bytearray(operstate)[0]
+        operstate = OPERSTATES[operstate] if operstate < len(OPERSTATES) else 'unknown'
+    return Link(index=index,
+                name=attr_str(attrs.get(IFLA_IFNAME, b'')),
+                flags=flags,
+                type=dev_type,
+                mtu=attr_u32(mtu) if mtu is not None else None,
+                mac=attr_mac(mac) if mac is not None else None,
+                kind=kind,
+                master=attr_u32(master) if master else None,
+                parent=attr_str(parent) if parent is not None else None,
+                operstate=operstate,
+                txqlen=_optional_u32(attrs, IFLA_TXQLEN),
+                gso_max_size=_optional_u32(attrs, IFLA_GSO_MAX_SIZE),
+                gso_max_segs=_optional_u32(attrs, IFLA_GSO_MAX_SEGS),
+                gro_max_size=_optional_u32(attrs, IFLA_GRO_MAX_SIZE))
+
+
+def _optional_u32(attrs, attr_type):
+    value = attrs.get(attr_type)
+    return attr_u32(value) if value is not None else None
+
+
+def parse_addr(payload):
+    ''' Convert an RTM_NEWADDR payload into an Address. '''
+    family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, IFADDRMSG.size)
+
+    # For point-to-point links IFA_ADDRESS is the peer; IFA_LOCAL is ours.
+    address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    if address is not None:
+        address = socket.inet_ntop(family, address)
+    label = attrs.get(IFA_LABEL)
+    # ifa_flags only has room for the first 8 flags
+    if IFA_FLAGS in attrs:
+        flags = attr_u32(attrs[IFA_FLAGS])
+    return Address(index=index,
+                   family=family,
+                   prefixlen=prefixlen,
+                   flags=flags,
+                   scope=scope,
+                   address=address,
+                   label=attr_str(label) if label is not None else None)
+
+
+def parse_route(payload):
+    ''' Convert an RTM_NEWROUTE payload into a Route. '''
+    (family, dst_len, _src_len, _tos, table, protocol, scope, rt_type,
+     _flags) = RTMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, RTMSG.size)
+
+    dst = attrs.get(RTA_DST)
+    gateway = attrs.get(RTA_GATEWAY)
+    oif = attrs.get(RTA_OIF)
+    priority = attrs.get(RTA_PRIORITY)
+    if RTA_TABLE in attrs:
+        table = attr_u32(attrs[RTA_TABLE])
+    return Route(family=family,
+                 dst=socket.inet_ntop(family, dst) if dst is not None else None,
+                 dst_len=dst_len,
+                 gateway=socket.inet_ntop(family, gateway) if gateway is not None else None,
+                 oif=attr_u32(oif) if oif is not None else None,
+                 table=table,
+                 protocol=protocol,
+                 scope=scope,
+                 type=rt_type,
+                 priority=attr_u32(priority) if priority is not None else None)
+
+
+def parse_neigh(payload):
+    ''' Convert an RTM_NEWNEIGH payload into a Neighbour. '''
+    family, index, state, flags, _ntype = NDMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, NDMSG.size)
+
+    address = attrs.get(NDA_DST)
+    if address is not None and family in (socket.AF_INET, socket.AF_INET6):
+        address = socket.inet_ntop(family, address)
+    lladdr = attrs.get(NDA_LLADDR)
+    return Neighbour(family=family,
+                     index=index,
+                     state=state,
+                     flags=flags,
+                     address=address,
+                     lladdr=attr_mac(lladdr) if lladdr is not None else None)
+
+
+def get_socket():
+    ''' Return the rtnetlink socket of the calling thread's context. '''
+    from . import context
+    return context.get_context().netlink
+
+
+def link_msg(name=None, index=0, flags=0, change=0, attrs=()):
+    ''' Build an ifinfomsg selecting a link by index and/or name, followed by
+        the given (type, value) attributes. '''
+    msg = IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, flags, change)
+    if name is not None:
+        msg += pack_attr(IFLA_IFNAME, name + b'\x00')
+    for attr_type, value in attrs:
+        msg += pack_attr(attr_type, value)
+    return msg
+
+
+def link_settings_attrs(settings):
+    ''' Convert a dict of LINK_SETTINGS values, e.g. {'mtu': 9000}, into
+        (type, value) attributes for link_msg(). '''
+    attrs = []
+    for field, attr_type in LINK_SETTINGS.items():
+        if settings.get(field) is not None:
+            attrs.append((attr_type, U32.pack(settings[field])))
+    unknown = set(settings) - set(LINK_SETTINGS)
+    if unknown:
+        raise ValueError("unknown link settings: %s" %
+                         ", ".join(sorted(unknown)))
+    return attrs
+
+
+def addr_msg(index, address, prefixlen, family=socket.AF_INET):
+    ''' Build an ifaddrmsg for the given address on the link with the given
+        index. '''
+    packed = socket.inet_pton(family, address)
+    return (IFADDRMSG.pack(family, prefixlen, 0, 0, index) +
+            pack_attr(IFA_LOCAL, packed) + pack_attr(IFA_ADDRESS, packed))
+
+
+def get_links(sock=None):
+    ''' Return a list of Links for every network device, using a single
+        RTM_GETLINK dump. '''
+    sock = sock or get_socket()
+    return [parse_link(payload) for msg_type, payload
+            in sock.dump(RTM_GETLINK, link_msg()) if msg_type == RTM_NEWLINK]
+
+
+def parse_link_stats64(payload):
+    ''' Return (index, name, LinkStats64) for an RTM_NEWLINK payload, or
+        None if it carries no 64-bit stats. '''
+    index = IFINFOMSG.unpack_from(payload)[2]
+    attrs = parse_attrs(payload, IFINFOMSG.size)
+    value = attrs.get(IFLA_STATS64)
+    if value is None or len(value) < RTNL_LINK_STATS64.size:
+        return None
+    name = attr_str(attrs.get(IFLA_IFNAME, b''))
+    return index, name, LinkStats64._make(RTNL_LINK_STATS64.unpack_from(value))
+
+
+def iter_link_stats64(sock=None):
+    ''' Yield (index, name, LinkStats64) for every device, using a single
+        RTM_GETLINK dump. '''
+    sock = sock or get_socket()
+    for msg_type, payload in sock.dump(RTM_GETLINK, link_msg()):
+        if msg_type == RTM_NEWLINK:
+            stats = parse_link_stats64(payload)
+            if stats is not None:
+                yield stats
+
+
+def get_link_stats64(sock=None):
+    ''' Return a dict mapping every device name to its LinkStats64. '''
+    return dict((name, stats) for _index, name, stats
+                in iter_link_stats64(sock))
+
+
+def get_link(name, sock=None):
+    ''' Return the Link with the given name, or None if there is no such
+        device. '''
+    sock = sock or get_socket()
+    try:
+        replies = sock.request(RTM_GETLINK, link_msg(name))
+    except NetlinkError as e:
+        if e.errno == errno.ENODEV:
+            return None
+        raise
+    for msg_type, payload in replies:
+        if msg_type == RTM_NEWLINK:
+            return parse_link(payload)
+    return None
+
+
+def get_addresses(family=socket.AF_UNSPEC, sock=None, index=0):
+    ''' Return a list of Addresses configured on all devices, or only on the
+        device with the given ifindex, using a single RTM_GETADDR dump.
+        Kernels with strict checking dump just that device's addresses. '''
+    sock = sock or get_socket()
+    if index:
+        sock.enable_strict_check()
+    msg = IFADDRMSG.pack(family, 0, 0, 0, index)
+    return [parse_addr(payload) for msg_type, payload
+            in sock.dump(RTM_GETADDR, msg) if msg_type == RTM_NEWADDR and
+            (not index or IFADDRMSG.unpack_from(payload)[4] == index)]
+
+
+def get_routes(family=socket.AF_UNSPEC, sock=None):
+    ''' Return a list of Routes in every table, using a single RTM_GETROUTE
+        dump. '''
+    sock = sock or get_socket()
+    msg = RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)
+    return [parse_route(payload) for msg_type, payload
+            in sock.dump(RTM_GETROUTE, msg) if msg_type == RTM_NEWROUTE]
+
+
+def get_family_id(name, sock):
+    ''' Return the id of the generic netlink family with the given name,
+        asking the controller over sock (a NETLINK_GENERIC NetlinkSocket). '''
+    msg = GENLMSGHDR.pack(CTRL_CMD_GETFAMILY, 1)
+    msg += pack_attr(CTRL_ATTR_FAMILY_NAME, name + b'\x00')
+    for _msg_type, payload in sock.request(GENL_ID_CTRL, msg):
+        attrs = parse_attrs(payload, GENLMSGHDR.size)
+        if CTRL_ATTR_FAMILY_ID in attrs:
+            return U16.unpack_from(attrs[CTRL_ATTR_FAMILY_ID])[0]
+    raise NetlinkError(errno.ENOENT, os.strerror(errno.ENOENT))
+
+
+def shutdown():
+    ''' Close the rtnetlink socket of the calling thread's context '''
+    from . import context
+    context.get_context().close_netlink()
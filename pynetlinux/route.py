@@ -1,6 +1,27 @@
-def get_default_if():
-    """ Returns the default interface """
-    f = open ('/proc/net/route', 'r')
+import socket
+
+from . import context
+from . import netlink
+
+
+def _default_route(ctx):
+    for route in netlink.get_routes(socket.AF_INET, ctx.netlink):
+        if route.dst_len == 0 and route.table == netlink.RT_TABLE_MAIN:
+            return route
+    return None
+
+
+def get_default_if(ctx=None):
+    """ Returns the default interface, or None. For a namespace Context
+    (given or current) the main routing table is read over rtnetlink """
+    ctx = ctx or context.get_context()
+    if ctx.netns is not None:
+        route = _default_route(ctx)
+        if route is None or route.oif is None:
+            return None
+        return ctx.index_cache.name(route.oif)
+    interf = None
+    f = open ('/proc/net/route', 'rb')
     for line in f:
         words = line.split()
         dest = words[1]
@@ -12,8 +33,13 @@ def get_default_if():
             pass
     return interf
 
-def get_default_gw():
-    """ Returns the default gateway """
+def get_default_gw(ctx=None):
+    """ Returns the default gateway. For a namespace Context (given or
+    current) the main routing table is read over rtnetlink """
+    ctx = ctx or context.get_context()
+    if ctx.netns is not None:
+        route = _default_route(ctx)
+        return route.gateway if route is not None else None
     octet_list = []
     gw_from_route = None
     f = open ('/proc/net/route', 'r')
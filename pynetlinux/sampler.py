@@ -0,0 +1,155 @@
+import array
+import time
+
+from . import ifconfig
+from . import util
+
+# Counters reported by drivers that only keep 32 bits wrap at this value.
+WRAP32 = 1 << 32
+
+DEFAULT_COUNTERS = ("rx_bytes", "rx_packets", "tx_bytes", "tx_packets")
+
+if util.PY3:
+    _COUNTER_TYPECODE = 'Q'
+    _clock = time.monotonic
+else:
+    _COUNTER_TYPECODE = 'L'
+    _clock = time.time
+
+
+class Port(object):
+    ''' Per-interface sampler state. rates holds the per-second rate of each
+        sampled counter over the last interval; it is updated in place. '''
+
+    __slots__ = ('name', 'index', 'stamp', 'last', 'rates', 'history', 'pos',
+                 'filled')
+
+    def __init__(self, name, index, ncounters, window):
+        self.name = name
+        self.index = index
+        self.stamp = None
+        self.last = array.array(_COUNTER_TYPECODE, [0] * ncounters)
+        self.rates = array.array('d', [0.0] * ncounters)
+        # Ring buffer of the last `window` rate vectors, flattened.
+        self.history = array.array('d', [0.0] * (ncounters * window))
+        self.pos = 0
+        self.filled = 0
+
+    def __repr__(self):
+        return "<%s %s at 0x%x>" % (self.__class__.__name__, self.name, id(self))
+
+
+class RateSampler(object):
+    '''
+    Computes per-second counter rates for many interfaces from one read of
+    the kernel counters per tick.
+
+    Raw counters and rates are kept in preallocated arrays per interface, so
+    sampling allocates no per-interface dicts. A counter that goes backwards
+    is treated as a 32-bit wrap if its previous value fit in 32 bits, and as
+    a reset otherwise. An interface that disappears is forgotten, and one
+    whose ifindex changes (i.e. it was re-created) starts a new baseline.
+    '''
+
+    def __init__(self, counters=DEFAULT_COUNTERS, window=60, names=None,
+                 use_netlink=True):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.counters = tuple(counters)
+        self.window = window
+        self.names = set(names) if names is not None else None
+        self.use_netlink = use_netlink
+        self.ports = {}
+        self._columns = [ifconfig.STATS_TITLES.index(c) for c in self.counters]
+
+    def _read(self):
+        if self.use_netlink:
+            try:
+                return list(ifconfig.iter_netlink_stats())
+            except EnvironmentError:
+                self.use_netlink = False
+        # /proc/net/dev has no ifindex, so re-creation between two samples
+        # can only be noticed as a counter reset.
+        return [(name, None, counters)
+                for name, counters in ifconfig.iter_proc_net_dev()]
+
+    def sample(self, now=None):
+        ''' Read the counters of every interface once and update the rates.
+            Return the list of Ports that have a rate for this interval. '''
+        if now is None:
+            now = _clock()
+        ncounters = len(self.counters)
+        seen = set()
+        updated = []
+        for name, index, values in self._read():
+            if self.names is not None and name not in self.names:
+                continue
+            seen.add(name)
+            port = self.ports.get(name)
+            if port is None or port.index != index:
+                port = self.ports[name] = Port(name, index, ncounters, self.window)
+
+            last = port.last
+            if port.stamp is None:
+                for i, col in enumerate(self._columns):
+                    last[i] = values[col]
+                port.stamp = now
+                continue
+
+            elapsed = now - port.stamp
+            if elapsed <= 0:
+                continue
+
+            rates = port.rates
+            base = port.pos * ncounters
+            for i, col in enumerate(self._columns):
+                value = values[col]
+                delta = value - last[i]
+                if delta < 0:
+                    delta = value + WRAP32 - last[i] if last[i] < WRAP32 else 0
+                last[i] = value
+                rates[i] = port.history[base + i] = delta / float(elapsed)
+            port.stamp = now
+            port.pos = (port.pos + 1) % self.window
+            if port.filled < self.window:
+                port.filled += 1
+            updated.append(port)
+
+        for name in list(self.ports):
+            if name not in seen:
+                del self.ports[name]
+        return updated
+
+    def rate(self, name, counter):
+        ''' Return the latest per-second rate of counter on the named
+            interface. '''
+        port = self.ports[name]
+        return port.rates[self.counters.index(counter)]
+
+    def percentile(self, name, counter, pct):
+        ''' Return the pct-th percentile (nearest rank) of the rate of counter
+            over the sampling window, or None if there are no samples yet. '''
+        port = self.ports[name]
+        if not port.filled:
+            return None
+        ncounters = len(self.counters)
+        col = self.counters.index(counter)
+        values = sorted(port.history[col:port.filled * ncounters:ncounters])
+        rank = int(round(pct / 100.0 * (len(values) - 1)))
+        return values[min(max(rank, 0), len(values) - 1)]
+
+    def stream(self, interval=1.0, count=None):
+        ''' Sample every interval seconds and yield (timestamp, port) for each
+            interface that has a rate. port.rates is reused on the next tick;
+            copy it if it has to be kept. Stops after count ticks if given. '''
+        deadline = _clock()
+        ticks = 0
+        while count is None or ticks < count:
+            now = _clock()
+            for port in self.sample(now):
+                yield now, port
+            ticks += 1
+            deadline += interval
+            delay = deadline - _clock()
+            if delay > 0 and (count is None or ticks < count):
+                time.sleep(delay)
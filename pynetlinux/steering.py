@@ -0,0 +1,324 @@
+import collections
+import errno
+import os
+import re
+
+"""
+Spreading packet processing across CPUs: Receive Packet Steering (RPS) and
+Transmit Packet Steering (XPS) masks and RPS flow counts under
+/sys/class/net/<if>/queues, and interrupt affinity under /proc/irq.
+
+CPU sets are passed and returned as sets of CPU numbers. They are written in
+the kernel's mask format: hex words of 32 CPUs each, most significant
+first, separated by commas.
+"""
+
+SYSFS_NET_PATH = b"/sys/class/net"
+PROC_INTERRUPTS = "/proc/interrupts"
+PROC_IRQ_PATH = "/proc/irq"
+CPU_ONLINE_PATH = "/sys/devices/system/cpu/online"
+
+# One interrupt line of a device. kind is 'rx', 'tx' or 'combined' for queue
+# interrupts, whose queue is then the queue index, and None for others
+# (e.g. link state or mailbox interrupts).
+Irq = collections.namedtuple('Irq', ['irq', 'action', 'kind', 'queue'])
+
+# One CPU set chosen by spread(). kind is 'rps' or 'xps', with index a queue
+# number, or 'irq', with index an IRQ number. changed is whether a write was
+# made; error is None on success, or the exception the write failed with.
+Assignment = collections.namedtuple('Assignment', [
+    'kind', 'index', 'cpus', 'changed', 'error'])
+
+_QUEUE_NUMBER = re.compile(r'(\d+)$')
+
+
+def parse_cpumask(text):
+    ''' Return the set of CPUs in a mask such as '00000000,0000000f'. '''
+    mask = int(text.strip().replace(',', '') or '0', 16)
+    cpus = set()
+    cpu = 0
+    while mask:
+        if mask & 1:
+            cpus.add(cpu)
+        mask >>= 1
+        cpu += 1
+    return cpus
+
+
+def format_cpumask(cpus):
+    ''' Return the mask for a set of CPUs, e.g. '00000000,0000000f'. '''
+    mask = 0
+    for cpu in cpus:
+        mask |= 1 << cpu
+    words = []
+    while True:
+        words.append('%08x' % (mask & 0xffffffff))
+        mask >>= 32
+        if not mask:
+            break
+    return ','.join(reversed(words))
+
+
+def parse_cpulist(text):
+    ''' Return the set of CPUs in a list such as '0-3,8'. '''
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def online_cpus():
+    ''' Return the set of online CPUs. '''
+    with open(CPU_ONLINE_PATH) as f:
+        return parse_cpulist(f.read())
+
+
+def _check_ctx(ctx):
+    # sysfs shows the namespace it was mounted in, not the context's.
+    if ctx is not None and ctx.netns is not None:
+        raise IOError(errno.EOPNOTSUPP,
+                      "queue steering is only available in the initial "
+                      "network namespace")
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('ascii').strip()
+
+
+def _write(path, value):
+    # A single write(), so the kernel's error reaches the caller.
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.write(fd, value.encode('ascii'))
+    finally:
+        os.close(fd)
+
+
+def _queue_path(name, kind, queue, attr):
+    return os.path.join(SYSFS_NET_PATH, name, b"queues",
+                        b"%s-%d" % (kind, queue), attr)
+
+
+def _queues(name, kind, ctx):
+    _check_ctx(ctx)
+    prefix = kind + b"-"
+    return sorted(int(d[len(prefix):])
+                  for d in os.listdir(os.path.join(SYSFS_NET_PATH, name,
+                                                   b"queues"))
+                  if d.startswith(prefix))
+
+
+def rx_queues(name, ctx=None):
+    ''' Return the numbers of the interface's receive queues. '''
+    return _queues(name, b"rx", ctx)
+
+
+def tx_queues(name, ctx=None):
+    ''' Return the numbers of the interface's transmit queues. '''
+    return _queues(name, b"tx", ctx)
+
+
+def _get_mask(name, kind, queue, attr, ctx):
+    _check_ctx(ctx)
+    return parse_cpumask(_read(_queue_path(name, kind, queue, attr)))
+
+
+def _set_mask(path, cpus):
+    cpus = set(cpus)
+    if parse_cpumask(_read(path)) == cpus:
+        return False
+    _write(path, format_cpumask(cpus))
+    return True
+
+
+def get_rps(name, queue, ctx=None):
+    ''' Return the CPUs RPS steers the receive queue's packets to. An
+        empty set means RPS is off. '''
+    return _get_mask(name, b"rx", queue, b"rps_cpus", ctx)
+
+
+def set_rps(name, queue, cpus, ctx=None):
+    ''' Steer the receive queue's packets to the given CPUs, or turn RPS off
+        for an empty set. Returns False, without writing, if already set. '''
+    _check_ctx(ctx)
+    return _set_mask(_queue_path(name, b"rx", queue, b"rps_cpus"), cpus)
+
+
+def get_rps_flow_cnt(name, queue, ctx=None):
+    ''' Return the number of flows tracked for the receive queue by Receive
+        Flow Steering. '''
+    _check_ctx(ctx)
+    return int(_read(_queue_path(name, b"rx", queue, b"rps_flow_cnt")))
+
+
+def set_rps_flow_cnt(name, queue, count, ctx=None):
+    ''' Set the number of flows tracked for the receive queue. The kernel
+        rounds it up to a power of two. Returns False, without writing, if
+        already set. '''
+    _check_ctx(ctx)
+    path = _queue_path(name, b"rx", queue, b"rps_flow_cnt")
+    if int(_read(path)) == count:
+        return False
+    _write(path, '%d' % count)
+    return True
+
+
+def get_xps(name, queue, ctx=None):
+    ''' Return the CPUs whose packets XPS sends through the transmit
+        queue. '''
+    return _get_mask(name, b"tx", queue, b"xps_cpus", ctx)
+
+
+def set_xps(name, queue, cpus, ctx=None):
+    ''' Send packets from the given CPUs through the transmit queue.
+        Returns False, without writing, if already set. '''
+    _check_ctx(ctx)
+    return _set_mask(_queue_path(name, b"tx", queue, b"xps_cpus"), cpus)
+
+
+def get_irq_affinity(irq):
+    ''' Return the CPUs the interrupt may be handled on. '''
+    return parse_cpumask(_read('%s/%d/smp_affinity' % (PROC_IRQ_PATH, irq)))
+
+
+def set_irq_affinity(irq, cpus):
+    ''' Restrict the interrupt to the given CPUs. Returns False, without
+        writing, if already set. Managed interrupts refuse with EIO. '''
+    return _set_mask('%s/%d/smp_affinity' % (PROC_IRQ_PATH, irq), cpus)
+
+
+def iter_interrupts():
+    ''' Yield (irq, action) for every action in /proc/interrupts, e.g.
+        (41, 'virtio3-output.0'). '''
+    with open(PROC_INTERRUPTS) as f:
+        for line in f:
+            number, _sep, rest = line.partition(':')
+            if not number.strip().isdigit():
+                continue
+            # Actions follow two spaces and are separated by ', '
+            fields = rest.rstrip('\n').rsplit('  ', 1)
+            if len(fields) < 2:
+                continue
+            for action in fields[1].split(', '):
+                if action.strip():
+                    yield int(number), action.strip()
+
+
+def _device_irqs(name):
+    ''' Return the IRQs of the interface's device and the device's name. '''
+    device = os.path.join(SYSFS_NET_PATH, name, b"device")
+    if not os.path.exists(device):
+        return set(), None
+    devname = os.path.basename(os.path.realpath(device)).decode('ascii')
+    msi_irqs = os.path.join(device, b"msi_irqs")
+    if os.path.isdir(msi_irqs):
+        return set(int(i) for i in os.listdir(msi_irqs)), devname
+    irq_path = os.path.join(device, b"irq")
+    if os.path.exists(irq_path):
+        irq = int(_read(irq_path))
+        if irq:
+            return set([irq]), devname
+    return set(), devname
+
+
+def _classify(action, prefixes):
+    ''' Return the kind and queue number of an interrupt from its action
+        name, e.g. ('combined', 3) for 'eth0-TxRx-3'. '''
+    rest = action.split('@')[0]
+    for prefix in prefixes:
+        if prefix and rest.startswith(prefix):
+            rest = rest[len(prefix):]
+            break
+    match = _QUEUE_NUMBER.search(rest)
+    if not match:
+        return None, None
+    lower = rest.lower()
+    rx = 'rx' in lower or 'input' in lower
+    tx = 'tx' in lower or 'output' in lower
+    if rx and not tx:
+        kind = 'rx'
+    elif tx and not rx:
+        kind = 'tx'
+    else:
+        kind = 'combined'
+    return kind, int(match.group(1))
+
+
+def get_irqs(name, ctx=None):
+    ''' Return the interface's interrupts as a list of Irqs, ordered by IRQ
+        number. They are the device's MSI or legacy interrupts, and any
+        whose action names the interface or (for virtio, whose interrupts
+        belong to the parent PCI device) the device. '''
+    _check_ctx(ctx)
+    irqs, devname = _device_irqs(name)
+    ifname = name.decode('ascii')
+    prefixes = [p for p in (ifname, devname) if p]
+    result = []
+    for irq, action in iter_interrupts():
+        owned = irq in irqs or any(
+            action == p or action.startswith(p + '-') for p in prefixes)
+        if owned:
+            kind, queue = _classify(action, prefixes)
+            result.append(Irq(irq, action, kind, queue))
+    return sorted(result)
+
+
+def _partition(count, cpus):
+    ''' Split cpus into count sets: one CPU each, reused round robin, if
+        there are at least as many queues as CPUs, otherwise an even share
+        of neighbouring CPUs each. '''
+    cpus = sorted(cpus)
+    if not cpus:
+        raise ValueError("no CPUs given")
+    if count >= len(cpus):
+        return [set([cpus[i % len(cpus)]]) for i in range(count)]
+    return [set(cpus[i * len(cpus) // count:(i + 1) * len(cpus) // count])
+            for i in range(count)]
+
+
+def _assign(kind, index, cpus, setter, *args):
+    try:
+        return Assignment(kind, index, cpus, setter(*args), None)
+    except EnvironmentError as e:
+        return Assignment(kind, index, cpus, False, e)
+
+
+def spread(name, cpus=None, rps=True, xps=True, irqs=True, ctx=None):
+    ''' Distribute the interface's queues evenly across cpus (by default
+        every online CPU): receive queue i's RPS mask and interrupt get the
+        i-th share of the CPUs, and likewise transmit queue i's XPS mask and
+        interrupt. Only values that differ are written, and a write that
+        fails does not stop the rest. Returns a list of Assignments. '''
+    _check_ctx(ctx)
+    if cpus is None:
+        cpus = online_cpus()
+    rx = rx_queues(name)
+    tx = tx_queues(name)
+    rx_plan = _partition(len(rx), cpus) if rx else []
+    tx_plan = _partition(len(tx), cpus) if tx else []
+
+    result = []
+    if rps:
+        for queue, share in zip(rx, rx_plan):
+            result.append(_assign('rps', queue, share, set_rps, name, queue,
+                                  share))
+    if xps and len(tx) > 1:
+        for queue, share in zip(tx, tx_plan):
+            result.append(_assign('xps', queue, share, set_xps, name, queue,
+                                  share))
+    if irqs:
+        for irq in get_irqs(name):
+            plan = tx_plan if irq.kind == 'tx' else rx_plan
+            if irq.queue is None or not plan:
+                continue
+            share = plan[irq.queue % len(plan)]
+            result.append(_assign('irq', irq.irq, share, set_irq_affinity,
+                                  irq.irq, share))
+    return result
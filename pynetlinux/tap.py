@@ -1,8 +1,18 @@
+import collections
+import errno
 import fcntl
+import multiprocessing
 import os
+import select
 import struct
+import threading
+import time
 
+from . import bpf
+from . import brctl
+from . import context
 from . import ifconfig
+from . import ifreq
 from . import util
 
 # From linux/if_tun.h
@@ -14,15 +24,255 @@ TUNSETIFF     = 0x400454ca
 TUNSETPERSIST = 0x400454cb
 TUNSETOWNER   = 0x400454cc
 TUNSETLINK    = 0x400454cd
+TUNSETGROUP   = 0x400454ce
+TUNSETOFFLOAD = 0x400454d0
+TUNGETIFF     = 0x800454d2
+TUNGETVNETHDRSZ = 0x800454d7
+TUNSETVNETHDRSZ = 0x400454d8
+TUNSETQUEUE   = 0x400454d9
+# _IOW('T', 213/214, struct sock_fprog), whose size depends on the ABI
+TUNATTACHFILTER = 0x400054d5 | bpf.SOCK_FPROG.size << 16
+TUNDETACHFILTER = 0x400054d6 | bpf.SOCK_FPROG.size << 16
+TUNSETSTEERINGEBPF = 0x800454e0
 
 # TUNSETIFF ifr flags
 IFF_TUN       = 0x0001
 IFF_TAP		  = 0x0002
+IFF_MULTI_QUEUE = 0x0100
+IFF_ATTACH_QUEUE = 0x0200
+IFF_DETACH_QUEUE = 0x0400
 IFF_NO_PI	  = 0x1000
 IFF_ONE_QUEUE = 0x2000
+IFF_VNET_HDR  = 0x4000
 
+# TUNSETOFFLOAD flags: what frames written to the tap may leave undone
+TUN_F_CSUM    = 0x01    # checksums (required by the others)
+TUN_F_TSO4    = 0x02
+TUN_F_TSO6    = 0x04
+TUN_F_TSO_ECN = 0x08
+TUN_F_UFO     = 0x10    # accepted but ignored since Linux 4.14
+TUN_F_USO4    = 0x20
+TUN_F_USO6    = 0x40
 
-class Tap(ifconfig.Interface):
+GSO_OFFLOADS = TUN_F_TSO4 | TUN_F_TSO6 | TUN_F_UFO | TUN_F_USO4 | TUN_F_USO6
+
+# From linux/virtio_net.h
+
+# virtio_net_hdr flags
+VIRTIO_NET_HDR_F_NEEDS_CSUM = 1
+VIRTIO_NET_HDR_F_DATA_VALID = 2
+
+# virtio_net_hdr gso_type
+VIRTIO_NET_HDR_GSO_NONE   = 0
+VIRTIO_NET_HDR_GSO_TCPV4  = 1
+VIRTIO_NET_HDR_GSO_UDP    = 3
+VIRTIO_NET_HDR_GSO_TCPV6  = 4
+VIRTIO_NET_HDR_GSO_UDP_L4 = 5
+VIRTIO_NET_HDR_GSO_ECN    = 0x80
+
+# struct virtio_net_hdr, in host byte order, which precedes every frame on a
+# tap opened with IFF_VNET_HDR
+VIRTIO_NET_HDR = struct.Struct("=BBHHHH")
+VnetHdr = collections.namedtuple('VnetHdr', [
+    'flags', 'gso_type', 'hdr_len', 'gso_size', 'csum_start', 'csum_offset'])
+NO_VNET_HDR = VnetHdr(0, VIRTIO_NET_HDR_GSO_NONE, 0, 0, 0, 0)
+
+# From linux/sockios.h
+SIOCSIFMTU = 0x8922
+
+# Most queues a multiqueue device can have (MAX_TAP_QUEUES)
+MAX_QUEUES = 256
+
+# ifreq with the TUNSETIFF flags in ifru_flags
+TUNSETIFF_REQ = struct.Struct("16sH")
+
+
+def _open_tun(name, flags, blocking, ctx):
+    ''' Open /dev/net/tun and attach it to the named device, creating it
+        if need be, with TUNSETIFF. Returns (fileno, file, device name). '''
+    oflags = os.O_RDWR
+    if not blocking:
+        oflags |= os.O_NONBLOCK
+    # The device is created in the namespace /dev/net/tun was opened in
+    fileno = (ctx or context.get_context()).open("/dev/net/tun", oflags)
+
+    if util.PY3:
+        fd = os.fdopen(fileno, 'w+b', buffering=0)
+    else:
+        fd = os.fdopen(fileno, 'w+b')
+
+    try:
+        res = ifreq.ioctl(fd, TUNSETIFF, TUNSETIFF_REQ, name or b"", flags)
+        fcntl.ioctl(fd, TUNSETNOCSUM, 1)
+        if flags & IFF_VNET_HDR:
+            fcntl.ioctl(fd, TUNSETVNETHDRSZ,
+                        struct.pack("i", VIRTIO_NET_HDR.size))
+    except:
+        fd.close()
+        raise
+    return fileno, fd, res[0].strip(b'\x00')
+
+
+def split_vnet_hdr(frame):
+    ''' Split a frame read from a tap opened with vnet_hdr into a VnetHdr
+        and the ethernet frame (a memoryview of frame). '''
+    view = memoryview(frame)
+    return (VnetHdr._make(VIRTIO_NET_HDR.unpack_from(view)),
+            view[VIRTIO_NET_HDR.size:])
+
+
+# Room beyond the MTU for a frame's ethernet header and one VLAN tag
+FRAME_OVERHEAD = 18
+
+# Largest read from a tap opened with vnet_hdr and GSO offloads
+MAX_VNET_FRAME = VIRTIO_NET_HDR.size + 65536 + FRAME_OVERHEAD
+
+
+def _set_offload(device, fd, flags):
+    if flags and not device.vnet_hdr:
+        raise ValueError("offloads need a tap opened with vnet_hdr")
+    fcntl.ioctl(fd, TUNSETOFFLOAD, flags)
+    device.offload = flags
+
+
+def _attach_filter(device, fd, program):
+    fprog, _buf = bpf.pack(program)
+    fcntl.ioctl(fd, TUNATTACHFILTER, fprog)
+    device.filter = program
+
+
+def _detach_filter(device, fd):
+    fcntl.ioctl(fd, TUNDETACHFILTER, bpf.SOCK_FPROG.pack(0, 0))
+    device.filter = None
+
+
+class FramePool(object):
+    '''
+    Preallocated receive buffers for read_batch(): `frames` slots of
+    frame_size bytes each, carved out of one bytearray. A frame longer than
+    its slot is truncated by the kernel, so frame_size must cover the MTU
+    plus FRAME_OVERHEAD.
+    '''
+
+    def __init__(self, frames=64, frame_size=2048):
+        self.frame_size = frame_size
+        self.buffer = bytearray(frames * frame_size)
+        view = memoryview(self.buffer)
+        self.slots = [view[i * frame_size:(i + 1) * frame_size]
+                      for i in range(frames)]
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class _FrameIO(object):
+    ''' Copy-free and batched frame I/O for Tap and TapQueue, which
+        provide fd, fileno(), blocking, vnet_hdr and _device(). '''
+
+    _pool = None
+
+    def readinto(self, buf):
+        ''' Read one frame into buf (a bytearray or writable memoryview) and
+            return its length, or None if the device is non-blocking and no
+            frame is ready. '''
+        try:
+            return self.fd.readinto(buf)
+        except EnvironmentError as e:
+            if e.errno == errno.EAGAIN:
+                return None
+            raise
+
+    def frame_pool(self, frames=64):
+        ''' Return a FramePool with slots big enough for the device's
+            current MTU or, with GSO offloads on, its largest GSO frame, plus
+            any virtio_net_hdr. '''
+        device = self._device()
+        link = device.get_link()
+        size = link.mtu
+        if device.offload & GSO_OFFLOADS:
+            size = max(size, link.gso_max_size or 65536)
+        size += FRAME_OVERHEAD
+        if self.vnet_hdr:
+            size += VIRTIO_NET_HDR.size
+        return FramePool(frames, size)
+
+    def read_batch(self, pool=None):
+        ''' Read every frame that is ready, up to len(pool), into the pool's
+            slots and return a list of memoryviews of them. They are only
+            valid until the pool is next used. pool defaults to one made by
+            frame_pool() on first use.
+
+            A non-blocking device returns an empty list if nothing is ready.
+            A blocking one waits for the first frame, then polls before each
+            further read, so non-blocking devices are faster. '''
+        if pool is None:
+            if self._pool is None:
+                self._pool = self.frame_pool()
+            pool = self._pool
+        frames = []
+        append = frames.append
+        readinto = self.fd.readinto
+        slots = pool.slots
+        try:
+            if self.blocking:
+                append(slots[0][:readinto(slots[0])])
+                poller = select.poll()
+                poller.register(self.fileno(), select.POLLIN)
+                for slot in slots[1:]:
+                    if not poller.poll(0):
+                        break
+                    append(slot[:readinto(slot)])
+            else:
+                for slot in slots:
+                    n = readinto(slot)
+                    if n is None:
+                        break
+                    append(slot[:n])
+        except EnvironmentError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        return frames
+
+    def write_batch(self, frames):
+        ''' Write each of frames (bytes, bytearrays or memoryviews, which are
+            not copied) as one frame. Returns the number written, which is
+            short only if a non-blocking device can't take more. '''
+        fileno = self.fileno()
+        written = 0
+        for frame in frames:
+            try:
+                os.write(fileno, frame)
+            except EnvironmentError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            written += 1
+        return written
+
+    def writev(self, parts):
+        ''' Write one frame gathered from several buffers, e.g. a header and
+            a payload, without joining them. Python 3 only. '''
+        return os.writev(self.fileno(), parts)
+
+    def read_vnet(self, n=MAX_VNET_FRAME):
+        ''' Read one frame from a tap opened with vnet_hdr and return its
+            (VnetHdr, ethernet frame). '''
+        hdr, frame = split_vnet_hdr(self.read(n))
+        return hdr, frame.tobytes()
+
+    def write_vnet(self, frame, hdr=NO_VNET_HDR):
+        ''' Write an ethernet frame to a tap opened with vnet_hdr, preceded
+            by hdr, a VnetHdr. With TUN_F_CSUM and GSO offloads on (see
+            set_offload()), frame can be a GSO superframe of up to 64KB
+            whose checksums the kernel fills in. Returns the number of bytes
+            written, including the header. '''
+        packed = VIRTIO_NET_HDR.pack(*hdr)
+        if util.PY3:
+            return os.writev(self.fileno(), [packed, frame])
+        return os.write(self.fileno(), packed + bytes(frame))
+
+
+class Tap(_FrameIO, ifconfig.Interface):
     """
     An object representing a Linux tap device. This object can be used as an
     argument to select().
@@ -32,35 +282,49 @@ class Tap(ifconfig.Interface):
     """
     
     # See ifconfig.py for details of ifr struct
-    def __init__(self, name=None, blocking=True):
+    def __init__(self, name=None, blocking=True, ctx=None, vnet_hdr=False):
         '''If name is None, the kernel will allocate a device name of the form tap#,
-        where # is the lowest unused tap device number.'''
-        flags = os.O_RDWR
-        if not blocking:
-            flags |= os.O_NONBLOCK
-        self._fileno = os.open("/dev/net/tun", flags)
-
-        if util.PY3:
-            self.fd = os.fdopen(self._fileno, 'w+b', buffering=0)
-        else:
-            self.fd = os.fdopen(self._fileno, 'w+b')
-
-        if name is None:
-            name = b""
-
+        where # is the lowest unused tap device number. With vnet_hdr, every
+        frame is preceded by a virtio_net_hdr (see read_vnet() and
+        write_vnet()), which offloads (see set_offload()) require.'''
         # TAP device with no packet information.
-        ifreq = struct.pack("16sH", name, IFF_TAP | IFF_NO_PI)
-        res = fcntl.ioctl(self.fd, TUNSETIFF, ifreq)
-        self.name = struct.unpack("16sH", res)[0].strip(b'\x00')
-        
-        fcntl.ioctl(self.fd, TUNSETNOCSUM, 1)
-        ifconfig.Interface.__init__(self, self.name)
+        flags = IFF_TAP | IFF_NO_PI
+        if vnet_hdr:
+            flags |= IFF_VNET_HDR
+        self._fileno, self.fd, self.name = _open_tun(name, flags, blocking, ctx)
+        self.blocking = blocking
+        self.vnet_hdr = vnet_hdr
+        self.offload = 0
+        self.filter = None
+        ifconfig.Interface.__init__(self, self.name, ctx)
+
+    def _device(self):
+        return self
     
     def persist(self):
         fcntl.ioctl(self.fd, TUNSETPERSIST, 1)
+
+    def set_offload(self, flags):
+        ''' Declare which work (TUN_F_* flags) frames written to the tap may
+            leave to the kernel, e.g. TUN_F_CSUM | TUN_F_TSO4 | TUN_F_TSO6.
+            The device advertises the matching features, so the kernel also
+            sends the tap unsegmented, unchecksummed frames. Requires
+            vnet_hdr. '''
+        _set_offload(self, self.fd, flags)
+
+    def attach_filter(self, program):
+        ''' Have the kernel drop, before they are queued for reading, the
+            frames a classic BPF program (a list of bpf.Instructions, e.g.
+            from bpf.build_filter()) rejects. Replaces any earlier filter. '''
+        _attach_filter(self, self.fd, program)
+
+    def detach_filter(self):
+        ''' Remove the filter, so every frame is read again. '''
+        _detach_filter(self, self.fd)
     
     def unpersist(self):
         fcntl.ioctl(self.fd, TUNSETPERSIST, 0)
+        self.ctx.index_cache.invalidate(self.name)
 
     def fileno(self):
         return self._fileno
@@ -73,4 +337,471 @@ class Tap(ifconfig.Interface):
     
     def close(self):
         self.fd.close()
+        self.ctx.index_cache.invalidate(self.name)
+
+
+
+class TapQueue(_FrameIO):
+    """
+    One queue of a MultiQueueTap, with its own file descriptor. Frames
+    the kernel sends to the device are spread across the attached queues by
+    flow, so each queue can be serviced independently. This object can be
+    used as an argument to select().
+    """
+
+    def __init__(self, tap, index, fileno, fd):
+        self.tap = tap
+        self.index = index
+        self._fileno = fileno
+        self.fd = fd
+        self.blocking = tap.blocking
+        self.vnet_hdr = tap.vnet_hdr
+        self.attached = True
+
+    def __repr__(self):
+        return "<%s %s#%d at 0x%x>" % (self.__class__.__name__, self.tap.name,
+                                       self.index, id(self))
+
+    def _device(self):
+        return self.tap
+
+    def fileno(self):
+        return self._fileno
+
+    def read(self, n):
+        return os.read(self._fileno, n)
+
+    def write(self, data):
+        return os.write(self._fileno, data)
+
+    def attach(self):
+        ''' Put a detached queue back in service. '''
+        ifreq.ioctl(self.fd, TUNSETQUEUE, TUNSETIFF_REQ, b"", IFF_ATTACH_QUEUE)
+        self.attached = True
+
+    def detach(self):
+        ''' Take the queue out of service without closing it: the kernel
+            stops sending it frames, and it can't write until reattached. '''
+        ifreq.ioctl(self.fd, TUNSETQUEUE, TUNSETIFF_REQ, b"", IFF_DETACH_QUEUE)
+        self.attached = False
+
+    def close(self):
+        self.fd.close()
+
+
+class MultiQueueTap(ifconfig.Interface):
+    """
+    A tap device with several queues (IFF_MULTI_QUEUE), each a TapQueue
+    with its own file descriptor, so packet I/O can be spread across
+    threads or processes.
+    """
+
+    def __init__(self, name=None, queues=2, blocking=True, ctx=None,
+                 vnet_hdr=False):
+        '''If name is None, the kernel will allocate a device name of the
+        form tap#. If the device exists (e.g. it is persistent), the queues
+        are added to it. vnet_hdr is as for Tap.'''
+        if not 1 <= queues <= MAX_QUEUES:
+            raise ValueError("queues must be between 1 and %d" % MAX_QUEUES)
+        self.blocking = blocking
+        self.vnet_hdr = vnet_hdr
+        self.offload = 0
+        self.filter = None
+        self.queues = []
+        ifconfig.Interface.__init__(self, name, ctx)
+        try:
+            for _i in range(queues):
+                self.add_queue()
+        except:
+            self.close()
+            raise
+
+    def add_queue(self):
+        ''' Open another queue and return its TapQueue. '''
+        flags = IFF_TAP | IFF_NO_PI | IFF_MULTI_QUEUE
+        if self.vnet_hdr:
+            flags |= IFF_VNET_HDR
+        fileno, fd, self.name = _open_tun(self.name, flags, self.blocking,
+                                          self._ctx)
+        queue = TapQueue(self, len(self.queues), fileno, fd)
+        self.queues.append(queue)
+        return queue
+
+    def persist(self):
+        fcntl.ioctl(self.queues[0].fd, TUNSETPERSIST, 1)
+
+    def set_offload(self, flags):
+        ''' Set offloads for every queue; see Tap.set_offload(). '''
+        _set_offload(self, self.queues[0].fd, flags)
+
+    def attach_filter(self, program):
+        ''' Filter the frames of every queue; see Tap.attach_filter(). '''
+        _attach_filter(self, self.queues[0].fd, program)
+
+    def detach_filter(self):
+        _detach_filter(self, self.queues[0].fd)
+
+    def set_steering_program(self, prog_fd):
+        ''' Choose each frame's queue with an eBPF socket filter program
+            (e.g. bpf.load_program(bpf.vlan_steering_program())) instead of
+            by flow hash: the queue is its return value modulo the number of
+            queues. The device keeps its own reference, so prog_fd may be
+            closed afterwards. None restores flow hashing. '''
+        if prog_fd is None:
+            prog_fd = -1
+        fcntl.ioctl(self.queues[0].fd, TUNSETSTEERINGEBPF,
+                    struct.pack('i', prog_fd))
+
+    def unpersist(self):
+        fcntl.ioctl(self.queues[0].fd, TUNSETPERSIST, 0)
+        self.ctx.index_cache.invalidate(self.name)
+
+    def close(self):
+        ''' Close every queue. The device goes away with the last one
+            unless it is persistent. '''
+        queues, self.queues = self.queues, []
+        for queue in queues:
+            queue.close()
+        if self.name:
+            self.ctx.index_cache.invalidate(self.name)
+
+
+def _serve_queue(queue, handler, bufsize, stop_fd):
+    poller = select.poll()
+    poller.register(queue.fileno(), select.POLLIN)
+    poller.register(stop_fd, select.POLLIN)
+    while True:
+        if any(fd == stop_fd for fd, _event in poller.poll()):
+            return
+        try:
+            frame = queue.read(bufsize)
+        except EnvironmentError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                continue
+            raise
+        handler(queue, frame)
+
+
+class QueueWorkers(object):
+    """
+    Services every queue of a MultiQueueTap on its own thread, or with
+    processes=True on its own forked process, calling handler(queue, frame)
+    for each frame read. Replies can be written with queue.write().
+
+    Threads share the GIL, so only the reads and writes run in parallel;
+    use processes for handlers that need CPU. Processes get a copy of the
+    handler and of everything it refers to.
+    """
+
+    def __init__(self, tap, handler, processes=False, bufsize=65536):
+        self.tap = tap
+        self.handler = handler
+        self.processes = processes
+        self.bufsize = bufsize
+        self.workers = []
+        self._stop_r = self._stop_w = None
+
+    def start(self):
+        ''' Start one worker per queue. '''
+        if self.workers:
+            raise RuntimeError("workers already started")
+        # Workers return once every copy of the write end is closed
+        stop_r, self._stop_w = os.pipe()
+        for queue in self.tap.queues:
+            if self.processes:
+                if util.PY3:
+                    factory = multiprocessing.get_context('fork').Process
+                else:
+                    factory = multiprocessing.Process
+                worker = factory(target=self._run_process,
+                                 args=(queue, stop_r))
+            else:
+                worker = threading.Thread(
+                    target=_serve_queue,
+                    args=(queue, self.handler, self.bufsize, stop_r))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        if self.processes:
+            os.close(stop_r)
+        else:
+            self._stop_r = stop_r
+        return self
+
+    def _run_process(self, queue, stop_r):
+        os.close(self._stop_w)
+        _serve_queue(queue, self.handler, self.bufsize, stop_r)
+
+    def stop(self, timeout=None):
+        ''' Stop the workers and wait up to timeout seconds for each. Any
+            still running (e.g. in a slow handler) stay in workers, and
+            calling stop() again waits for them. '''
+        if self._stop_w is not None:
+            os.close(self._stop_w)
+            self._stop_w = None
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = [w for w in self.workers if w.is_alive()]
+        if not self.workers and self._stop_r is not None:
+            # Only once no thread can still be polling it
+            os.close(self._stop_r)
+            self._stop_r = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if util.PY3:
+    _clock = time.monotonic
+else:
+    _clock = time.time
+
+# Counters and allocation latency of a TapPool. Latencies are in seconds,
+# over the last `history` acquire() calls; hit_rate and the latencies are
+# None before the first.
+PoolStats = collections.namedtuple('PoolStats', [
+    'available', 'in_use', 'hits', 'misses', 'created', 'reclaimed',
+    'destroyed', 'errors', 'hit_rate', 'latency_p50', 'latency_p99',
+    'latency_max'])
+
+
+class TapPool(object):
+    """
+    Persistent taps made ahead of time, so that handing one to a VM or
+    container being started costs no device creation.
+
+    Every tap is created from template (the kernel replaces %d with the
+    lowest free number), given owner and group (TUNSETOWNER/TUNSETGROUP)
+    so an unprivileged process can open it, its MTU, optionally added to
+    bridge and brought up, made persistent and closed. acquire() hands out
+    a prepared tap in O(1) and only creates one on the spot (a miss) if the
+    pool is empty. Whenever the pool falls to low, a background thread tops
+    it back up to size. release() returns a tap to the pool, reset to the
+    same settings, or deletes it if the pool is full.
+    """
+
+    def __init__(self, size=8, low=None, template=b"ptap%d", owner=None,
+                 group=None, bridge=None, mtu=None, up=False, ctx=None,
+                 background=True, history=1024):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self.low = size // 2 if low is None else low
+        self.template = template
+        self.owner = owner
+        self.group = group
+        if bridge is not None and not isinstance(bridge, brctl.Bridge):
+            bridge = brctl.Bridge(bridge, ctx)
+        self.bridge = bridge
+        self.mtu = mtu
+        self.up = up
+        self.ctx = ctx
+
+        self._lock = threading.Lock()
+        self._free = collections.deque()
+        # Slots reserved for taps being created or reset for the pool
+        self._pending = 0
+        self._in_use = set()
+        self._latency = collections.deque(maxlen=history)
+        self._counts = dict.fromkeys(('hits', 'misses', 'created', 'reclaimed',
+                                      'destroyed', 'errors'), 0)
+        self.last_error = None
+        self._closed = False
+        self._wake = threading.Event()
+
+        self.replenish()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._replenish_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._free)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counts[key] += n
+
+    def _sockfd(self):
+        return (self.ctx or context.get_context()).sockfd
+
+    def _prepare(self, name):
+        ''' Apply the pool's MTU, bridge and up settings, with ioctls so the
+            replenishing thread can share ctx. '''
+        iface = ifconfig.Interface(name, self.ctx)
+        if self.mtu is not None:
+            ifreq.ioctl(self._sockfd(), SIOCSIFMTU, ifreq.INT, name, self.mtu)
+        if self.bridge is not None:
+            try:
+                self.bridge.addif(name)
+            except EnvironmentError as e:
+                # Already a port (of this or another bridge)
+                if e.errno != errno.EBUSY:
+                    raise
+        if self.up:
+            iface.up()
+        else:
+            iface.down()
+
+    def _create(self):
+        t = Tap(self.template, ctx=self.ctx)
+        try:
+            if self.owner is not None:
+                fcntl.ioctl(t.fd, TUNSETOWNER, self.owner)
+            if self.group is not None:
+                fcntl.ioctl(t.fd, TUNSETGROUP, self.group)
+            self._prepare(t.name)
+            t.persist()
+        finally:
+            t.close()
+        self._count('created')
+        return t.name
+
+    def _destroy(self, name):
+        t = Tap(name, ctx=self.ctx)
+        t.unpersist()
+        t.close()
+        self._count('destroyed')
+
+    def _reserve(self):
+        ''' Reserve a slot in the pool, if it has room. Call with the lock
+            held. '''
+        if self._closed or len(self._free) + self._pending >= self.size:
+            return False
+        self._pending += 1
+        return True
+
+    def _put(self, name):
+        ''' Fill a reserved slot with name, or, if the pool was closed in
+            the meantime, delete the tap. Returns whether it was kept. '''
+        with self._lock:
+            self._pending -= 1
+            if not self._closed:
+                self._free.append(name)
+                return True
+        self._destroy(name)
+        return False
+
+    def _unreserve(self):
+        with self._lock:
+            self._pending -= 1
+
+    def replenish(self):
+        ''' Create taps until the pool holds size. Returns the number
+            created. A failure is counted in errors and kept in last_error
+            rather than raised. '''
+        created = 0
+        while True:
+            with self._lock:
+                if not self._reserve():
+                    break
+            try:
+                try:
+                    name = self._create()
+                except EnvironmentError:
+                    self._unreserve()
+                    raise
+                if not self._put(name):
+                    break
+            except EnvironmentError as e:
+                self._count('errors')
+                self.last_error = e
+                break
+            created += 1
+        return created
+
+    def _replenish_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            self.replenish()
+
+    def acquire(self):
+        ''' Return an ifconfig.Interface for a prepared tap, which stays
+            persistent until released. '''
+        start = _clock()
+        with self._lock:
+            if self._closed:
+                raise ValueError("pool is closed")
+            name = self._free.popleft() if self._free else None
+            self._counts['hits' if name is not None else 'misses'] += 1
+            if len(self._free) <= self.low:
+                self._wake.set()
+        if name is None:
+            name = self._create()
+        with self._lock:
+            self._in_use.add(name)
+            self._latency.append(_clock() - start)
+        return ifconfig.Interface(name, self.ctx)
+
+    def release(self, iface):
+        ''' Take back a tap from acquire() once nothing has it open. It is
+            reset and reused if the pool has room, otherwise deleted. '''
+        name = iface.name if isinstance(iface, ifconfig.Interface) else iface
+        with self._lock:
+            self._in_use.discard(name)
+            keep = self._reserve()
+        try:
+            if keep:
+                try:
+                    self._prepare(name)
+                except EnvironmentError:
+                    self._unreserve()
+                    raise
+                if self._put(name):
+                    self._count('reclaimed')
+            else:
+                self._destroy(name)
+        except EnvironmentError as e:
+            # e.g. the tap was deleted, or is still open
+            self._count('errors')
+            self.last_error = e
+
+    def stats(self):
+        ''' Return a PoolStats. '''
+        with self._lock:
+            counts = dict(self._counts)
+            latency = sorted(self._latency)
+            available, in_use = len(self._free), len(self._in_use)
+        served = counts['hits'] + counts['misses']
+
+        def percentile(pct):
+            if not latency:
+                return None
+            return latency[int(round(pct / 100.0 * (len(latency) - 1)))]
+
+        return PoolStats(available=available, in_use=in_use,
+                         hit_rate=(float(counts['hits']) / served
+                                   if served else None),
+                         latency_p50=percentile(50),
+                         latency_p99=percentile(99),
+                         latency_max=latency[-1] if latency else None,
+                         **counts)
+
+    def close(self):
+        ''' Stop replenishing and delete the taps in the pool. Taps that
+            are handed out are left alone. '''
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        while self._free:
+            name = self._free.popleft()
+            try:
+                self._destroy(name)
+            except EnvironmentError as e:
+                self._count('errors')
+                self.last_error = e
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *exc_info):
+        self.close()
@@ -7,3 +7,10 @@ if PY3:
     binary_type = bytes
 else:
     binary_type = str
+
+
+def array_tobytes(arr):
+    ''' array.tostring() was renamed to tobytes() and later removed. '''
+    if PY3:
+        return arr.tobytes()
+    return arr.tostring()
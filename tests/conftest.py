@@ -32,6 +32,27 @@ def if2(request):
     return interface(request, b'eth2')
 
 
+@pytest.fixture
+def veth(request):
+    subprocess.check_call(b'ip link add veth_test0 type veth peer name veth_test1',
+                          shell=True)
+    def cleanup():
+        subprocess.call(b'ip link del veth_test0', shell=True)
+        subprocess.call(b'ip link del veth_test2', shell=True)
+    request.addfinalizer(cleanup)
+    return ifconfig.Interface(b'veth_test0')
+
+
+@pytest.fixture
+def mq_veth(request):
+    subprocess.check_call(b'ip link add veth_test0 numtxqueues 4 numrxqueues 4 '
+                          b'type veth peer name veth_test1 numtxqueues 4 '
+                          b'numrxqueues 4', shell=True)
+    request.addfinalizer(lambda: subprocess.call(b'ip link del veth_test0',
+                                                 shell=True))
+    return ifconfig.Interface(b'veth_test0')
+
+
 def check_output(shell_cmd, regex=[], substr=[], not_regex=[], not_substr=[],
                  debug=False):
     assert regex or substr or not_regex or not_substr
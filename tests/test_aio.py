@@ -0,0 +1,219 @@
+import pytest
+
+from pynetlinux import util
+
+if util.PY2:
+    pytest.skip("asyncio requires Python 3", allow_module_level=True)
+
+import asyncio
+import errno
+import socket
+
+from pynetlinux import aio
+from pynetlinux import ifconfig
+from pynetlinux import netlink
+from pynetlinux import route
+from tests.conftest import check_output
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_getters(if1):
+    i = aio.Interface(if1.name)
+    assert run(i.is_up()) == if1.is_up()
+    assert run(i.get_mac()) == if1.mac
+    assert run(i.get_ip()) == if1.ip
+    assert run(i.get_netmask()) == if1.netmask
+    assert run(i.get_index()) == if1.index
+
+
+def test_up_down(veth):
+    i = aio.Interface(veth.name)
+    run(i.up())
+    assert veth.is_up()
+    run(i.down())
+    assert not veth.is_up()
+
+
+def test_set_mac(veth):
+    run(aio.Interface(veth.name).set_mac('00:11:22:33:44:55'))
+    assert veth.mac == '00:11:22:33:44:55'
+
+
+def test_set_ip_netmask(veth):
+    i = aio.Interface(veth.name)
+    run(i.set_ip('10.99.2.1', 24))
+    assert veth.ip == '10.99.2.1'
+    assert veth.netmask == 24
+    run(i.set_netmask(16))
+    check_output(b'ip addr show ' + veth.name, substr=[b'inet 10.99.2.1/16'])
+
+
+def test_nonexistent():
+    with pytest.raises(EnvironmentError):
+        run(aio.Interface(b'foobar').is_up())
+
+
+def test_bridge(veth):
+    async def scenario():
+        br = await aio.addbr(b'br_test1')
+        try:
+            await br.addif(veth.name)
+            added = await br.iterifs()
+            await br.delif(veth.name)
+            return added, await br.iterifs()
+        finally:
+            await br.delete()
+    added, removed = run(scenario())
+    assert added == [veth.name]
+    assert removed == []
+    assert ifconfig.findif(b'br_test1', physical=False) is None
+
+
+def test_route():
+    assert run(aio.get_default_gw()) == route.get_default_gw()
+    assert run(aio.get_default_if()) == route.get_default_if()
+
+
+def test_stats(if1):
+    stats = run(aio.get_all_stats64())
+    assert set(stats[if1.name]) == set(ifconfig.STATS_TITLES)
+    assert set(run(aio.Interface(if1.name).get_stats())) == set(ifconfig.STATS_TITLES)
+
+
+def test_pipelining():
+    names = [l.name for l in netlink.get_links()] * 100
+    expected = [ifconfig.Interface(n).is_up() for n in names]
+    async def scenario():
+        conn = aio.get_connection()
+        results = await asyncio.gather(*[aio.Interface(n, conn).is_up()
+                                         for n in names])
+        conn.close()
+        return results
+    assert run(scenario()) == expected
+
+
+def test_concurrent_dumps(veth):
+    run(aio.Interface(veth.name).set_ip('10.99.3.1', 24))
+    async def scenario():
+        conn = aio.get_connection()
+        results = await asyncio.gather(
+            *([conn.get_addresses() for _i in range(20)] +
+              [conn.get_links() for _i in range(5)] +
+              [aio.Interface(veth.name, conn).get_ip() for _i in range(20)] +
+              [aio.Interface(veth.name, conn).is_up() for _i in range(20)]))
+        conn.close()
+        return results
+    results = run(scenario())
+    addresses = results[:20]
+    assert all(a == addresses[0] for a in addresses)
+    assert any(a.address == '10.99.3.1' for a in addresses[0])
+    assert all(len(links) == len(results[20]) for links in results[20:25])
+    assert results[25:45] == ['10.99.3.1'] * 20
+
+
+def test_set_ip_failure_restores(veth):
+    i = aio.Interface(veth.name)
+    run(i.set_ip('10.99.4.1', 24))
+    with pytest.raises(EnvironmentError):
+        run(i.set_ip('10.99.4.2', 33))
+    assert veth.ip == '10.99.4.1'
+    assert veth.netmask == 24
+
+
+def _send_frames(name, count):
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+    s.bind((name.decode('ascii'), 0))
+    sent = [b'\xde\xad\xbe\xef\xde\xad\x00\x11"3DU\x88\xb5frame %d' % i
+            for i in range(count)]
+    for frame in sent:
+        s.send(frame)
+    s.close()
+    return sent
+
+
+def test_tap_stream():
+    async def main():
+        stream = await aio.open_tap_stream()
+        name = stream.transport.get_extra_info('name')
+        t = stream.transport.get_extra_info('tap')
+        t.up()
+        sent = _send_frames(name, 8)
+        received = []
+        async for frame in stream:
+            if frame in sent:
+                received.append(frame)
+                if len(received) == len(sent):
+                    break
+        assert received == sent
+
+        pre_stats = t.get_stats()
+        stream.write(b'\xff' * 6 + b'\x00\x11"3DU\x88\xb5reply')
+        await stream.drain()
+        assert t.get_stats()['rx_packets'] == pre_stats['rx_packets'] + 1
+
+        stream.close()
+        assert await stream.read() is None
+        return name
+
+    name = run(main())
+    assert ifconfig.findif(name, physical=False) is None
+
+
+def test_tap_stream_backpressure():
+    async def main():
+        stream = await aio.open_tap_stream(max_queued=4)
+        name = stream.transport.get_extra_info('name')
+        stream.transport.get_extra_info('tap').up()
+        # Let the tap's own traffic go by
+        try:
+            while True:
+                await asyncio.wait_for(stream.read(), 0.1)
+        except asyncio.TimeoutError:
+            pass
+        sent = _send_frames(name, 10)
+        await asyncio.sleep(0.05)
+        assert not stream.transport.is_reading()
+        received = []
+        while len(received) < len(sent):
+            frame = await asyncio.wait_for(stream.read(), 3)
+            if frame in sent:
+                received.append(frame)
+        assert received == sent
+        assert stream.transport.is_reading()
+        stream.close()
+
+    run(main())
+
+
+def test_tap_protocol():
+    class Protocol(aio.TapProtocol):
+        def __init__(self):
+            self.errors = []
+            self.lost = []
+
+        def error_received(self, exc):
+            self.errors.append(exc)
+
+        def connection_lost(self, exc):
+            self.lost.append(exc)
+
+    async def main():
+        transport, protocol = await aio.create_tap_endpoint(Protocol)
+        # A tap that is down refuses frames
+        transport.write(b'\xff' * 6 + b'\x00\x11"3DU\x88\xb5frame')
+        assert [e.errno for e in protocol.errors] == [errno.EIO]
+        assert not transport.is_closing()
+        assert transport.get_write_buffer_size() == 0
+        transport.close()
+        assert transport.is_closing()
+        await asyncio.sleep(0)
+        assert protocol.lost == [None]
+
+    run(main())
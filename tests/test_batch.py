@@ -0,0 +1,112 @@
+import errno
+
+import pytest
+
+from pynetlinux import batch
+from pynetlinux import brctl
+from pynetlinux import ifconfig
+from pynetlinux import netlink
+from tests.conftest import check_output
+
+
+def test_commit(veth):
+    peer = ifconfig.Interface(b'veth_test1')
+    b = batch.Batch()
+    b.set_mtu(veth, 1400).set_mac(b'veth_test1', '00:11:22:33:44:77')
+    b.up(veth).up(peer)
+    b.add_address(veth, '10.88.0.1', 24)
+    b.add_address(b'veth_test0', 'fd00:88::1', 64)
+    assert len(b) == 6
+    results = b.commit()
+    assert len(b) == 0
+    assert [r.op for r in results] == ['set_mtu', 'set_mac', 'up', 'up',
+                                       'add_address', 'add_address']
+    assert all(r.error is None for r in results)
+
+    assert veth.is_up() and peer.is_up()
+    assert peer.mac == '00:11:22:33:44:77'
+    check_output(b'ip addr show veth_test0',
+                 substr=[b'mtu 1400', b'10.88.0.1/24', b'fd00:88::1/64'])
+
+    results = batch.Batch().del_address(veth, '10.88.0.1', 24).down(veth).commit()
+    assert all(r.error is None for r in results)
+    assert not veth.is_up()
+    check_output(b'ip addr show veth_test0', not_substr=[b'10.88.0.1'])
+
+
+def test_errors(veth):
+    b = batch.Batch()
+    b.up(b'no_such_if0')
+    b.add_address(b'no_such_if0', '10.88.0.1', 24)
+    b.add_address(veth, '10.88.0.1', 24)
+    b.add_address(veth, '10.88.0.1', 24)
+    b.add_address(veth, '10.88.0.1', 24, replace=True)
+    b.up(veth)
+    results = b.commit()
+    assert [r.name for r in results] == [b'no_such_if0', b'no_such_if0'] + \
+        [b'veth_test0'] * 4
+    assert results[0].error.errno == errno.ENODEV
+    assert results[1].error.errno == errno.ENODEV
+    assert results[2].error is None
+    assert results[3].error.errno == errno.EEXIST
+    assert results[4].error is None
+    assert results[5].error is None
+    assert veth.is_up()
+
+
+def test_many(veth, monkeypatch):
+    # Force one datagram per few messages
+    monkeypatch.setattr(batch, 'MAX_DATAGRAM', 256)
+    b = batch.Batch()
+    for i in range(50):
+        b.add_address(veth, '10.88.%d.1' % i, 24)
+    results = b.commit()
+    assert all(r.error is None for r in results)
+    addrs = [a.address for a in netlink.get_addresses()
+             if a.index == veth.index]
+    assert set('10.88.%d.1' % i for i in range(50)) <= set(addrs)
+
+
+def test_set_master(veth):
+    br = brctl.addbr(b'br_test1')
+    try:
+        results = batch.Batch().set_master(veth, br).commit()
+        assert results[0].error is None
+        assert br.listif() == [b'veth_test0']
+        results = batch.Batch().set_master(veth, None).commit()
+        assert results[0].error is None
+        assert br.listif() == []
+    finally:
+        br.delete()
+
+
+def test_link_profile(veth):
+    profile = batch.LinkProfile(mtu=4000, txqlen=500, gso_max_segs=None)
+    assert profile.settings == {'mtu': 4000, 'txqlen': 500}
+    ifaces = [veth, b'veth_test1', b'no_such_if0']
+    assert profile.plan(ifaces) == {
+        b'veth_test0': {'mtu': 4000, 'txqlen': 500},
+        b'veth_test1': {'mtu': 4000, 'txqlen': 500},
+        b'no_such_if0': None,
+    }
+    results = dict((r.name, r) for r in profile.apply(ifaces))
+    assert results[b'veth_test0'].error is None
+    assert results[b'veth_test1'].error is None
+    assert results[b'no_such_if0'].error.errno == errno.ENODEV
+    check_output(b'ip link show veth_test1', substr=[b'mtu 4000', b'qlen 500'])
+
+    # Only what differs is sent; nothing when the profile is in effect
+    veth.txqlen = 1000
+    assert profile.plan([veth]) == {b'veth_test0': {'txqlen': 500}}
+    assert [r.name for r in profile.apply(ifaces[:2])] == [b'veth_test0']
+    assert profile.apply(ifaces[:2]) == []
+
+    # Interfaces must be named; nothing else, e.g. lo, is touched
+    with pytest.raises(TypeError):
+        profile.apply()
+    assert profile.plan([]) == {}
+    assert profile.apply([]) == []
+    check_output(b'ip link show lo', not_substr=[b'mtu 4000'])
+
+    with pytest.raises(ValueError):
+        batch.LinkProfile(mtu=1500, qlen=10)
@@ -0,0 +1,36 @@
+import pytest
+import os
+
+from pynetlinux import bpf
+
+
+def test_assemble():
+    program = bpf.assemble([
+        bpf.stmt(bpf.BPF_LD | bpf.BPF_H | bpf.BPF_ABS, 12),
+        bpf.jump(bpf.BPF_JMP | bpf.BPF_JEQ | bpf.BPF_K, 0x0800, 'ok', 0),
+        bpf.goto('reject'),
+        'ok',
+        bpf.stmt(bpf.BPF_RET | bpf.BPF_K, 0xffff),
+        'reject',
+        bpf.stmt(bpf.BPF_RET | bpf.BPF_K, 0),
+    ])
+    assert program == [(0x28, 0, 0, 12), (0x15, 1, 0, 0x800), (0x05, 0, 0, 1),
+                       (0x06, 0, 0, 0xffff), (0x06, 0, 0, 0)]
+    fprog, buf = bpf.pack(program)
+    assert len(buf) == 8 * len(program)
+    assert bpf.SOCK_FPROG.unpack(fprog) == (len(program), buf.buffer_info()[0])
+
+    with pytest.raises(ValueError):
+        bpf.assemble([bpf.jump(bpf.BPF_JMP | bpf.BPF_JEQ | bpf.BPF_K, 0,
+                               'far', 0)] +
+                     [bpf.stmt(bpf.BPF_RET | bpf.BPF_K, 0)] * 300 + ['far'])
+
+
+def test_load_program():
+    fd = bpf.load_program(bpf.vlan_steering_program())
+    assert fd >= 0
+    os.close(fd)
+
+    # The verifier refuses a program that exits without setting R0
+    with pytest.raises(OSError):
+        bpf.load_program(bpf.ebpf_insn(bpf.BPF_JMP | bpf.BPF_EXIT))
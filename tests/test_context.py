@@ -0,0 +1,103 @@
+import os
+import threading
+
+from pynetlinux import brctl
+from pynetlinux import context
+from pynetlinux import ifconfig
+from pynetlinux import netlink
+
+
+def test_per_thread_default():
+    contexts = []
+    def worker():
+        contexts.append(context.get_context())
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(id(c) for c in contexts)) == 4
+    assert context.get_context() not in contexts
+
+
+def test_shutdown_is_per_thread(if1):
+    results = []
+    def worker():
+        ifconfig.shutdown()
+        results.append(if1.is_up())
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    # The worker recreated its own context; ours is untouched
+    assert results == [True]
+    assert if1.is_up()
+
+
+def test_bound_interface(if1):
+    ctx = context.Context()
+    try:
+        i = ifconfig.Interface(if1.name, ctx)
+        assert i.ctx is ctx
+        assert i.index == if1.index
+        assert i.mac == if1.mac
+        assert [l.name for l in ifconfig.list_ifs(ctx=ctx)] == \
+            [l.name for l in ifconfig.list_ifs()]
+        assert all(l.ctx is ctx for l in ifconfig.list_ifs(ctx=ctx))
+    finally:
+        ctx.close()
+
+
+def test_bound_bridge():
+    ctx = context.Context()
+    try:
+        br = brctl.addbr(b'br_test1', ctx)
+        try:
+            assert br.ctx is ctx
+            assert brctl.findbridge(b'br_test1', ctx).ctx is ctx
+        finally:
+            br.delete()
+    finally:
+        ctx.close()
+
+
+def test_using():
+    ctx = context.Context()
+    try:
+        default = context.get_context()
+        with context.using(ctx):
+            assert context.get_context() is ctx
+            assert netlink.get_socket() is ctx.netlink
+            assert ifconfig.Interface(b'lo').ctx is ctx
+        assert context.get_context() is default
+    finally:
+        ctx.close()
+
+
+def test_pool():
+    pool = context.ContextPool(size=1)
+    with pool.context() as c1:
+        assert context.get_context() is c1
+        with pool.context() as c2:
+            assert c2 is not c1
+    # Only one is kept around
+    assert pool.acquire() in (c1, c2)
+    assert pool.acquire() not in (c1, c2)
+    pool.close()
+
+
+def test_fork():
+    parent = context.get_context()
+    parent.netlink
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child = context.get_context()
+            ok = child is not parent and netlink.get_link(b'lo') is not None
+            os.write(w, b'1' if ok else b'0')
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(r, 1) == b'1'
+    os.close(r)
+    os.close(w)
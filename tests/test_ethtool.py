@@ -0,0 +1,127 @@
+import errno
+
+import pytest
+
+from pynetlinux import context
+from pynetlinux import ethtool
+from pynetlinux import ifconfig
+
+
+def test_get_link_settings(veth):
+    settings = ethtool.get_link_settings(veth.name)
+    assert settings.speed == 10000
+    assert settings.duplex is True
+    assert settings.link is False
+    assert veth.get_link_settings() == settings
+
+    veth.up()
+    ifconfig.Interface(b'veth_test1').up()
+    assert ethtool.get_link_settings(veth.name).link is True
+    assert veth.get_link_info() == (10000, True, settings.autoneg, True)
+
+
+def test_get_link_settings_unsupported():
+    with pytest.raises(IOError) as e:
+        ethtool.get_link_settings(b'lo')
+    assert e.value.errno == errno.EOPNOTSUPP
+
+
+def test_scan_links(veth):
+    veth.up()
+    ifconfig.Interface(b'veth_test1').up()
+    links = ethtool.scan_links()
+    assert b'lo' not in links
+    assert links[b'veth_test0'] == ethtool.get_link_settings(b'veth_test0')
+    assert links[b'veth_test1'].link is True
+
+
+def test_scan_links_ioctl(veth):
+    # The fallback used without ethtool netlink gives the same answers
+    ctx = context.get_context()
+    assert ethtool._scan_ioctl(ctx) == ethtool.scan_links(ctx)
+
+
+def test_get_drvinfo(veth):
+    info = ethtool.get_drvinfo(veth.name)
+    assert info.driver == b'veth'
+    assert info.n_stats > 0
+
+
+def test_stats_reader(veth):
+    peer = ifconfig.Interface(b'veth_test1')
+    reader = ethtool.StatsReader(veth.name)
+    values = reader.read()
+    assert len(values) == len(reader.table) == ethtool.get_drvinfo(veth.name).n_stats
+    assert reader.get('peer_ifindex') == peer.index
+    assert values[reader.table.index['peer_ifindex']] == peer.index
+    assert reader.as_dict() == veth.get_driver_stats()
+    assert reader.read() is values
+
+    # Same driver, same table
+    assert ethtool.StatsReader(peer.name).table is reader.table
+    assert ethtool.get_string_table(peer.name, ethtool.ETH_SS_STATS) is reader.table
+
+
+def test_stats_unsupported():
+    with pytest.raises(IOError) as e:
+        ethtool.StatsReader(b'lo')
+    assert e.value.errno == errno.EOPNOTSUPP
+
+
+def test_channels(mq_veth):
+    channels = mq_veth.get_channels()
+    assert channels.max_rx == channels.max_tx == 4
+    assert mq_veth.set_channels(rx_count=2, tx_count=2) is True
+    assert mq_veth.get_channels().rx_count == 2
+    assert mq_veth.get_channels().tx_count == 2
+    assert ethtool.StatsReader(mq_veth.name).table.index['rx_queue_1_drops']
+    # Already in effect: nothing is written
+    assert mq_veth.set_channels(rx_count=2) is False
+    with pytest.raises(ValueError):
+        mq_veth.set_channels(foo=1)
+
+
+def test_ringparam_unsupported(veth):
+    with pytest.raises(IOError) as e:
+        veth.get_ringparam()
+    assert e.value.errno == errno.EOPNOTSUPP
+    with pytest.raises(IOError):
+        veth.get_coalesce()
+
+
+def test_apply(mq_veth):
+    peer_rx = ethtool.get_channels(b'veth_test1').rx_count
+    results = ethtool.apply({
+        b'veth_test0': {'channels': {'rx_count': 3}, 'ring': {'rx_pending': 64}},
+        b'veth_test1': {'channels': {'rx_count': peer_rx}},
+    })
+    results = dict(((r.name, r.op), r) for r in results)
+    assert len(results) == 3
+    assert results[b'veth_test0', 'channels'].changed is True
+    assert results[b'veth_test0', 'channels'].error is None
+    assert results[b'veth_test0', 'ring'].error.errno == errno.EOPNOTSUPP
+    assert results[b'veth_test1', 'channels'].changed is False
+    assert mq_veth.get_channels().rx_count == 3
+
+    with pytest.raises(ValueError):
+        ethtool.apply({b'veth_test0': {'channels': {'rx_count': 1},
+                                       'rings': {}}})
+    assert mq_veth.get_channels().rx_count == 3
+
+
+def test_features(veth):
+    features = veth.get_features()
+    assert features['rx-gro'].available
+    assert features['tx-checksum-ip-generic'].active
+
+    accepted = veth.set_features({'gro': True,
+                                  'tx-checksum-ip-generic': False})
+    assert accepted == {'rx-gro': True, 'tx-checksum-ip-generic': True}
+    features = veth.get_features()
+    assert features['rx-gro'].active
+    assert not features['tx-checksum-ip-generic'].active
+
+    # veth can't do LRO, so the kernel leaves it off
+    assert veth.set_features({'lro': True}) == {'rx-lro': False}
+    with pytest.raises(ValueError):
+        veth.set_features({'no-such-offload': True})
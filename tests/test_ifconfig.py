@@ -2,8 +2,11 @@
 
 import pytest
 import re
+import socket
+import subprocess
 
 from pynetlinux import ifconfig
+from pynetlinux import netlink
 from tests.conftest import check_output
 
 
@@ -19,6 +22,19 @@ def test_list_ifs_physical_only():
     assert set(i.name for i in ifs) == expected
 
 
+def test_list_ifs_subinterface(if1):
+    label = if1.name + b':7'
+    subprocess.check_call(b'ip addr add 10.99.0.1/24 dev ' + if1.name +
+                          b' label ' + label, shell=True)
+    try:
+        names = set(i.name for i in ifconfig.list_ifs(physical=False))
+        assert label in names
+        assert label not in set(i.name for i in ifconfig.list_ifs())
+    finally:
+        subprocess.check_call(b'ip addr del 10.99.0.1/24 dev ' + if1.name,
+                              shell=True)
+
+
 def test_findif(if1, if2):
     for i in [if1, if2]:
         i2 = ifconfig.findif(i.name)
@@ -121,3 +137,229 @@ def test_pause_param_settings(if1, rx, tx):
     ]
     check_output(b'ethtool -a ' + if1.name, regex=expected)
 
+
+
+def test_get_stats(if1):
+    stats = if1.get_stats()
+    assert set(stats) == set(ifconfig.STATS_TITLES)
+    assert ifconfig.Interface(b'foobar').get_stats() is None
+
+
+def test_get_all_stats(if1, if2):
+    stats = ifconfig.get_all_stats()
+    assert set([b'lo', if1.name, if2.name]) <= set(stats)
+    assert set(stats[if1.name]) == set(ifconfig.STATS_TITLES)
+
+
+def test_get_all_stats64(if1):
+    legacy = ifconfig.get_all_stats()
+    stats = ifconfig.get_all_stats64()
+    assert set(legacy) <= set(stats)
+    assert set(stats[if1.name]) == set(ifconfig.STATS_TITLES)
+    # Counters only go up between the two reads
+    for title in ifconfig.STATS_TITLES:
+        assert stats[if1.name][title] >= legacy[if1.name][title]
+
+
+def test_snapshot(if1):
+    snap = if1.snapshot()
+    assert snap.name == if1.name
+    assert snap.index == if1.index
+    assert snap.mac == if1.mac
+    assert snap.flags & ifconfig.IFF_UP
+    assert if1.ip in [a.address for a in snap.addresses]
+    check_output(b'ip link show ' + if1.name,
+                 substr=[b'mtu ' + str(snap.mtu).encode('ascii'),
+                         b'state ' + snap.operstate.upper().encode('ascii')])
+    assert ifconfig.Interface(b'foobar').snapshot() is None
+
+
+def test_snapshot_all(if1, if2):
+    snaps = dict((s.name, s) for s in ifconfig.snapshot_all())
+    assert set([b'lo', if1.name, if2.name]) <= set(snaps)
+    assert snaps[if1.name] == if1.snapshot()
+
+
+def test_index_cache(if1):
+    cache = ifconfig.IndexCache()
+    try:
+        index = cache.index(if1.name)
+        assert cache.name(index) == if1.name
+        check_output(b'ip link show ' + if1.name,
+                     substr=[str(index).encode('ascii') + b': ' + if1.name])
+    finally:
+        cache.close()
+
+
+def test_index_cache_rename(veth):
+    cache = ifconfig.IndexCache()
+    try:
+        index = cache.index(veth.name)
+        subprocess.check_call(b'ip link set veth_test0 name veth_test2',
+                              shell=True)
+        assert cache.name(index) == b'veth_test2'
+        with pytest.raises(IOError):
+            cache.index(b'veth_test0')
+    finally:
+        cache.close()
+
+
+def test_index_cache_delete(veth):
+    cache = ifconfig.IndexCache()
+    try:
+        cache.index(veth.name)
+        subprocess.check_call(b'ip link del veth_test0', shell=True)
+        with pytest.raises(IOError):
+            cache.index(veth.name)
+    finally:
+        cache.close()
+
+
+def test_index_cache_overflow():
+    cache = ifconfig.IndexCache()
+    try:
+        cache.index(b'lo')
+        # Only the first notification, ovf_test1's creation, fits; the rest
+        # are dropped, but it is still delivered after ENOBUFS.
+        cache._events.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1)
+        subprocess.check_call(b'ip link add ovf_test0 type veth peer name '
+                              b'ovf_test1', shell=True)
+        subprocess.check_call(b'ip link del ovf_test0', shell=True)
+        subprocess.check_call(b'ip link add ovf_test0 type veth peer name '
+                              b'ovf_test1', shell=True)
+        with open('/sys/class/net/ovf_test1/ifindex') as f:
+            index = int(f.read())
+        assert cache.index(b'ovf_test1') == index
+    finally:
+        cache.close()
+        subprocess.call(b'ip link del ovf_test0 2>/dev/null', shell=True)
+
+
+def test_index_cache_invalidate(veth):
+    cache = ifconfig.IndexCache(watch=False)
+    try:
+        index = cache.index(veth.name)
+        generation = cache.generation
+        subprocess.check_call(b'ip link set veth_test0 name veth_test2',
+                              shell=True)
+        # Without notifications the stale entry survives until invalidated
+        assert cache.index(veth.name) == index
+        cache.invalidate(veth.name)
+        assert cache.generation > generation
+        with pytest.raises(IOError):
+            cache.index(veth.name)
+    finally:
+        cache.close()
+
+
+def test_index_cache_alias(veth):
+    cache = ifconfig.IndexCache()
+    try:
+        index = cache.index(veth.name)
+        assert cache.index(b'veth_test0:1') == index
+        assert cache.name(index) == veth.name
+        subprocess.check_call(b'ip link set veth_test0 name veth_test2',
+                              shell=True)
+        assert cache.name(index) == b'veth_test2'
+        with pytest.raises(IOError):
+            cache.index(b'veth_test0:1')
+    finally:
+        cache.close()
+
+
+def test_index_cache_lru(veth):
+    cache = ifconfig.IndexCache(maxsize=2, watch=False)
+    try:
+        lo = cache.index(b'lo')
+        cache.index(b'veth_test0')
+        cache.name(lo)      # lo is now the most recently used
+        cache.index(b'veth_test1')
+        assert list(cache._by_name) == [b'lo', b'veth_test1']
+        assert sorted(cache._by_index.values()) == [b'lo', b'veth_test1']
+    finally:
+        cache.close()
+
+
+def test_get_addresses(veth):
+    subprocess.check_call(b'ip addr add 10.66.0.1/24 dev veth_test0', shell=True)
+    subprocess.check_call(b'ip addr add 10.66.0.2/24 dev veth_test0', shell=True)
+    subprocess.check_call(b'ip addr add fd00:66::1/64 dev veth_test0 nodad',
+                          shell=True)
+    addrs = dict((a.address, a) for a in veth.get_addresses())
+    assert set(addrs) >= set(['10.66.0.1', '10.66.0.2', 'fd00:66::1'])
+    assert addrs['10.66.0.2'].flags & netlink.IFA_F_SECONDARY
+    assert addrs['fd00:66::1'].prefixlen == 64
+    assert addrs['fd00:66::1'].flags & netlink.IFA_F_NODAD
+    assert [a.address for a in veth.get_addresses(socket.AF_INET)] == \
+        ['10.66.0.1', '10.66.0.2']
+
+
+def test_address_table(veth):
+    subprocess.check_call(b'ip addr add 10.66.0.1/24 dev veth_test0', shell=True)
+    table = ifconfig.AddressTable()
+    try:
+        index = veth.index
+        assert table.index_of('10.66.0.1') == index
+        assert table.index_of('10.66.0.9') is None
+        assert [a.address for a in table.addresses(index)] == ['10.66.0.1']
+        assert table.index_of('127.0.0.1') == 1
+
+        # Picked up from notifications, without a dump
+        subprocess.check_call(b'ip addr add fd00:66::1/64 dev veth_test0 nodad',
+                              shell=True)
+        subprocess.check_call(b'ip addr del 10.66.0.1/24 dev veth_test0',
+                              shell=True)
+        assert table.index_of('FD00:66:0::1') == index
+        assert table.index_of('10.66.0.1') is None
+        assert [a.address for a in table.addresses(index)
+                if a.scope == netlink.RT_SCOPE_UNIVERSE] == ['fd00:66::1']
+
+        subprocess.check_call(b'ip link del veth_test0', shell=True)
+        assert table.lookup('fd00:66::1') == []
+        assert table.addresses(index) == []
+    finally:
+        table.close()
+
+
+def test_address_table_overflow(veth):
+    table = ifconfig.AddressTable(socket.AF_INET)
+    try:
+        # Only the first addition fits; the deletions are dropped, but it is
+        # still delivered after ENOBUFS.
+        table._events.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1)
+        for i in range(1, 5):
+            subprocess.check_call(b'ip addr add 10.66.0.%d/24 dev veth_test0'
+                                  % i, shell=True)
+        for i in range(4, 0, -1):
+            subprocess.check_call(b'ip addr del 10.66.0.%d/24 dev veth_test0'
+                                  % i, shell=True)
+        assert table.addresses(veth.index) == []
+    finally:
+        table.close()
+
+
+def test_address_table_unwatched(veth):
+    table = ifconfig.AddressTable(socket.AF_INET, watch=False)
+    try:
+        subprocess.check_call(b'ip addr add 10.66.0.1/24 dev veth_test0',
+                              shell=True)
+        assert table.index_of('10.66.0.1') is None
+        table.refresh()
+        assert table.index_of('10.66.0.1') == veth.index
+        assert all(a.family == socket.AF_INET for a in table.addresses())
+    finally:
+        table.close()
+
+
+def test_link_settings(veth):
+    veth.mtu = 9000
+    assert veth.mtu == 9000
+    veth.set_link(txqlen=500, gso_max_size=32768, gro_max_size=32768)
+    check_output(b'ip -d link show veth_test0',
+                 substr=[b'mtu 9000', b'qlen 500', b'gso_max_size 32768',
+                         b'gro_max_size 32768'])
+    assert veth.txqlen == 500
+    assert veth.gso_max_size == veth.gro_max_size == 32768
+    with pytest.raises(ValueError):
+        veth.set_link(mtu=1500, speed=10)
+    assert veth.mtu == 9000
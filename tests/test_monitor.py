@@ -0,0 +1,109 @@
+import pytest
+import socket
+import subprocess
+
+from pynetlinux import monitor
+
+
+@pytest.fixture
+def mon(request):
+    m = monitor.Monitor(mirror=True)
+    request.addfinalizer(m.close)
+    return m
+
+
+def events_for(mon, name):
+    return [e for e in mon.events(timeout=0.5) if e.name == name]
+
+
+def types(events):
+    return [e.type for e in events]
+
+
+def test_link_new_del(mon):
+    subprocess.check_call(b'ip link add veth_test0 type veth peer name veth_test1',
+                          shell=True)
+    try:
+        assert monitor.LINK_NEW in types(events_for(mon, b'veth_test0'))
+        assert mon.link_by_name(b'veth_test0') is not None
+    finally:
+        subprocess.check_call(b'ip link del veth_test0', shell=True)
+    assert monitor.LINK_DEL in types(events_for(mon, b'veth_test0'))
+    assert mon.link_by_name(b'veth_test0') is None
+
+
+def test_overflow(mon):
+    mon.poll()
+    # Only ovf_test1's first creation fits; it is still delivered after
+    # ENOBUFS, but must not override the re-dump.
+    mon.sock.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1)
+    subprocess.check_call(b'ip link add ovf_test0 type veth peer name ovf_test1',
+                          shell=True)
+    subprocess.check_call(b'ip link del ovf_test0', shell=True)
+    subprocess.check_call(b'ip link add ovf_test0 type veth peer name ovf_test1',
+                          shell=True)
+    try:
+        with open('/sys/class/net/ovf_test1/ifindex') as f:
+            index = int(f.read())
+        mon.poll()
+        assert [link.index for link in mon.links.values()
+                if link.name == b'ovf_test1'] == [index]
+    finally:
+        subprocess.check_call(b'ip link del ovf_test0', shell=True)
+
+
+def test_up_down_carrier(mon, veth):
+    mon.poll()
+    subprocess.check_call(b'ip link set veth_test1 up', shell=True)
+    subprocess.check_call(b'ip link set veth_test0 up', shell=True)
+    events = types(events_for(mon, veth.name))
+    assert monitor.LINK_UP in events
+    assert monitor.CARRIER_UP in events
+
+    subprocess.check_call(b'ip link set veth_test1 down', shell=True)
+    events = types(events_for(mon, veth.name))
+    assert monitor.CARRIER_DOWN in events
+    assert monitor.LINK_DOWN not in events
+
+    subprocess.check_call(b'ip link set veth_test0 down', shell=True)
+    assert monitor.LINK_DOWN in types(events_for(mon, veth.name))
+
+
+def test_rename(mon, veth):
+    mon.poll()
+    subprocess.check_call(b'ip link set veth_test0 name veth_test2', shell=True)
+    events = events_for(mon, b'veth_test2')
+    assert events[0].type == monitor.LINK_RENAME
+    assert events[0].old.name == b'veth_test0'
+    assert mon.link_by_name(b'veth_test0') is None
+
+
+def test_address_mirror(mon, veth):
+    mon.poll()
+    index = mon.link_by_name(veth.name).index
+    subprocess.check_call(b'ip addr add 10.99.1.1/24 dev veth_test0', shell=True)
+    events = events_for(mon, veth.name)
+    assert monitor.ADDR_NEW in types(events)
+    assert '10.99.1.1' in [a.address for a in mon.addresses[index]]
+
+    subprocess.check_call(b'ip addr del 10.99.1.1/24 dev veth_test0', shell=True)
+    assert monitor.ADDR_DEL in types(events_for(mon, veth.name))
+    assert '10.99.1.1' not in [a.address for a in mon.addresses[index]]
+
+
+def test_neighbour(mon, veth):
+    mon.poll()
+    index = mon.link_by_name(veth.name).index
+    subprocess.check_call(b'ip neigh add 10.99.1.2 lladdr 00:11:22:33:44:55 '
+                          b'dev veth_test0 nud permanent', shell=True)
+    events = [e for e in events_for(mon, veth.name)
+              if e.type == monitor.NEIGH_NEW]
+    assert events
+    neigh = events[-1].obj
+    assert neigh.index == index
+    assert neigh.address == '10.99.1.2'
+    assert neigh.lladdr == '00:11:22:33:44:55'
+    assert neigh.state == 0x80     # NUD_PERMANENT
+
+    subprocess.check_call(b'ip neigh del 10.99.1.2 dev veth_test0', shell=True)
+    assert monitor.NEIGH_DEL in types(events_for(mon, veth.name))
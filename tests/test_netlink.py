@@ -0,0 +1,55 @@
+import pytest
+
+from pynetlinux import netlink
+from tests.conftest import check_output
+
+
+def test_get_links():
+    links = netlink.get_links()
+    names = set(l.name for l in links)
+    assert set([b'eth0', b'eth1', b'eth2', b'lo']) <= names
+    for l in links:
+        check_output(b'ip link show ' + l.name,
+                     substr=[str(l.index).encode('ascii') + b': ' + l.name])
+
+
+def test_get_link(if1):
+    link = netlink.get_link(if1.name)
+    assert link.name == if1.name
+    assert link.index == if1.index
+    assert link.mac == if1.mac
+    check_output(b'ip link show ' + if1.name,
+                 substr=[b'mtu ' + str(link.mtu).encode('ascii')])
+
+
+def test_get_link_nonexistent():
+    assert netlink.get_link(b'foobar') is None
+
+
+def test_get_addresses(if1):
+    link = netlink.get_link(if1.name)
+    addrs = [a for a in netlink.get_addresses() if a.index == link.index]
+    assert if1.ip in [a.address for a in addrs]
+
+
+def test_get_addresses_by_index(veth):
+    veth.ip = '10.99.6.1'
+    sock = netlink.NetlinkSocket()
+    try:
+        everything = netlink.get_addresses(sock=sock)
+        addrs = netlink.get_addresses(sock=sock, index=veth.index)
+        assert sock.strict
+        assert addrs == [a for a in everything if a.index == veth.index]
+        assert '10.99.6.1' in [a.address for a in addrs]
+        # Other dumps still work on a strict socket
+        assert veth.name in [l.name for l in netlink.get_links(sock)]
+        assert netlink.get_routes(sock=sock)
+    finally:
+        sock.close()
+
+
+def test_request_error():
+    msg = netlink.IFINFOMSG.pack(0, 0, 0, 0, 0) + netlink.pack_attr(
+        netlink.IFLA_IFNAME, b'foobar\x00')
+    with pytest.raises(netlink.NetlinkError):
+        netlink.get_socket().request(netlink.RTM_GETLINK, msg)
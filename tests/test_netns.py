@@ -0,0 +1,129 @@
+import socket
+import subprocess
+import threading
+
+import pytest
+
+from pynetlinux import brctl
+from pynetlinux import context
+from pynetlinux import ifconfig
+from pynetlinux import monitor
+from pynetlinux import route
+from pynetlinux import tap
+
+NETNS = b'pynl_test'
+
+
+def ns_exec(cmd):
+    subprocess.check_call(b'ip netns exec ' + NETNS + b' ' + cmd, shell=True)
+
+
+@pytest.fixture
+def netns(request):
+    subprocess.check_call(b'ip netns add ' + NETNS, shell=True)
+    def cleanup():
+        context.shutdown()
+        subprocess.call(b'ip netns del ' + NETNS, shell=True)
+    request.addfinalizer(cleanup)
+    return context.netns(NETNS)
+
+
+def test_cached(netns):
+    assert context.netns(NETNS) is netns
+    others = []
+    t = threading.Thread(target=lambda: others.append(context.netns(NETNS)))
+    t.start()
+    t.join()
+    assert others[0] is not netns
+
+
+def test_list_ifs(netns):
+    assert [i.name for i in ifconfig.list_ifs(physical=False, ctx=netns)] == [b'lo']
+    assert all(i.ctx is netns for i in ifconfig.list_ifs(physical=False, ctx=netns))
+
+
+def test_interface(netns):
+    lo = ifconfig.Interface(b'lo', netns)
+    assert lo.index == 1
+    assert not lo.is_up()
+    lo.up()
+    assert lo.is_up()
+    assert ifconfig.Interface(b'lo').is_up()
+    assert lo.get_stats() is not None
+
+    # An unbound Interface reads the counters of the current context
+    s = netns.run(socket.socket, socket.AF_INET, socket.SOCK_DGRAM)
+    for _i in range(5):
+        s.sendto(b'x', ('127.0.0.1', 9))
+    s.close()
+    with context.using(netns):
+        stats = ifconfig.Interface(b'lo').get_stats()
+    assert stats['tx_packets'] == lo.get_stats()['tx_packets'] >= 5
+    with context.using(netns):
+        assert list(ifconfig.get_all_stats()) == [b'lo']
+
+
+def test_set_netns(netns, veth):
+    veth.set_netns(NETNS)
+    assert veth.ctx is netns
+    assert ifconfig.findif(b'veth_test0', physical=False) is None
+    assert veth.index == netns.index_cache.index(b'veth_test0')
+    veth.up()
+    veth.ip = '10.77.0.1'
+    ns_exec(b'ip addr show veth_test0 | grep -q 10.77.0.1')
+
+    veth.set_netns(context.get_context())
+    assert veth.ctx is context.get_context()
+    assert ifconfig.findif(b'veth_test0', physical=False) is not None
+
+
+def test_bridge(netns, veth):
+    veth.set_netns(netns)
+    br = brctl.addbr(b'br_test1', netns)
+    try:
+        br.addif(b'veth_test0')
+        assert br.listif() == [b'veth_test0']
+        assert [b.name for b in brctl.list_bridges(netns)] == [b'br_test1']
+        assert brctl.findbridge(b'br_test1') is None
+        assert brctl.findif(b'veth_test0', netns).name == b'br_test1'
+        assert brctl.findif(b'veth_test0') is None
+    finally:
+        br.delete()
+
+
+def test_tap(netns):
+    t = tap.Tap(ctx=netns)
+    try:
+        assert ifconfig.findif(t.name, physical=False, ctx=netns) is not None
+        assert ifconfig.findif(t.name, physical=False) is None
+    finally:
+        t.close()
+
+
+def test_route(netns, veth):
+    veth.set_netns(netns)
+    ns_exec(b'ip addr add 10.77.0.1/24 dev veth_test0')
+    ns_exec(b'ip link set veth_test0 up')
+    ns_exec(b'ip route add default via 10.77.0.2')
+    assert route.get_default_gw(netns) == '10.77.0.2'
+    assert route.get_default_if(netns) == b'veth_test0'
+    with context.using(netns):
+        assert route.get_default_gw() == '10.77.0.2'
+        assert route.get_default_if() == b'veth_test0'
+
+
+def test_route_none(netns):
+    with context.using(netns):
+        assert route.get_default_gw() is None
+        assert route.get_default_if() is None
+
+
+def test_monitor(netns):
+    m = monitor.Monitor(monitor.LINK_GROUPS, ctx=netns)
+    try:
+        assert [l.name for l in m.links.values()] == [b'lo']
+        ns_exec(b'ip link set lo up')
+        events = list(m.events(timeout=1))
+        assert monitor.LINK_UP in [e.type for e in events]
+    finally:
+        m.close()
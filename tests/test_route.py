@@ -11,4 +11,4 @@ def test_route():
     match = re.search(r'default via ([^ ]+) dev ([^ ]+)', output.decode('ascii'))
     assert match, 'this test requires a default route to be present'
     assert match.group(1) == route.get_default_gw()
-    assert match.group(2) == route.get_default_if()
+    assert match.group(2).encode('ascii') == route.get_default_if()
@@ -0,0 +1,92 @@
+import socket
+
+from pynetlinux import sampler
+
+
+def send_udp(count):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _ in range(count):
+            s.sendto(b'x' * 100, ('127.0.0.1', 9))
+    finally:
+        s.close()
+
+
+def fake_source(sampler_obj, rows):
+    ''' Replace the kernel read with the given list of (name, index, value)
+        rows, where value is used for every counter. '''
+    sampler_obj._read = lambda: [(name, index, [value] * 16)
+                                 for name, index, value in rows]
+
+
+def test_sample_lo():
+    s = sampler.RateSampler(names=[b'lo'])
+    assert s.sample() == []
+    send_udp(10)
+    ports = s.sample()
+    assert [p.name for p in ports] == [b'lo']
+    assert s.rate(b'lo', 'rx_packets') > 0
+    assert s.rate(b'lo', 'tx_bytes') > 0
+
+
+def test_sample_proc_net_dev():
+    s = sampler.RateSampler(names=[b'lo'], use_netlink=False)
+    s.sample()
+    send_udp(10)
+    s.sample()
+    assert s.rate(b'lo', 'rx_packets') > 0
+
+
+def test_stream():
+    s = sampler.RateSampler(names=[b'lo'])
+    ticks = [now for now, port in s.stream(0.01, count=3)]
+    assert len(ticks) == 2
+
+
+def test_wrap32():
+    s = sampler.RateSampler(names=[b'eth9'])
+    fake_source(s, [(b'eth9', 5, sampler.WRAP32 - 10)])
+    s.sample(now=0)
+    fake_source(s, [(b'eth9', 5, 20)])
+    s.sample(now=1)
+    assert s.rate(b'eth9', 'rx_bytes') == 30
+
+
+def test_reset_64bit():
+    s = sampler.RateSampler(names=[b'eth9'])
+    fake_source(s, [(b'eth9', 5, sampler.WRAP32 * 4)])
+    s.sample(now=0)
+    fake_source(s, [(b'eth9', 5, 20)])
+    s.sample(now=1)
+    assert s.rate(b'eth9', 'rx_bytes') == 0
+
+
+def test_recreated():
+    s = sampler.RateSampler(names=[b'eth9'])
+    fake_source(s, [(b'eth9', 5, 1000)])
+    s.sample(now=0)
+    fake_source(s, [(b'eth9', 6, 10)])
+    assert s.sample(now=1) == []
+    fake_source(s, [(b'eth9', 6, 30)])
+    s.sample(now=2)
+    assert s.rate(b'eth9', 'rx_bytes') == 20
+
+
+def test_disappeared():
+    s = sampler.RateSampler(names=[b'eth9'])
+    fake_source(s, [(b'eth9', 5, 1000)])
+    s.sample(now=0)
+    fake_source(s, [])
+    s.sample(now=1)
+    assert b'eth9' not in s.ports
+
+
+def test_percentile():
+    s = sampler.RateSampler(names=[b'eth9'], window=4)
+    for t, value in enumerate([0, 10, 30, 60, 100, 150]):
+        fake_source(s, [(b'eth9', 5, value)])
+        s.sample(now=t)
+    # Window holds the rates of the last 4 intervals: 20, 30, 40, 50
+    assert s.percentile(b'eth9', 'rx_bytes', 0) == 20
+    assert s.percentile(b'eth9', 'rx_bytes', 100) == 50
+    assert s.percentile(b'eth9', 'rx_bytes', 50) in (30, 40)
@@ -0,0 +1,79 @@
+import errno
+
+import pytest
+
+from pynetlinux import context
+from pynetlinux import steering
+from tests.conftest import check_output
+
+
+def test_cpumask():
+    assert steering.parse_cpumask('00000008,00000003') == set([0, 1, 35])
+    assert steering.format_cpumask([0, 1, 35]) == '00000008,00000003'
+    assert steering.format_cpumask([]) == '00000000'
+    assert steering.parse_cpulist('0-2,5') == set([0, 1, 2, 5])
+    assert 0 in steering.online_cpus()
+
+
+def test_queues(mq_veth):
+    assert mq_veth.get_rx_queues() == [0, 1, 2, 3]
+    assert mq_veth.get_tx_queues() == [0, 1, 2, 3]
+
+
+def test_rps(mq_veth):
+    assert mq_veth.get_rps(1) == set()
+    assert mq_veth.set_rps(1, [0]) is True
+    assert mq_veth.get_rps(1) == set([0])
+    check_output(b'cat /sys/class/net/veth_test0/queues/rx-1/rps_cpus',
+                 regex=[b'^0*1$'])
+    assert mq_veth.set_rps(1, [0]) is False
+
+    assert mq_veth.set_rps_flow_cnt(1, 256) is True
+    assert mq_veth.get_rps_flow_cnt(1) == 256
+    assert mq_veth.set_rps_flow_cnt(1, 256) is False
+
+
+def test_xps(mq_veth):
+    assert mq_veth.set_xps(2, [0]) is True
+    assert mq_veth.get_xps(2) == set([0])
+    assert mq_veth.set_xps(2, [0]) is False
+
+
+def test_spread(mq_veth):
+    result = mq_veth.spread_queues([0])
+    assert sorted((a.kind, a.index) for a in result) == [
+        ('rps', 0), ('rps', 1), ('rps', 2), ('rps', 3),
+        ('xps', 0), ('xps', 1), ('xps', 2), ('xps', 3)]
+    assert all(a.cpus == set([0]) and a.error is None for a in result)
+    for queue in range(4):
+        assert mq_veth.get_rps(queue) == set([0])
+    # Already in effect: nothing is written
+    assert not any(a.changed for a in mq_veth.spread_queues([0]))
+
+
+def test_partition():
+    assert steering._partition(4, [0, 1]) == [set([0]), set([1]),
+                                             set([0]), set([1])]
+    assert steering._partition(2, [0, 1, 2, 3]) == [set([0, 1]), set([2, 3])]
+    with pytest.raises(ValueError):
+        steering._partition(2, [])
+
+
+def test_irqs(veth):
+    # veth has no device, so no interrupts
+    assert veth.get_irqs() == []
+    assert steering._classify('eth0-TxRx-3', ['eth0']) == ('combined', 3)
+    assert steering._classify('virtio3-input.0', ['eth0', 'virtio3']) == \
+        ('rx', 0)
+    assert steering._classify('virtio3-config', ['eth0', 'virtio3']) == \
+        (None, None)
+
+
+def test_netns_unsupported(mq_veth):
+    ctx = context.Context(netns=context.SELF_NETNS_PATH)
+    try:
+        with pytest.raises(IOError) as e:
+            steering.rx_queues(mq_veth.name, ctx)
+        assert e.value.errno == errno.EOPNOTSUPP
+    finally:
+        ctx.close()
@@ -1,11 +1,15 @@
 import binascii
 import codecs
+import os
 import pytest
 import select
 import socket
 import struct
+import time
 
 
+from pynetlinux import bpf
+from pynetlinux import brctl
 from pynetlinux import tap
 from pynetlinux import ifconfig
 from tests.conftest import check_output
@@ -79,3 +83,439 @@ def test_tap_read():
         assert r, 'did not receive expected packet - timed out'
         if t.fd.read(1500) == packet:
             break
+
+
+def _send_flows(name, count):
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                      socket.htons(ETH_P_ALL))
+    s.bind((name.decode('ascii'), ETH_P_ALL))
+    sent = []
+    for i in range(count):
+        # Distinct IPv4 source addresses, so the frames hash to many queues
+        ip = (b'\x45\x00\x00\x1c\x00\x00\x00\x00\x40\x11\x00\x00' +
+              struct.pack('!I', 0x0a000000 + i) + b'\x0a\xff\x00\x01' +
+              struct.pack('!HHHH', 1000 + i, 9, 8, 0))
+        frame = b'\xde\xad\xbe\xef\xde\xad\x00\x11"3DU\x08\x00' + ip
+        s.send(frame)
+        sent.append(frame)
+    s.close()
+    return sent
+
+
+def _frames(t, count):
+    tap_mac = b''.join(codecs.decode(i, 'hex') for i in t.mac.split(':'))
+    return [tap_mac + b'\x00\x11"3DU\x90\x00fake payload %d' % i
+            for i in range(count)]
+
+
+def test_multiqueue_create():
+    t = tap.MultiQueueTap(queues=4)
+    try:
+        assert len(t.queues) == 4
+        assert len(set(q.fileno() for q in t.queues)) == 4
+        check_output(b'ip -d link show ' + t.name, substr=[b'multi_queue'])
+        q = t.add_queue()
+        assert q.index == 4 and len(t.queues) == 5
+        q.detach()
+        assert not q.attached
+        q.attach()
+    finally:
+        t.close()
+    assert ifconfig.findif(t.name, physical=False) is None
+
+    with pytest.raises(ValueError):
+        tap.MultiQueueTap(queues=0)
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_queue_workers(processes):
+    t = tap.MultiQueueTap(queues=4)
+    t.up()
+    if processes:
+        import multiprocessing
+        received = multiprocessing.Queue()
+        handler = lambda queue, frame: received.put((queue.index, frame))
+    else:
+        import queue as queue_module
+        received = queue_module.Queue()
+        handler = lambda queue, frame: received.put((queue.index, frame))
+    try:
+        with tap.QueueWorkers(t, handler, processes=processes):
+            sent = _send_flows(t.name, 32)
+            frames = []
+            used = set()
+            while len(frames) < len(sent):
+                index, frame = received.get(timeout=3)
+                used.add(index)
+                if frame in sent:
+                    frames.append(frame)
+            assert sorted(frames) == sorted(sent)
+            assert len(used) > 1
+    finally:
+        t.close()
+
+
+def test_queue_workers_stop_timeout():
+    import threading
+    t = tap.MultiQueueTap(queues=2)
+    t.up()
+    busy = threading.Event()
+    release = threading.Event()
+
+    def handler(queue, frame):
+        busy.set()
+        release.wait()
+
+    try:
+        workers = tap.QueueWorkers(t, handler).start()
+        _send_flows(t.name, 1)
+        assert busy.wait(3)
+        workers.stop(timeout=0.1)
+        # The busy worker still polls the pipe, so it is left open
+        assert workers.workers
+        os.fstat(workers._stop_r)
+        release.set()
+        workers.stop()
+        assert workers.workers == [] and workers._stop_r is None
+    finally:
+        release.set()
+        t.close()
+
+
+def test_read_batch():
+    t = tap.Tap(blocking=False)
+    t.up()
+    try:
+        t.read_batch()  # anything sent as the tap came up
+        pool = tap.FramePool(4, t.mtu + tap.FRAME_OVERHEAD)
+        assert t.read_batch(pool) == []
+        sent = _send_flows(t.name, 6)
+        frames = [bytes(f) for f in t.read_batch(pool)]
+        # At most one frame per slot; the rest wait for the next call
+        assert len(frames) == 4
+        for _i in range(10):
+            if len([f for f in frames if f in sent]) == len(sent):
+                break
+            frames += [bytes(f) for f in t.read_batch(pool)]
+        assert [f for f in frames if f in sent] == sent
+
+        buf = bytearray(2048)
+        while t.readinto(buf) is not None:
+            pass
+        frame = _send_flows(t.name, 1)[0]
+        while True:
+            n = t.readinto(buf)
+            assert n is not None, 'did not receive expected packet'
+            if buf[:n] == frame:
+                break
+    finally:
+        t.close()
+
+
+def test_read_batch_blocking():
+    t = tap.Tap()
+    t.up()
+    try:
+        sent = _send_flows(t.name, 3)
+        frames = []
+        while len(frames) < 3:
+            frames += [bytes(f) for f in t.read_batch() if bytes(f) in sent]
+        assert frames == sent
+    finally:
+        t.close()
+
+
+def test_write_batch():
+    t = tap.Tap()
+    t.up()
+    try:
+        pre_stats = t.get_stats()
+        frames = _frames(t, 3)
+        assert t.write_batch([frames[0], bytearray(frames[1]),
+                              memoryview(frames[2])]) == 3
+        assert t.writev([frames[0][:14], memoryview(frames[0])[14:]]) == \
+            len(frames[0])
+        post_stats = t.get_stats()
+        assert post_stats['rx_packets'] == pre_stats['rx_packets'] + 4
+        assert post_stats['rx_bytes'] == (pre_stats['rx_bytes'] +
+                                          sum(map(len, frames)) +
+                                          len(frames[0]))
+    finally:
+        t.close()
+
+
+def test_vnet_hdr_offload():
+    t = tap.Tap(vnet_hdr=True, blocking=False)
+    t.up()
+    try:
+        t.set_offload(tap.TUN_F_CSUM | tap.TUN_F_TSO4 | tap.TUN_F_TSO6)
+        features = t.get_features()
+        assert features['tx-tcp-segmentation'].active
+        assert features['tx-checksum-ip-generic'].active
+        assert t.frame_pool(1).frame_size >= 65536
+
+        # A 20KB TCP superframe, segmented and checksummed by the kernel
+        tap_mac = b''.join(codecs.decode(i, 'hex') for i in t.mac.split(':'))
+        payload = b'x' * 20000
+        tcp = struct.pack('!HHIIBBHHH', 1234, 80, 1, 0, 5 << 4, 0x18, 65535,
+                          0, 0)
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40 + len(payload), 0,
+                         0x4000, 64, 6, 0, socket.inet_aton('10.1.1.1'),
+                         socket.inet_aton('10.1.1.2'))
+        frame = tap_mac + b'\x00\x11"3DU\x08\x00' + ip + tcp + payload
+        hdr = tap.VnetHdr(tap.VIRTIO_NET_HDR_F_NEEDS_CSUM,
+                          tap.VIRTIO_NET_HDR_GSO_TCPV4, 54, 1448, 34, 16)
+        pre_stats = t.get_stats()
+        assert t.write_vnet(frame, hdr) == tap.VIRTIO_NET_HDR.size + len(frame)
+        post_stats = t.get_stats()
+        assert post_stats['rx_packets'] == pre_stats['rx_packets'] + 1
+        assert post_stats['rx_bytes'] == pre_stats['rx_bytes'] + len(frame)
+
+        t.read_batch()  # anything sent as the tap came up
+        sent = _send_flows(t.name, 2)
+        received = []
+        while len(received) < 2:
+            r, _, _ = select.select([t], [], [], 3)
+            assert r, 'did not receive expected packet - timed out'
+            hdr, frame = t.read_vnet()
+            if frame in sent:
+                # Sent whole and without checksum offload
+                assert hdr == tap.NO_VNET_HDR
+                received.append(frame)
+        assert received == sent
+
+        _send_flows(t.name, 1)
+        select.select([t], [], [], 3)
+        hdr, frame = tap.split_vnet_hdr(t.read_batch()[0])
+        assert isinstance(hdr, tap.VnetHdr)
+    finally:
+        t.close()
+
+
+def test_offload_needs_vnet_hdr():
+    t = tap.Tap()
+    try:
+        with pytest.raises(ValueError):
+            t.set_offload(tap.TUN_F_CSUM)
+        t.set_offload(0)
+    finally:
+        t.close()
+
+
+def _send_raw(name, frames):
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+    s.bind((name.decode('ascii'), 0))
+    for frame in frames:
+        s.send(frame)
+    s.close()
+
+
+def test_tap_filter():
+    t = tap.Tap(blocking=False)
+    t.up()
+    try:
+        t.attach_filter(bpf.build_filter(ethertypes=[0x88b5]))
+        t.read_batch()  # anything sent as the tap came up
+        header = b'\x02\xad\xbe\xef\xde\xad\x00\x11"3DU'
+        wanted = [header + b'\x88\xb5plain',
+                  header + b'\x81\x00\x00\x07\x88\xb5tagged']
+        _send_flows(t.name, 3)  # IPv4
+        _send_raw(t.name, wanted)
+        select.select([t], [], [], 3)
+        assert [bytes(f) for f in t.read_batch()] == wanted
+
+        t.attach_filter(bpf.build_filter(vlans=[7], drop_multicast=True,
+                                         src_macs=['00:11:22:33:44:55']))
+        _send_raw(t.name, [
+            b'\x01' + header[1:] + b'\x81\x00\x00\x07\x88\xb5multicast',
+            header + b'\x81\x00\x00\x08\x88\xb5vlan 8',
+            header[:11] + b'\x56\x81\x00\x00\x07\x88\xb5other source',
+            header + b'\x88\xb5untagged',
+            header + b'\x81\x00\x20\x07\x88\xb5vlan 7'])
+        select.select([t], [], [], 3)
+        assert [bytes(f) for f in t.read_batch()] == \
+            [header + b'\x81\x00\x20\x07\x88\xb5vlan 7']
+
+        t.detach_filter()
+        assert t.filter is None
+        sent = _send_flows(t.name, 1)
+        select.select([t], [], [], 3)
+        assert sent[0] in [bytes(f) for f in t.read_batch()]
+    finally:
+        t.close()
+
+
+def test_multiqueue_steering():
+    t = tap.MultiQueueTap(queues=4, blocking=False)
+    t.up()
+    try:
+        # Every frame to queue 6 % 4
+        fd = bpf.load_program(
+            bpf.ebpf_insn(bpf.BPF_ALU64 | bpf.BPF_MOV | bpf.BPF_K,
+                          bpf.BPF_REG_0, imm=6) +
+            bpf.ebpf_insn(bpf.BPF_JMP | bpf.BPF_EXIT))
+        t.set_steering_program(fd)
+        os.close(fd)
+        for q in t.queues:
+            q.read_batch()
+        sent = _send_flows(t.name, 16)
+        time.sleep(0.1)
+        counts = [len([f for f in q.read_batch() if bytes(f) in sent])
+                  for q in t.queues]
+        assert counts == [0, 0, 16, 0]
+
+        t.set_steering_program(None)
+        sent = _send_flows(t.name, 16)
+        time.sleep(0.1)
+        counts = [len([f for f in q.read_batch() if bytes(f) in sent])
+                  for q in t.queues]
+        assert sum(counts) == 16 and max(counts) < 16
+    finally:
+        t.close()
+
+
+def test_multiqueue_vlan_steering():
+    # A tap bridged to the multiqueue tap. Tagged frames written to it are
+    # untagged into skb->vlan_tci on receive, which the program reads.
+    br = brctl.addbr(b'steertestbr0')
+    t = tap.Tap()
+    mq = tap.MultiQueueTap(queues=4, blocking=False)
+    try:
+        br.up()
+        br.addif(t)
+        br.addif(mq)
+        t.up()
+        mq.up()
+        fd = bpf.load_program(bpf.vlan_steering_program())
+        mq.set_steering_program(fd)
+        os.close(fd)
+        for q in mq.queues:
+            q.read_batch()
+        header = b'\x02\x00\x00\x00\x00\x09\x02\x00\x00\x00\x00\x08'
+        sent = {}
+        for vid in [0, 1, 2, 3, 5, 6, 4095]:
+            tag = struct.pack('!HH', 0x8100, vid) if vid else b''
+            frame = header + tag + b'\x88\xb5vlan %d' % vid
+            t.write(frame)
+            sent[frame] = vid % 4
+        time.sleep(0.1)
+        received = {}
+        for q in mq.queues:
+            for frame in q.read_batch():
+                if bytes(frame) in sent:
+                    received[bytes(frame)] = q.index
+        assert received == sent
+    finally:
+        t.close()
+        mq.close()
+        br.delete()
+
+
+def _wait_available(pool, count):
+    for _i in range(100):
+        if pool.stats().available == count:
+            return
+        time.sleep(0.02)
+    assert pool.stats().available == count
+
+
+def _close_pool(pool):
+    # Taps still handed out (e.g. after a failed assertion) stay persistent
+    for name in list(pool._in_use):
+        pool.release(name)
+    pool.close()
+
+
+def test_tap_pool():
+    pool = tap.TapPool(size=2, template=b'pooltap%d', mtu=1400, owner=65534,
+                       group=65534, up=True)
+    try:
+        assert len(pool) == 2
+        a, b = pool.acquire(), pool.acquire()
+        assert a.name != b.name
+        check_output(b'ip -d link show ' + a.name,
+                     substr=[b'mtu 1400', b'persist on'], regex=[b'<[^>]*UP'])
+        check_output(b'cat /sys/class/net/%s/owner /sys/class/net/%s/group' %
+                     (a.name, a.name), substr=[b'65534\n65534'])
+        # Topped back up in the background
+        _wait_available(pool, 2)
+        stats = pool.stats()
+        assert (stats.hits, stats.misses, stats.created) == (2, 0, 4)
+        assert stats.in_use == 2 and stats.hit_rate == 1.0
+        assert 0 < stats.latency_p50 <= stats.latency_p99 <= stats.latency_max
+
+        # The pool is full, so released taps are deleted
+        pool.release(a)
+        pool.release(b.name)
+        assert pool.stats().destroyed == 2
+        assert ifconfig.findif(a.name, physical=False) is None
+    finally:
+        names = list(pool._free)
+        _close_pool(pool)
+    assert all(ifconfig.findif(n, physical=False) is None for n in names)
+
+
+def test_tap_pool_miss_and_reclaim():
+    pool = tap.TapPool(size=1, low=0, template=b'pooltest%d', background=False)
+    try:
+        a = pool.acquire()
+        b = pool.acquire()
+        assert a.name.startswith(b'pooltest')
+        stats = pool.stats()
+        assert (stats.hits, stats.misses, stats.available) == (1, 1, 0)
+        assert stats.hit_rate == 0.5
+
+        b.up()
+        pool.release(b)
+        assert len(pool) == 1 and pool.stats().reclaimed == 1
+        assert not b.is_up()    # reset
+        assert pool.acquire().name == b.name
+
+        # A tap that has gone away is not taken back
+        pool.release(b'pooltest_gone')
+        assert pool.stats().errors == 1 and len(pool) == 0
+
+        pool.release(a)
+        pool.release(b)
+        stats = pool.stats()
+        assert (stats.reclaimed, stats.destroyed) == (2, 1)
+    finally:
+        _close_pool(pool)
+
+
+def test_tap_pool_reserves_slots():
+    pool = tap.TapPool(size=1, low=0, template=b'pooltest%d', background=False)
+    try:
+        a = pool.acquire()
+        create = pool._create
+
+        def create_racing_release():
+            # A release() while replenish() is creating a tap for the
+            # last free slot
+            pool.release(a)
+            return create()
+
+        pool._create = create_racing_release
+        assert pool.replenish() == 1
+        assert len(pool) == 1
+        stats = pool.stats()
+        assert (stats.reclaimed, stats.destroyed) == (0, 1)
+    finally:
+        _close_pool(pool)
+
+
+def test_tap_pool_bridge():
+    br = brctl.addbr(b'pooltestbr0')
+    try:
+        pool = tap.TapPool(size=1, template=b'pooltest%d', bridge=br,
+                           background=False)
+        try:
+            iface = pool.acquire()
+            assert br.listif() == [iface.name]
+            pool.release(iface)
+            assert br.listif() == [iface.name]
+        finally:
+            _close_pool(pool)
+        assert br.listif() == []
+    finally:
+        br.delete()